@@ -0,0 +1,305 @@
+"""Writes synthetic catalogues in the CSV format library/adapters/csv_data_importer.py reads.
+
+    python -m benchmarks.catalogue DIRECTORY [--books N] [--seed N] [--skew S] [--authors N] [--publishers N]
+                                             [--users N] [--reviews N]
+
+The same sizes, seed and skew always give the same files. The quirks of the bundled files are kept: a byte order
+mark (except in users.csv, which also has no final line break), a books.csv header padded with blank genre columns,
+rows with one to MAX_GENRES genres padded to the header's width, and quoted descriptions with commas and several
+paragraphs, separated by a literal \\n as in the bundled file or, in a few, by real line breaks.
+
+Popularity is skewed as in real catalogues, following Zipf's law with exponent --skew: a few genres are given to
+most books, a few authors write many books each while most write one or two, and a few books and users account for
+most reviews. Rows are generated in batches, from pools of texts made up front; a million books (with their
+authors, publishers and half a million reviews) take well under a minute.
+"""
+import argparse
+import csv
+import io
+import random
+from itertools import accumulate
+from pathlib import Path
+
+GENRES = [
+    'Crime', 'Suspense', 'Thriller', 'Mystery', 'Zombies', 'Fiction', 'Espionage', 'Reality', 'Dark', 'Magical',
+    'Russia', 'Humour', 'Romance', 'History', 'Science', 'Travel', 'Poetry', 'Horror', 'Fantasy', 'Biography'
+]
+
+WORDS = [
+    'house', 'memory', 'fear', 'darkness', 'bay', 'art', 'game', 'night', 'river', 'letter', 'garden', 'silence',
+    'winter', 'stranger', 'island', 'secret', 'mirror', 'road', 'city', 'storm', 'shadow', 'glass', 'fire', 'sea'
+]
+
+FIRST_NAMES = [
+    'James', 'Aya', 'Frank', 'Clare', 'Alix', 'Brigid', 'Tomas', 'Mei', 'Oliver', 'Ngaio', 'Ruth', 'Hemi', 'Ines',
+    'Yusuf', 'Greta', 'Pita', 'Sofia', 'Arjun', 'Lena', 'Marcus'
+]
+
+SURNAMES = [
+    'Reiner', 'Bostock', 'Gohre', 'Randell', 'London', 'Quinn', 'Marsh', 'Tanaka', 'Okafor', 'Novak', 'Duval',
+    'Henare', 'Kowalski', 'Silva', 'Brandt', 'Moana', 'Ricci', 'Patel', 'Lindqvist', 'Hughes'
+]
+
+IMAGE_URLS = [
+    'https://images.gr-assets.com/books/{}m/{}.jpg',
+    'https://s.gr-assets.com/assets/nophoto/book/111x148-bcc042a9c91a29c1d680899eff700a03.png',
+]
+
+# Changed whenever the same size and seed give different files, so that cached catalogues are written again.
+VERSION = 2
+
+MAX_GENRES = 3
+
+# The share of descriptions whose paragraphs are split by real line breaks, rather than the literal \n.
+MULTILINE_DESCRIPTIONS = 0.05
+
+BATCH_SIZE = 10000
+
+
+def catalogue_sizes(books: int):
+    # Authors, publishers, users and reviews grow with the number of books. Few users: each is hashed on load.
+    return {
+        'authors': max(1, books // 10),
+        'publishers': max(1, books // 100),
+        'users': min(50, max(1, books // 100)),
+        'reviews': books // 2,
+    }
+
+
+def zipf_weights(count: int, skew: float):
+    """ Cumulative weights for random.choices, giving the item of rank k a weight of 1 / k**skew. """
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def write_catalogue(directory, books: int, seed: int = 235, skew: float = 1.0, **sizes):
+    """ Writes authors.csv, publishers.csv, books.csv, users.csv and reviews.csv to the directory.
+
+    The numbers of authors, publishers, users and reviews default to catalogue_sizes(books) and may be given as
+    keyword arguments instead.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    sizes = dict(catalogue_sizes(books), **sizes)
+    rng = random.Random(seed)
+    texts = _Texts(rng)
+
+    with _writer(directory / 'authors.csv') as writer:
+        writer.writerow(['author_id', 'author_full_name'])
+        writer.writerows(_batched(sizes['authors'], lambda first, count: _authors(rng, first, count)))
+
+    with _writer(directory / 'publishers.csv') as writer:
+        writer.writerow(['publisher_id', 'publisher_name'])
+        writer.writerows(_batched(sizes['publishers'], lambda first, count: _publishers(rng, texts, first, count)))
+
+    with _writer(directory / 'books.csv') as writer:
+        writer.writerow(['book_id', 'release_year', 'title', 'publisher', 'author_id', 'description', 'image_url'] +
+                        [''] * MAX_GENRES)
+        # Which ids are popular is shuffled, so that popularity does not follow the ids.
+        popular = {
+            'genres': (rng.sample(GENRES, len(GENRES)), zipf_weights(len(GENRES), skew)),
+            'authors': (_ranked_ids(rng, sizes['authors']), zipf_weights(sizes['authors'], skew)),
+            'publishers': (_ranked_ids(rng, sizes['publishers']), zipf_weights(sizes['publishers'], skew)),
+        }
+        writer.writerows(_batched(books, lambda first, count: _books(rng, texts, first, count, popular)))
+
+    with _writer(directory / 'users.csv', bom=False, final_newline=False) as writer:
+        writer.writerow(['id', 'username', 'password'])
+        writer.writerows(_batched(sizes['users'], _users))
+
+    with _writer(directory / 'reviews.csv') as writer:
+        writer.writerow(['user-id', 'book-id', 'review-text', 'rating'])
+        popular = {
+            'books': (_ranked_ids(rng, books), zipf_weights(books, skew)),
+            'users': (_ranked_ids(rng, sizes['users']), zipf_weights(sizes['users'], skew)),
+        }
+        writer.writerows(_batched(sizes['reviews'], lambda first, count: _reviews(rng, texts, count, popular)))
+
+    return directory
+
+
+class _Texts:
+    """ Pools of titles, descriptions and review texts, which rows pick from many at a time.
+
+    Drawing every word of every row costs several random numbers per word; picking whole texts from a few thousand
+    made up front costs one per row, which is what makes millions of rows quick to write.
+    """
+
+    POOL_SIZE = 4096
+
+    def __init__(self, rng: random.Random):
+        self.titles = [_title(rng, rng.randint(1, 4)) for _ in range(self.POOL_SIZE)]
+        self.descriptions = [_escaped(_description(rng)) for _ in range(self.POOL_SIZE)]
+        self.reviews = [_escaped(_review_text(rng)) for _ in range(self.POOL_SIZE)]
+
+    def pick(self, rng: random.Random, pool: str, count: int):
+        return rng.choices(getattr(self, pool), k=count)
+
+
+def _batched(total: int, make_rows):
+    # Rows are made BATCH_SIZE at a time, so that random.choices can draw many values per call.
+    for first in range(1, total + 1, BATCH_SIZE):
+        yield from make_rows(first, min(BATCH_SIZE, total + 1 - first))
+
+
+def _ranked_ids(rng: random.Random, count: int):
+    ids = list(range(1, count + 1))
+    rng.shuffle(ids)
+    return ids
+
+
+def _popular(rng: random.Random, popular, kind: str, count: int):
+    population, cum_weights = popular[kind]
+    return rng.choices(population, cum_weights=cum_weights, k=count)
+
+
+def _authors(rng: random.Random, first: int, count: int):
+    first_names = rng.choices(FIRST_NAMES, k=count)
+    surnames = rng.choices(SURNAMES, k=count)
+    # Numbered, so that names stay distinct however many authors there are.
+    return ([author_id, f'{first_name} {surname} {author_id}']
+            for author_id, first_name, surname in zip(range(first, first + count), first_names, surnames))
+
+
+def _publishers(rng: random.Random, texts: _Texts, first: int, count: int):
+    names = rng.choices(texts.titles, k=count)
+    return ([publisher_id, f'{name} Press {publisher_id}']
+            for publisher_id, name in zip(range(first, first + count), names))
+
+
+def _books(rng: random.Random, texts: _Texts, first: int, count: int, popular):
+    columns = zip(
+        range(first, first + count),
+        rng.choices(range(1900, 2022), k=count),
+        texts.pick(rng, 'titles', count),
+        _popular(rng, popular, 'publishers', count),
+        _popular(rng, popular, 'authors', count),
+        texts.pick(rng, 'descriptions', count),
+        rng.choices((True, False), weights=(3, 7), k=count),
+        _genres(rng, popular, count),
+    )
+    return ([book_id, year, title, publisher, author, description, _image_url(book_id, no_photo)] + genres
+            for book_id, year, title, publisher, author, description, no_photo, genres in columns)
+
+
+def _genres(rng: random.Random, popular, count: int):
+    # One to MAX_GENRES distinct genres per book, padded with blank columns to the header's width.
+    wanted = rng.choices(range(1, MAX_GENRES + 1), weights=(5, 3, 2), k=count)
+    drawn = iter(_popular(rng, popular, 'genres', count * MAX_GENRES))
+    for number in wanted:
+        genres = list(dict.fromkeys(next(drawn) for _ in range(MAX_GENRES)))[:number]
+        yield genres + [''] * (MAX_GENRES - len(genres))
+
+
+def _users(first: int, count: int):
+    return ([user_id, f'reader{user_id}', f'Password{user_id}'] for user_id in range(first, first + count))
+
+
+def _reviews(rng: random.Random, texts: _Texts, count: int, popular):
+    # Ratings lean towards the top of the scale, as they do on review sites.
+    columns = zip(
+        _popular(rng, popular, 'users', count),
+        _popular(rng, popular, 'books', count),
+        texts.pick(rng, 'reviews', count),
+        rng.choices(range(1, 6), weights=(1, 2, 4, 6, 5), k=count),
+    )
+    return ([user, book, text, rating] for user, book, text, rating in columns)
+
+
+def _description(rng: random.Random):
+    kind = rng.random()
+    if kind < 0.1:
+        return rng.choice(['No description', 'Bad book no publisher', ''])
+    paragraphs = [_sentences(rng, rng.randint(1, 3)) for _ in range(rng.randint(1, 3))]
+    separator = '\n' if kind > 1 - MULTILINE_DESCRIPTIONS else '\\n'
+    return separator.join(paragraphs)
+
+
+def _sentences(rng: random.Random, count: int):
+    # Commas in most sentences, so that most descriptions are quoted.
+    return ' '.join(
+        f'{_words(rng, rng.randint(2, 8)).capitalize()}, {_words(rng, rng.randint(2, 10))}.' for _ in range(count)
+    )
+
+
+def _review_text(rng: random.Random):
+    if rng.random() < 0.3:
+        return f'{_words(rng, rng.randint(2, 6)).capitalize()}, {_words(rng, rng.randint(2, 24))}!'
+    return _words(rng, rng.randint(2, 30)).capitalize() + '!'
+
+
+def _image_url(book_id: int, no_photo: bool):
+    if no_photo:
+        return IMAGE_URLS[1]
+    return IMAGE_URLS[0].format(1300000000 + book_id, 20000000 + book_id)
+
+
+def _title(rng: random.Random, words: int):
+    return ' '.join(word.capitalize() for word in rng.choices(WORDS, k=words))
+
+
+def _words(rng: random.Random, count: int):
+    return ' '.join(rng.choices(WORDS, k=count))
+
+
+def _writer(path: Path, bom: bool = True, final_newline: bool = True):
+    return _CsvFile(path, bom, final_newline)
+
+
+class _CsvFile:
+    """ Writes rows of fields that are already CSV-escaped (see _escaped); csv.writer spends most of its time
+    scanning long descriptions for characters to quote. """
+
+    def __init__(self, path: Path, bom: bool, final_newline: bool):
+        self.__path = path
+        # utf-8-sig encodes in Python, a write at a time; the byte order mark is written by hand instead.
+        self.__file = open(path, 'w', encoding='utf-8', newline='', buffering=1 << 20)
+        self.__final_newline = final_newline
+        if bom:
+            # The bundled files start with a byte order mark, except users.csv.
+            self.__file.write('\ufeff')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__file.close()
+        if exc_type is None and not self.__final_newline:
+            # The bundled users.csv does not end with a line break.
+            with open(self.__path, 'rb+') as outfile:
+                outfile.seek(-1, 2)
+                outfile.truncate()
+
+    def writerow(self, row):
+        self.__file.write(','.join(map(str, row)) + '\n')
+
+    def writerows(self, rows):
+        self.__file.writelines(','.join(map(str, row)) + '\n' for row in rows)
+
+
+def _escaped(text: str):
+    # As csv.writer would write the text as a field: quoted if it holds a comma, quote or line break.
+    if text == '':
+        return text
+    field = io.StringIO()
+    csv.writer(field, lineterminator='').writerow([text])
+    return field.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic catalogue of CSV files.')
+    parser.add_argument('directory', type=Path)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=235)
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf's law exponent of genre, author and review "
+                                                                'popularity (0 for none)')
+    for entity in ('authors', 'publishers', 'users', 'reviews'):
+        parser.add_argument(f'--{entity}', type=int, help=f'number of {entity} (default: grows with --books)')
+    args = parser.parse_args()
+
+    sizes = {entity: getattr(args, entity) for entity in ('authors', 'publishers', 'users', 'reviews')
+             if getattr(args, entity) is not None}
+    write_catalogue(args.directory, args.books, args.seed, args.skew, **sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""Load-tests the application end to end: simulated users browse, log in and post reviews through the HTTP routes.
+
+Run from the project root:
+
+    python -m benchmarks.load_test [--target test-client|server|URL] [--repository memory|database] [--books N]
+                                   [--users N] [--duration SECONDS] [--journeys year=4,genre=3,login=1,review=2]
+                                   [--output FILE] [--baseline FILE] [--threshold PERCENT]
+
+Each of --users simulated users (a thread) keeps picking a journey, weighted by --journeys, and following it:
+
+    year    the release year pages: the first year, a few Next links, a Previous link, and a book's reviews
+    genre   the list of genres, one genre, and a few of its pages
+    login   the login form, then logging in as a user from users.csv, then the home page
+    review  logging in if need be, the review form for a book on a year page, then posting a review
+
+Links are taken from the pages, as a browser would, and forms are posted with their CSRF token. Requests are
+grouped by method and route (the path without its query string); for each, the number of requests, requests per
+second, p50/p90/p99/max latency and the non-2xx/3xx responses are reported, then written as JSON, by default to
+benchmarks/results/load-<commit>.json. With --baseline, routes whose p50 or p99 latency grew by more than
+--threshold percent against an earlier results file are listed, and the exit status is 1 if there are any.
+
+Targets:
+    test-client  the application is built here and driven through Flask's test client, without sockets
+    server       the application is built here and served over HTTP on a free local port
+    URL          an application already running, e.g. http://localhost:5000 from python serve.py; it has to serve
+                 the catalogue --books (or the bundled one) describes, for the logins and links to work
+
+With --books N, a synthetic catalogue is used (see benchmarks.catalogue), cached under benchmarks/data like the
+repository suite's, database included. The application is otherwise built with its configured settings, except that
+login throttling is lifted, so that the simulated users are not refused for logging in too often.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from html import unescape
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from library import create_app
+from library.adapters.csv_data_importer import read_csv_file
+from library.server import PooledWSGIServer, stop_extensions
+from benchmarks.repository_suite import RESULTS_DIR, catalogue, commit_id, pristine_database
+from utils import get_project_root
+
+JOURNEYS = ('year', 'genre', 'login', 'review')
+
+LINK = re.compile(r"location\.href='([^']*)'\">(\w+)<")
+GENRE_LINK = re.compile(r'href="(/?books_by_genre\?genre=[^"]+)"')
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class Response:
+    def __init__(self, status: int, text: str, location: str = None):
+        self.status = status
+        self.text = text
+        self.location = location
+
+
+class FlaskClientSession:
+    """ A user's cookies and requests, through Flask's test client. """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, form=None):
+        try:
+            response = self.client.open(path, method=method, data=form)
+        except Exception:
+            # In debug mode the application's exceptions reach the test client; a server would answer 500.
+            logging.getLogger(__name__).exception('%s %s failed', method, path)
+            return Response(500, '')
+        location = response.headers.get('Location')
+        return Response(response.status_code, response.get_data(as_text=True),
+                        urlsplit(location)._replace(scheme='', netloc='').geturl() if location else None)
+
+    def close(self):
+        pass
+
+
+class HttpSession:
+    """ A user's cookies and requests, over a kept-alive HTTP connection. """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.connection = None
+        self.cookies = SimpleCookie()
+
+    def request(self, method: str, path: str, form=None):
+        headers = dict()
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={morsel.value}' for name, morsel in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                text = response.read().decode('utf-8', 'replace')
+                break
+            except (OSError, http.client.HTTPException):
+                # The server may close a kept-alive connection; try once more on a new one.
+                self.close()
+                if attempt == 2:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        location = response.headers.get('Location')
+        return Response(response.status, text,
+                        urlsplit(location)._replace(scheme='', netloc='').geturl() if location else None)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class VirtualUser:
+    """ Follows journeys through the site, timing every request by route. """
+
+    def __init__(self, session, rng: random.Random, credentials):
+        self.session = session
+        self.rng = rng
+        self.credentials = credentials
+        self.logged_in = False
+        self.recording = False
+        self.latencies = dict()  # route -> list of seconds
+        self.failures = dict()  # route -> Counter of statuses (0 for a connection error)
+
+    def request(self, method: str, path: str, form=None):
+        route = f'{method} {urlsplit(path).path}'
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, path, form)
+        except (OSError, http.client.HTTPException):
+            response = Response(0, '')
+        elapsed = time.perf_counter() - start
+        if self.recording:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not 200 <= response.status < 400:
+                self.failures.setdefault(route, Counter())[response.status] += 1
+        return response
+
+    def links(self, page: Response, label: str):
+        return [unescape(url) for url, text in LINK.findall(page.text) if text == label]
+
+    def follow(self, page: Response, label: str):
+        links = self.links(page, label)
+        return self.request('GET', links[0]) if links else None
+
+    def year(self):
+        page = self.request('GET', '/books_by_release_year')
+        for _ in range(self.rng.randint(1, 5)):
+            page = self.follow(page, 'Next') or page
+        page = self.follow(page, 'Previous') or page
+        reviews = [url for url in (unescape(url) for url, _ in LINK.findall(page.text)) if 'view_reviews_for' in url]
+        if reviews:
+            self.request('GET', self.rng.choice(reviews))
+
+    def genre(self):
+        page = self.request('GET', '/list_of_genres')
+        genres = GENRE_LINK.findall(page.text)
+        if not genres:
+            return
+        page = self.request('GET', '/' + unescape(self.rng.choice(genres)).lstrip('/'))
+        for _ in range(self.rng.randint(0, 4)):
+            page = self.follow(page, 'Next')
+            if page is None:
+                break
+
+    def login(self):
+        form = self.request('GET', '/authentication/login')
+        user_name, password = self.rng.choice(self.credentials)
+        response = self.request('POST', '/authentication/login', {
+            'csrf_token': _csrf_token(form), 'user_name': user_name, 'password': password
+        })
+        self.logged_in = response.status == 302
+        if self.logged_in:
+            self.request('GET', response.location)
+
+    def review(self):
+        if not self.logged_in:
+            self.login()
+        page = self.request('GET', '/books_by_release_year')
+        for _ in range(self.rng.randint(0, 3)):
+            page = self.follow(page, 'Next') or page
+        books = self.links(page, 'Review')
+        if not books:
+            return
+        form = self.request('GET', self.rng.choice(books))
+        if form.status != 200:
+            # Logged out, e.g. the session expired.
+            self.logged_in = False
+            return
+        book_id = re.search(r'name="book_id" type="hidden" value="(\d+)"', form.text)
+        response = self.request('POST', '/review', {
+            'csrf_token': _csrf_token(form), 'book_id': book_id.group(1) if book_id else '',
+            'review': 'A load test review of this book', 'review_rating': str(self.rng.randint(1, 5))
+        })
+        if response.status == 302:
+            self.request('GET', response.location)
+
+    def run(self, journeys, weights, until: float, recording_from: float):
+        while time.monotonic() < until:
+            self.recording = time.monotonic() >= recording_from
+            getattr(self, self.rng.choices(journeys, weights)[0])()
+        self.session.close()
+
+
+def _csrf_token(page: Response):
+    token = CSRF_TOKEN.search(page.text)
+    return token.group(1) if token else ''
+
+
+def credentials(data_path: Path):
+    # users.csv holds the passwords in the clear; they are hashed as the repository is populated.
+    return [(row[1], row[2]) for row in read_csv_file(str(data_path / 'users.csv'))]
+
+
+def build_app(repository: str, data_path: Path, database_path: Path = None):
+    config = {
+        'REPOSITORY': repository,
+        'TEST_DATA_PATH': data_path,
+        'LOGIN_RATE': 1e9, 'LOGIN_BURST': 10 ** 9, 'LOGIN_IP_RATE': 1e9, 'LOGIN_IP_BURST': 10 ** 9,
+    }
+    if database_path is not None:
+        config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    return create_app(config)
+
+
+def run(session_factory, users: int, journeys, weights, duration: float, warmup: float, credentials_list, seed: int):
+    start = time.monotonic()
+    virtual_users = [
+        VirtualUser(session_factory(), random.Random(seed + number), credentials_list) for number in range(users)
+    ]
+    threads = [
+        threading.Thread(target=user.run, args=(journeys, weights, start + warmup + duration, start + warmup))
+        for user in virtual_users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return virtual_users
+
+
+def summarise(virtual_users, duration: float):
+    latencies = dict()
+    failures = dict()
+    for user in virtual_users:
+        for route, samples in user.latencies.items():
+            latencies.setdefault(route, []).extend(samples)
+        for route, statuses in user.failures.items():
+            failures.setdefault(route, Counter()).update(statuses)
+
+    results = list()
+    for route in sorted(latencies):
+        samples = sorted(latencies[route])
+        results.append({
+            'route': route,
+            'requests': len(samples),
+            'requests_per_sec': round(len(samples) / duration, 2),
+            'p50_ms': round(_percentile(samples, 0.5) * 1000, 3),
+            'p90_ms': round(_percentile(samples, 0.9) * 1000, 3),
+            'p99_ms': round(_percentile(samples, 0.99) * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3),
+            'failures': {str(status): count for status, count in sorted(failures.get(route, {}).items())},
+        })
+    return results
+
+
+def _percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+
+def report(results, duration: float):
+    print(f'{"route":<40}{"requests":>9}{"req/s":>9}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}  failures')
+    for result in results:
+        failures = ', '.join(f'{status}: {count}' for status, count in result['failures'].items())
+        print(f'{result["route"]:<40}{result["requests"]:>9}{result["requests_per_sec"]:>9.1f}{result["p50_ms"]:>10.1f}'
+              f'{result["p90_ms"]:>10.1f}{result["p99_ms"]:>10.1f}{result["max_ms"]:>10.1f}  {failures}')
+    total = sum(result['requests'] for result in results)
+    print(f'{total} requests in {duration:.0f} s: {total / duration:.1f} requests/s')
+
+
+def compare(results, baseline_path: Path, threshold: float) -> bool:
+    """ Prints the routes whose p50 or p99 latency grew beyond the threshold; returns whether there are any. """
+    with open(baseline_path, encoding='utf-8') as infile:
+        baseline = {result['route']: result for result in json.load(infile)['results']}
+
+    regressed = False
+    print(f'Compared with {baseline_path} (threshold {threshold}%):')
+    for result in results:
+        before = baseline.get(result['route'])
+        if before is None:
+            continue
+        for statistic in ('p50_ms', 'p99_ms'):
+            if before[statistic] == 0:
+                continue
+            change = (result[statistic] - before[statistic]) / before[statistic] * 100
+            if change > threshold:
+                regressed = True
+                print(f'  {result["route"]:<40}{statistic[:3]} {before[statistic]:>9.1f} -> {result[statistic]:>9.1f} ms '
+                      f'({change:+.1f}%)')
+    if not regressed:
+        print('  no route got slower')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the application through its HTTP routes.')
+    parser.add_argument('--target', default='test-client', help='test-client, server or the URL of a running server')
+    parser.add_argument('--repository', default='memory', choices=('memory', 'database'))
+    parser.add_argument('--books', type=int, help='use a synthetic catalogue of this many books')
+    parser.add_argument('--seed', type=int, default=235)
+    parser.add_argument('--users', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of load before measuring')
+    parser.add_argument('--journeys', default='year=4,genre=3,login=1,review=2',
+                        help='journeys and their weights, from ' + ', '.join(JOURNEYS))
+    parser.add_argument('--output', type=Path, help='results file (default benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--baseline', type=Path, help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=20.0, help='percent latency growth reported')
+    args = parser.parse_args()
+
+    weights = dict(pair.split('=') for pair in args.journeys.split(','))
+    unknown = set(weights) - set(JOURNEYS)
+    if unknown:
+        parser.error(f'unknown journeys: {", ".join(sorted(unknown))}')
+    journeys = list(weights)
+    weights = [float(weight) for weight in weights.values()]
+
+    cat = catalogue(args.books, args.seed) if args.books else None
+    data_path = cat.directory if cat else get_project_root() / 'library' / 'adapters' / 'data'
+
+    app = None
+    server = None
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.target in ('test-client', 'server'):
+            database_path = None
+            if args.repository == 'database':
+                database_path = Path(work_dir) / 'library.db'
+                if cat is not None:
+                    # A copy of the populated database, which create_app then uses as it is.
+                    shutil.copyfile(pristine_database(cat)[0], database_path)
+            app = build_app(args.repository, data_path, database_path)
+
+        if args.target == 'test-client':
+            session_factory = lambda: FlaskClientSession(app)  # noqa: E731
+        else:
+            url = args.target
+            if args.target == 'server':
+                logging.getLogger('werkzeug').setLevel(logging.WARNING)
+                server = PooledWSGIServer('localhost', 0, app, threads=max(4, args.users))
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                url = f'http://localhost:{server.port}'
+            session_factory = lambda: HttpSession(url)  # noqa: E731
+
+        print(f'{args.users} users for {args.duration:.0f} s against {args.target} '
+              f'({args.repository} repository, {args.books or "bundled"} books)')
+        virtual_users = run(session_factory, args.users, journeys, weights, args.duration, args.warmup,
+                            credentials(data_path), args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.drain()
+        if app is not None:
+            stop_extensions(app)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = summarise(virtual_users, args.duration)
+    report(results, args.duration)
+
+    commit = commit_id()
+    output = args.output or RESULTS_DIR / f'load-{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as outfile:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'target': args.target,
+                'repository': args.repository,
+                'books': args.books,
+                'seed': args.seed,
+                'users': args.users,
+                'duration': args.duration,
+                'journeys': dict(zip(journeys, weights)),
+            },
+            'results': results,
+        }, outfile, indent=2)
+    print(f'Results written to {output}')
+
+    if args.baseline is not None and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Measures /books_by_genre latency while the server is flooded with login attempts.
+
+Run from the project root:
+
+    python -m benchmarks.login_storm [--hash-workers N] [--storm THREADS] [--requests N]
+
+The application (memory repository) is served by werkzeug's threaded server in this process. THREADS clients keep
+posting logins with a wrong password while one client times catalogue page views; p50/p99 of those are reported,
+with no storm first and then during it. Compare --hash-workers 0 (hashing on the request threads) with the
+default, which hashes in worker processes. Login throttling is lifted so every attempt reaches the hashing.
+"""
+import argparse
+import http.client
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from library import create_app
+import library.adapters.repository as repo
+import library.utilities.services as services
+from utils import get_project_root
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def time_page_views(port: int, path: str, count: int):
+    connection = http.client.HTTPConnection('localhost', port)
+    latencies = list()
+    for _ in range(count):
+        start = time.perf_counter()
+        connection.request('GET', path)
+        connection.getresponse().read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    return latencies
+
+
+def storm(port: int, stop: threading.Event, outcomes: dict):
+    connection = http.client.HTTPConnection('localhost', port)
+    body = urlencode({'user_name': 'thorke', 'password': 'NotThePassword1'})
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    while not stop.is_set():
+        connection.request('POST', '/authentication/login', body, headers)
+        status = connection.getresponse()
+        status.read()
+        outcomes[status.status] = outcomes.get(status.status, 0) + 1
+    connection.close()
+
+
+def report(label, latencies):
+    print(f'{label}: p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms '
+          f'over {len(latencies)} requests')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure catalogue latency during a login storm.')
+    parser.add_argument('--hash-workers', type=int, default=2, help='password hashing processes (0 = inline)')
+    parser.add_argument('--storm', type=int, default=8, help='concurrent login clients')
+    parser.add_argument('--requests', type=int, default=300, help='timed page views per phase')
+    args = parser.parse_args()
+
+    app = create_app({
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': get_project_root() / 'library' / 'adapters' / 'data',
+        'WTF_CSRF_ENABLED': False,
+        'FRAGMENT_CACHE_SIZE': 0,
+        'RESPONSE_CACHE': False,
+        'PASSWORD_HASH_WORKERS': args.hash_workers,
+        'PASSWORD_HASH_MAX_PENDING': max(1, args.hash_workers) * 4,
+        'LOGIN_RATE': 1e9, 'LOGIN_BURST': 10 ** 9, 'LOGIN_IP_RATE': 1e9, 'LOGIN_IP_BURST': 10 ** 9,
+    })
+    with app.app_context():
+        genre = services.get_genre_names(repo.repo_instance)[0]
+    path = '/books_by_genre?' + urlencode({'genre': genre})
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('localhost', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    time_page_views(port, path, 10)
+    report('idle', time_page_views(port, path, args.requests))
+
+    stop = threading.Event()
+    outcomes = dict()
+    clients = [threading.Thread(target=storm, args=(port, stop, outcomes)) for _ in range(args.storm)]
+    for client in clients:
+        client.start()
+    time.sleep(1)
+    report(f'login storm ({args.storm} clients)', time_page_views(port, path, args.requests))
+    stop.set()
+    for client in clients:
+        client.join()
+    print('login responses by status:', dict(sorted(outcomes.items())))
+
+    server.shutdown()
+    policy = app.extensions['password_policy']
+    if hasattr(policy, 'shutdown'):
+        policy.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Measures review screening throughput, in MB of review text per second.
+
+Run from the project root:
+
+    python -m benchmarks.moderation_throughput [--reviews N] [--length CHARS] [--baseline]
+
+Review texts are cut from the book descriptions in library/adapters/data/books.csv. --baseline also measures
+better_profanity on a sample, for comparison.
+"""
+import argparse
+import time
+
+from library.book.moderation import ProfanityFilter
+from utils import get_project_root
+
+
+def make_reviews(count: int, length: int):
+    with open(get_project_root() / 'library' / 'adapters' / 'data' / 'books.csv', encoding='utf-8-sig') as infile:
+        corpus = infile.read()
+    reviews = list()
+    offset = 0
+    while len(reviews) < count:
+        if offset + length > len(corpus):
+            offset = 0
+        reviews.append(corpus[offset:offset + length])
+        offset += length
+    return reviews
+
+
+def throughput(screen, reviews):
+    megabytes = sum(len(review.encode('utf-8')) for review in reviews) / 1e6
+    start = time.perf_counter()
+    screen(reviews)
+    return megabytes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure profanity screening throughput.')
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--length', type=int, default=500, help='characters per review')
+    parser.add_argument('--baseline', action='store_true', help='also measure better_profanity')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    profanity_filter = ProfanityFilter.from_default_wordlist()
+    print(f'compile word list: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    reviews = make_reviews(args.reviews, args.length)
+    print(f'ProfanityFilter: {throughput(profanity_filter.screen, reviews):.3f} MB/s')
+
+    if args.baseline:
+        from better_profanity import profanity
+        sample = reviews[:max(1, len(reviews) // 100)]
+        rate = throughput(lambda texts: [profanity.contains_profanity(text) for text in texts], sample)
+        print(f'better_profanity: {rate:.3f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Benchmarks every AbstractRepository method against MemoryRepository and SqlAlchemyRepository.
+
+Run from the project root:
+
+    python -m benchmarks.repository_suite [--sizes 10000,100000,1000000] [--repositories memory,database]
+                                          [--time SECONDS] [--output FILE] [--baseline FILE] [--threshold PERCENT]
+
+For each size, a synthetic catalogue is written with benchmarks.catalogue and loaded into each repository through
+repository_populate, as the application does. Catalogues and populated databases are kept under benchmarks/data,
+so later runs skip generating and populating them; each database run works on a copy. Every method is then called
+repeatedly with varying arguments for about --time seconds (at least once). For the database, each call gets a
+fresh session, as each request does. Reads run before writes, so writes do not change what the reads see.
+
+Results (ops/sec, p50/p99 latency, number of calls, population time) are printed and written as JSON, by default to
+benchmarks/results/repository-<commit>.json. With --baseline, methods whose ops/sec moved by more than --threshold
+percent against an earlier results file are listed, and the exit status is 1 if any got slower.
+
+A million-book catalogue takes a long time to populate into the database (once) and several GB of memory.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.pool import NullPool
+from werkzeug.security import generate_password_hash
+
+from benchmarks.catalogue import VERSION, write_catalogue, catalogue_sizes
+from library.adapters import memory_repository, database_repository, repository_populate
+from library.adapters.orm import metadata, map_model_to_tables
+from library.domain.model import Author, Book, Genre, Publisher, User, make_review
+from utils import get_project_root
+
+DATA_DIR = get_project_root() / 'benchmarks' / 'data'
+RESULTS_DIR = get_project_root() / 'benchmarks' / 'results'
+
+PASSWORD_HASH = generate_password_hash('Benchmark1', method='pbkdf2:sha256:1000')
+
+
+class Catalogue:
+    """ What the benchmarks pick their arguments from: the ids and names in a generated catalogue. """
+
+    def __init__(self, directory: Path, books: int, seed: int):
+        self.directory = directory
+        self.books = books
+        self.sizes = catalogue_sizes(books)
+        self.rng = random.Random(seed)
+        self.genre_names = _column(directory / 'books.csv', slice(7, None), distinct=True)
+        self.years = sorted({int(year) for year in _column(directory / 'books.csv', 1)})
+        self.author_names = _column(directory / 'authors.csv', 1)
+        self.publisher_names = _column(directory / 'publishers.csv', 1)
+        self.user_names = _column(directory / 'users.csv', 1)
+        self.__next_id = 0
+
+    def book_id(self):
+        return self.rng.randint(1, self.books)
+
+    def new_id(self):
+        # Ids (and names) for added entities, clear of the generated ones.
+        self.__next_id += 1
+        return self.books * 10 + self.__next_id
+
+
+# Each benchmark is a method name and a function that prepares one call: given the repository and the catalogue,
+# it returns the arguments to call the method with. Preparation is not timed.
+READS = [
+    ('get_version', lambda repo, cat: ()),
+    ('get_user', lambda repo, cat: (cat.rng.choice(cat.user_names),)),
+    ('get_book', lambda repo, cat: (cat.book_id(),)),
+    ('get_number_of_books', lambda repo, cat: ()),
+    ('get_first_book', lambda repo, cat: ()),
+    ('get_last_book', lambda repo, cat: ()),
+    ('get_books_by_id', lambda repo, cat: ([cat.book_id() for _ in range(20)],)),
+    ('get_books_by_release_year', lambda repo, cat: (cat.rng.choice(cat.years),)),
+    ('get_release_year_of_previous_book', lambda repo, cat: (repo.get_book(cat.book_id()),)),
+    ('get_release_year_of_next_book', lambda repo, cat: (repo.get_book(cat.book_id()),)),
+    ('get_book_ids_for_genre', lambda repo, cat: (cat.rng.choice(cat.genre_names),)),
+    ('get_book_ids_for_author', lambda repo, cat: (cat.rng.choice(cat.author_names),)),
+    ('get_book_ids_for_publisher', lambda repo, cat: (cat.rng.choice(cat.publisher_names),)),
+    ('get_top_rated_books', lambda repo, cat: (10,)),
+    ('get_most_reviewed_books', lambda repo, cat: (10,)),
+    ('get_genres', lambda repo, cat: ()),
+    ('get_authors', lambda repo, cat: ()),
+    ('get_publishers', lambda repo, cat: ()),
+    ('get_reviews', lambda repo, cat: ()),
+    ('get_all_books', lambda repo, cat: ()),
+    ('iter_books', lambda repo, cat: (cat.book_id(),)),
+    ('detach', lambda repo, cat: (repo.get_book(cat.book_id()),)),
+    ('attach', lambda repo, cat: (repo.detach(repo.get_book(cat.book_id())),)),
+    ('attach_user', lambda repo, cat: (repo.get_user(cat.rng.choice(cat.user_names)),)),
+]
+
+WRITES = [
+    ('bump_version', lambda repo, cat: ()),
+    ('add_user', lambda repo, cat: (User(f'benchmark{cat.new_id()}', PASSWORD_HASH),)),
+    ('update_user', lambda repo, cat: (_with_new_password(repo.get_user(cat.rng.choice(cat.user_names))),)),
+    ('add_book', lambda repo, cat: (_new_book(cat),)),
+    ('add_author', lambda repo, cat: (Author(cat.new_id(), f'Benchmark Author {cat.new_id()}'),)),
+    ('add_publisher', lambda repo, cat: (Publisher(cat.new_id(), f'Benchmark Publisher {cat.new_id()}'),)),
+    ('add_genre', lambda repo, cat: (Genre(f'Benchmark Genre {cat.new_id()}'),)),
+    ('add_review', lambda repo, cat: (_new_review(repo, cat),)),
+    ('add_reviews', lambda repo, cat: ([_new_review(repo, cat) for _ in range(20)],)),
+]
+
+
+def _with_new_password(user: User):
+    user.password = PASSWORD_HASH
+    return user
+
+
+def _new_book(cat: Catalogue):
+    return Book(cat.rng.choice(cat.years), 'Benchmark Book', cat.rng.randint(1, cat.sizes['publishers']),
+                cat.rng.randint(1, cat.sizes['authors']), cat.new_id())
+
+
+def _new_review(repo, cat: Catalogue):
+    user = repo.get_user(cat.rng.choice(cat.user_names))
+    book = repo.get_book(cat.book_id())
+    return make_review('Benchmarked', user, book, cat.rng.randint(1, 5))
+
+
+def consume(value):
+    # iter_books returns a generator; the benchmark reads one page of it.
+    if hasattr(value, '__next__'):
+        for _, _ in zip(range(20), value):
+            pass
+        value.close()
+
+
+def run_benchmark(repo, cat: Catalogue, method: str, prepare, budget: float, new_session):
+    # The budget is wall-clock time, preparation included; ops/sec counts only the time spent in the method.
+    latencies = list()
+    spent = 0.0
+    deadline = time.monotonic() + budget
+    while not latencies or time.monotonic() < deadline:
+        new_session()
+        args = prepare(repo, cat)
+        function = getattr(repo, method)
+        start = time.perf_counter()
+        consume(function(*args))
+        elapsed = time.perf_counter() - start
+        latencies.append(elapsed)
+        spent += elapsed
+    latencies.sort()
+    return {
+        'method': method,
+        'calls': len(latencies),
+        'ops_per_sec': round(len(latencies) / spent, 2),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 4),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 4),
+    }
+
+
+def _percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+
+def run_repository(kind: str, cat: Catalogue, budget: float, work_dir: Path):
+    clear_mappers()
+    engine = None
+    if kind == 'memory':
+        start = time.perf_counter()
+        repo = memory_repository.MemoryRepository()
+        repository_populate.populate(cat.directory, repo, False)
+        populate_seconds = time.perf_counter() - start
+        new_session = lambda: None  # noqa: E731
+    else:
+        pristine, populate_seconds = pristine_database(cat)
+        database_path = work_dir / 'library.db'
+        shutil.copyfile(pristine, database_path)
+        map_model_to_tables()
+        engine = create_engine(f'sqlite:///{database_path}', connect_args={'check_same_thread': False},
+                               poolclass=NullPool)
+        repo = database_repository.SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+        new_session = repo.reset_session
+
+    print(f'{kind} repository, {cat.books} books (populated in {populate_seconds:.1f} s)')
+    results = list()
+    for method, prepare in READS + WRITES:
+        try:
+            result = run_benchmark(repo, cat, method, prepare, budget, new_session)
+        except Exception as error:
+            # A broken method is reported, and the other methods still measured.
+            result = {'method': method, 'error': f'{type(error).__name__}: {str(error).splitlines()[0]}'}
+            print(f'  {method:<36}failed: {result["error"]}')
+        else:
+            print(f'  {method:<36}{result["ops_per_sec"]:>14,.1f} ops/s  p50 {result["p50_ms"]:>10.3f} ms  '
+                  f'p99 {result["p99_ms"]:>10.3f} ms  ({result["calls"]} calls)')
+        result.update(repository=kind, books=cat.books)
+        results.append(result)
+
+    if engine is not None:
+        repo.close_session()
+        engine.dispose()
+    clear_mappers()
+    return results, {'repository': kind, 'books': cat.books, 'seconds': round(populate_seconds, 3)}
+
+
+def pristine_database(cat: Catalogue):
+    # Populated once per catalogue; the time it took is kept next to it.
+    database_path = cat.directory / 'library.db'
+    timing_path = cat.directory / 'library.db.seconds'
+    if database_path.exists() and timing_path.exists():
+        return database_path, float(timing_path.read_text())
+
+    print(f'Populating a database with {cat.books} books (once)...')
+    clear_mappers()
+    building_path = database_path.with_suffix('.building')
+    if building_path.exists():
+        building_path.unlink()
+    engine = create_engine(f'sqlite:///{building_path}', connect_args={'check_same_thread': False},
+                           poolclass=NullPool)
+
+    @event.listens_for(engine, 'connect')
+    def without_syncing(connection, record):
+        # Only the finished file matters, so commits need not wait for the disk.
+        connection.execute('PRAGMA synchronous = OFF')
+
+    metadata.create_all(engine)
+    map_model_to_tables()
+    repo = database_repository.SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    start = time.perf_counter()
+    repository_populate.populate(cat.directory, repo, True)
+    seconds = time.perf_counter() - start
+    repo.close_session()
+    engine.dispose()
+    clear_mappers()
+
+    os.replace(building_path, database_path)
+    timing_path.write_text(str(seconds))
+    return database_path, seconds
+
+
+def catalogue(books: int, seed: int) -> Catalogue:
+    directory = DATA_DIR / f'{books}-{seed}-v{VERSION}'
+    if not (directory / 'reviews.csv').exists():
+        print(f'Writing a catalogue of {books} books to {directory}...')
+        write_catalogue(directory, books, seed)
+    return Catalogue(directory, books, seed)
+
+
+def compare(results, baseline_path: Path, threshold: float) -> bool:
+    """ Prints the methods whose throughput moved beyond the threshold; returns whether any got slower. """
+    with open(baseline_path, encoding='utf-8') as infile:
+        baseline = {(r['repository'], r['books'], r['method']): r for r in json.load(infile)['results']}
+
+    regressed = False
+    print(f'Compared with {baseline_path} (threshold {threshold}%):')
+    for result in results:
+        before = baseline.get((result['repository'], result['books'], result['method']))
+        if before is None or not before.get('ops_per_sec') or 'ops_per_sec' not in result:
+            continue
+        change = (result['ops_per_sec'] - before['ops_per_sec']) / before['ops_per_sec'] * 100
+        if abs(change) > threshold:
+            regressed = regressed or change < 0
+            label = 'slower' if change < 0 else 'faster'
+            print(f'  {result["repository"]:<9}{result["books"]:>9} books  {result["method"]:<36}'
+                  f'{before["ops_per_sec"]:>12,.1f} -> {result["ops_per_sec"]:>12,.1f} ops/s ({change:+.1f}%, {label})')
+    if not regressed:
+        print('  no method got slower')
+    return regressed
+
+
+def commit_id():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=get_project_root(), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _column(path: Path, index, distinct: bool = False):
+    with open(path, encoding='utf-8-sig', newline='') as infile:
+        reader = csv.reader(infile)
+        next(reader)
+        if isinstance(index, slice):
+            values = [value.strip() for row in reader for value in row[index] if value.strip()]
+        else:
+            values = [row[index].strip() for row in reader]
+    return sorted(set(values)) if distinct else values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the repository implementations.')
+    parser.add_argument('--sizes', default='10000,100000', help='comma-separated catalogue sizes, in books')
+    parser.add_argument('--repositories', default='memory,database', help='memory, database or both')
+    parser.add_argument('--time', type=float, default=1.0, help='seconds spent calling each method')
+    parser.add_argument('--seed', type=int, default=235)
+    parser.add_argument('--output', type=Path, help='results file (default benchmarks/results/repository-<commit>.json)')
+    parser.add_argument('--baseline', type=Path, help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent change reported against the baseline')
+    args = parser.parse_args()
+
+    commit = commit_id()
+    results = list()
+    populations = list()
+    for books in (int(size) for size in args.sizes.split(',')):
+        cat = catalogue(books, args.seed)
+        for kind in args.repositories.split(','):
+            with tempfile.TemporaryDirectory() as work_dir:
+                kind_results, population = run_repository(kind, cat, args.time, Path(work_dir))
+            results.extend(kind_results)
+            populations.append(population)
+
+    output = args.output or RESULTS_DIR / f'repository-{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as outfile:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'seed': args.seed,
+                'time_per_method': args.time,
+            },
+            'populate': populations,
+            'results': results,
+        }, outfile, indent=2)
+    print(f'Results written to {output}')
+
+    if args.baseline is not None and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Measures requests per second served by serve.py as the number of worker processes grows.
+
+Run from the project root:
+
+    python -m benchmarks.serve_scaling [--workers 1,2,4] [--threads N] [--clients N] [--duration SECONDS]
+
+For each worker count, serve.py is started on a free port (memory repository, preloaded) and CLIENTS client
+processes keep requesting a mix of catalogue pages for DURATION seconds. Requests per second and p50/p99 latency
+are reported per worker count. Throughput should grow with the workers up to the number of cores, less whatever
+the clients themselves use.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from utils import get_project_root
+
+PATHS = [
+    '/',
+    '/books_by_release_year',
+    '/books_by_genre?genre=Crime',
+    '/books_by_author?author=James+Reiner',
+    '/list_of_genres',
+    '/api/v1/books',
+]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_serving(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('localhost', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'serve.py did not start listening on port {port}')
+
+
+def client(port: int, duration: float, results):
+    latencies = list()
+    errors = 0
+    deadline = time.monotonic() + duration
+    index = os.getpid()
+    while time.monotonic() < deadline:
+        path = PATHS[index % len(PATHS)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('localhost', port, timeout=30)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                errors += 1
+        except OSError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    results.put((latencies, errors))
+
+
+def measure(workers: int, threads: int, clients: int, duration: float):
+    port = free_port()
+    environment = dict(
+        os.environ, REPOSITORY='memory', FLASK_ENV='production', SERVER_HOST='localhost', SERVER_PORT=str(port),
+        SERVER_WORKERS=str(workers), SERVER_THREADS=str(threads), SERVER_PRELOAD='True', RESPONSE_CACHE='False'
+    )
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py'], cwd=get_project_root(), env=environment,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_serving(port)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=client, args=(port, duration, results)) for _ in range(clients)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+    errors = sum(client_errors for _, client_errors in outcomes)
+    print(f'{workers:>3} workers: {len(latencies) / duration:8.1f} requests/s, p50 {percentile(latencies, 0.5):6.1f} ms, '
+          f'p99 {percentile(latencies, 0.99):6.1f} ms, {errors} errors')
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, max(1, cores // 2), cores})
+    parser = argparse.ArgumentParser(description='Measure how serve.py throughput scales with worker processes.')
+    parser.add_argument('--workers', default=','.join(map(str, default_workers)),
+                        help='comma-separated worker counts to try (default: 1, half the cores, all cores)')
+    parser.add_argument('--threads', type=int, default=4, help='request threads per worker')
+    parser.add_argument('--clients', type=int, default=cores * 2, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per worker count')
+    args = parser.parse_args()
+
+    print(f'{cores} cores, {args.clients} clients, {args.threads} threads per worker')
+    for workers in (int(count) for count in args.workers.split(',')):
+        measure(workers, args.threads, args.clients, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,4 +25,100 @@ class Config:
     echo_string = environ.get('SQLALCHEMY_ECHO')
     SQLALCHEMY_ECHO = False
     if echo_string.lower().strip() == "true":
-        SQLALCHEMY_ECHO = True
\ No newline at end of file
+        SQLALCHEMY_ECHO = True
+
+    # Caching configuration
+    repository_cache_string = environ.get('REPOSITORY_CACHE', 'False')
+    REPOSITORY_CACHE = repository_cache_string.lower().strip() == "true"
+    REPOSITORY_CACHE_SIZE = int(environ.get('REPOSITORY_CACHE_SIZE', 4096))
+    FRAGMENT_CACHE_SIZE = int(environ.get('FRAGMENT_CACHE_SIZE', 512))
+
+    cache_string = environ.get('RESPONSE_CACHE', 'False')
+    RESPONSE_CACHE = cache_string.lower().strip() == "true"
+    RESPONSE_CACHE_MAX_BYTES = int(environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = int(environ.get('RESPONSE_CACHE_TTL', 300))
+    CACHE_STATS_TOKEN = environ.get('CACHE_STATS_TOKEN', '')
+
+    # Compression configuration
+    compress_string = environ.get('COMPRESS', 'True')
+    COMPRESS = compress_string.lower().strip() == "true"
+    COMPRESS_MIN_SIZE = int(environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_CACHE_MAX_BYTES = int(environ.get('COMPRESS_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+
+    # Review submission configuration
+    write_behind_string = environ.get('REVIEW_WRITE_BEHIND', 'False')
+    REVIEW_WRITE_BEHIND = write_behind_string.lower().strip() == "true"
+    REVIEW_JOURNAL_DIR = environ.get('REVIEW_JOURNAL_DIR', 'journal')
+    REVIEW_BATCH_SIZE = int(environ.get('REVIEW_BATCH_SIZE', 50))
+    REVIEW_FLUSH_INTERVAL = float(environ.get('REVIEW_FLUSH_INTERVAL', 0.5))
+
+    # Authentication configuration
+    PASSWORD_HASH_METHOD = environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(environ.get('PASSWORD_HASH_ITERATIONS', 150000))
+    PASSWORD_SALT_LENGTH = int(environ.get('PASSWORD_SALT_LENGTH', 8))
+    LOGIN_RATE = float(environ.get('LOGIN_RATE', 5))
+    LOGIN_BURST = int(environ.get('LOGIN_BURST', 5))
+    LOGIN_IP_RATE = float(environ.get('LOGIN_IP_RATE', 50))
+    LOGIN_IP_BURST = int(environ.get('LOGIN_IP_BURST', 50))
+    PASSWORD_HASH_WORKERS = int(environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 1))
+
+    # Session configuration
+    SESSION_BACKEND = environ.get('SESSION_BACKEND', 'cookie')
+    SESSION_CACHE_SIZE = int(environ.get('SESSION_CACHE_SIZE', 10000))
+    SESSION_FILE_DIR = environ.get('SESSION_FILE_DIR', 'sessions')
+    SESSION_SQLITE_PATH = environ.get('SESSION_SQLITE_PATH', 'sessions.db')
+
+    # API configuration
+    API_PAGE_SIZE = int(environ.get('API_PAGE_SIZE', 20))
+    API_MAX_PAGE_SIZE = int(environ.get('API_MAX_PAGE_SIZE', 100))
+
+    # Catalogue import configuration
+    CATALOGUE_IMPORT_TOKEN = environ.get('CATALOGUE_IMPORT_TOKEN', '')
+
+    # Catalogue watch configuration
+    catalogue_watch_string = environ.get('CATALOGUE_WATCH', 'False')
+    CATALOGUE_WATCH = catalogue_watch_string.lower().strip() == "true"
+    CATALOGUE_WATCH_DEBOUNCE = float(environ.get('CATALOGUE_WATCH_DEBOUNCE', 2.0))
+    CATALOGUE_WATCH_POLL_INTERVAL = float(environ.get('CATALOGUE_WATCH_POLL_INTERVAL', 5.0))
+    catalogue_watch_inotify_string = environ.get('CATALOGUE_WATCH_INOTIFY', 'True')
+    CATALOGUE_WATCH_INOTIFY = catalogue_watch_inotify_string.lower().strip() == "true"
+
+    # Instrumentation configuration
+    instrumentation_string = environ.get('INSTRUMENTATION', 'False')
+    INSTRUMENTATION = instrumentation_string.lower().strip() == "true"
+    server_timing_string = environ.get('INSTRUMENTATION_SERVER_TIMING', 'True')
+    INSTRUMENTATION_SERVER_TIMING = server_timing_string.lower().strip() == "true"
+    instrumentation_log_string = environ.get('INSTRUMENTATION_LOG', 'False')
+    INSTRUMENTATION_LOG = instrumentation_log_string.lower().strip() == "true"
+    METRICS_TOKEN = environ.get('METRICS_TOKEN', '')
+
+    # Slow query log configuration (database repository only)
+    slow_query_log_string = environ.get('SLOW_QUERY_LOG', 'False')
+    SLOW_QUERY_LOG = slow_query_log_string.lower().strip() == "true"
+    SLOW_QUERY_THRESHOLD = float(environ.get('SLOW_QUERY_THRESHOLD', 0.1))
+    slow_query_explain_string = environ.get('SLOW_QUERY_EXPLAIN', 'True')
+    SLOW_QUERY_EXPLAIN = slow_query_explain_string.lower().strip() == "true"
+    SLOW_QUERY_REPORT_SIZE = int(environ.get('SLOW_QUERY_REPORT_SIZE', 20))
+    SLOW_QUERY_TOKEN = environ.get('SLOW_QUERY_TOKEN', '')
+
+    # Profiler configuration
+    profiler_string = environ.get('PROFILER', 'False')
+    PROFILER = profiler_string.lower().strip() == "true"
+    profiler_signals_string = environ.get('PROFILER_SIGNALS', 'False')
+    PROFILER_SIGNALS = profiler_signals_string.lower().strip() == "true"
+    PROFILER_ENDPOINTS = environ.get('PROFILER_ENDPOINTS', '')
+    PROFILER_SAMPLE_RATE = float(environ.get('PROFILER_SAMPLE_RATE', 0.1))
+    PROFILER_INTERVAL = float(environ.get('PROFILER_INTERVAL', 0.005))
+    PROFILER_DIR = environ.get('PROFILER_DIR', 'profiles')
+    PROFILER_TOKEN = environ.get('PROFILER_TOKEN', '')
+
+    # Production server configuration (serve.py, gunicorn.conf.py)
+    SERVER_HOST = environ.get('SERVER_HOST', 'localhost')
+    SERVER_PORT = int(environ.get('SERVER_PORT', 5000))
+    SERVER_WORKERS = int(environ.get('SERVER_WORKERS', 0))
+    SERVER_THREADS = int(environ.get('SERVER_THREADS', 4))
+    preload_string = environ.get('SERVER_PRELOAD', 'True')
+    SERVER_PRELOAD = preload_string.lower().strip() == "true"
+    SERVER_GRACEFUL_TIMEOUT = float(environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
@@ -0,0 +1,51 @@
+"""gunicorn settings, taken from the same configuration as the built-in server (see serve.py).
+
+gunicorn is optional (pip install gunicorn). From the project root:
+
+    $ gunicorn wsgi:app
+
+gunicorn reloads its workers gracefully on SIGHUP and stops them gracefully on SIGTERM.
+"""
+import os
+import signal
+
+from config import Config
+
+bind = f'{Config.SERVER_HOST}:{Config.SERVER_PORT}'
+workers = Config.SERVER_WORKERS or os.cpu_count() or 1
+worker_class = 'gthread'
+threads = Config.SERVER_THREADS
+preload_app = Config.SERVER_PRELOAD
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+
+
+def when_ready(server):
+    # With preload, the workers hold copies of the master's memory repository. When the catalogue watcher has
+    # reloaded it in the master, the workers are replaced (gunicorn keeps a preloaded application on SIGHUP).
+    watcher = server.app.wsgi().extensions.get('catalogue_watcher') if server.cfg.preload_app else None
+    if watcher is not None and watcher.engine is None:
+        def reload_and_replace_workers(snapshots):
+            if watcher.reload(snapshots):
+                os.kill(os.getpid(), signal.SIGHUP)
+
+        watcher.on_change = reload_and_replace_workers
+
+
+def post_worker_init(worker):
+    # With the memory repository, each worker holds its own; importing into one would leave the others behind.
+    importer = worker.wsgi.extensions.get('catalogue_importer')
+    if importer is not None and importer.engine is None and worker.cfg.workers > 1:
+        from library.adapters.catalogue_import import refuse_import
+        importer.on_import = refuse_import
+
+
+def pre_fork(server, worker):
+    # Forked workers must not share the master's database connection.
+    import library.adapters.repository as repo
+    if hasattr(repo.repo_instance, 'close_session'):
+        repo.repo_instance.close_session()
+
+
+def worker_exit(server, worker):
+    from library.server import stop_extensions
+    stop_extensions(worker.wsgi)
@@ -4,14 +4,22 @@ from pathlib import Path
 
 from flask import Flask
 
-# imports from SQLAlchemy
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, clear_mappers
-from sqlalchemy.pool import NullPool
-
 import library.adapters.repository as repo
-from library.adapters import memory_repository, database_repository, repository_populate
-from library.adapters.orm import metadata, map_model_to_tables
+from library.authentication.hashing_pool import HashingPool
+from library.authentication.password_policy import PasswordPolicy
+from library.authentication.session_store import ServerSideSessionInterface, FileSessionBackend, SqliteSessionBackend
+from library.authentication.throttle import LoginThrottle
+from library.adapters import repository_populate
+from library.adapters.caching_repository import CachingRepository
+from library.adapters.instrumented_repository import InstrumentedRepository
+from library.book.moderation import ProfanityFilter
+from library.book.review_queue import ReviewWriteQueue
+from library.utilities.compression import ResponseCompressor
+from library.utilities.fragment_cache import FragmentCache
+from library.utilities.instrumentation import Instrumentation
+from library.utilities.profiler import SamplingProfiler
+from library.utilities.response_cache import ResponseCache
+from library.utilities.static_assets import StaticAssets
 
 
 def create_app(test_config=None):
@@ -29,7 +37,12 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config)
         data_path = app.config['TEST_DATA_PATH']
 
+    # Each repository's modules (SQLAlchemy and the ORM mapping for the database) are only imported when it is used,
+    # so that starting a worker does not pay for the other.
+    database_engine = None
     if app.config['REPOSITORY'] == 'memory':
+        from library.adapters import memory_repository
+
         # Create the MemoryRepository implementation for a memory-based repository.
         repo.repo_instance = memory_repository.MemoryRepository()
         # fill the content of the repository from the provided csv files (has to be done every time we start app!)
@@ -37,6 +50,12 @@ def create_app(test_config=None):
         repository_populate.populate(data_path, repo.repo_instance, database_mode)
 
     elif app.config['REPOSITORY'] == 'database':
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import NullPool
+
+        from library.adapters import database_repository, database_population
+
         # Configure database.
         database_uri = app.config['SQLALCHEMY_DATABASE_URI']
 
@@ -51,25 +70,113 @@ def create_app(test_config=None):
         # Create the SQLAlchemy DatabaseRepository instance for an sqlite3-based repository.
         repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
 
-        if app.config['TESTING'] == 'True' or len(database_engine.table_names()) == 0:
-            print("REPOPULATING DATABASE...")
-            # For testing, or first-time use of the web application, reinitialise the database.
-            clear_mappers()
-            metadata.create_all(database_engine)  # Conditionally create database tables.
-            for table in reversed(metadata.sorted_tables):  # Remove any data from the tables.
-                database_engine.execute(table.delete())
-
-            # Generate mappings that map domain model classes to the database tables.
-            map_model_to_tables()
-
-            database_mode = True
-            repository_populate.populate(data_path, repo.repo_instance, database_mode)
-            print("REPOPULATING DATABASE... FINISHED")
-
-        else:
-            # Solely generate mappings that map domain model classes to the database tables.
-            map_model_to_tables()
-
+        # Populate the database only as far as the CSV files (or the tables) changed since it was last populated, and
+        # map the domain model classes to the tables. For testing, the database is always reinitialised.
+        action = database_population.prepare_database(
+            database_engine, data_path, repo.repo_instance, reset=app.config['TESTING'] == 'True'
+        )
+        if action == database_population.RESET:
+            print("REPOPULATED DATABASE")
+        elif action == database_population.UPDATED:
+            print("UPDATED DATABASE FROM CHANGED CSV FILES")
+
+    # Optionally take in rows added to the CSV files while the application runs, when asked to by an administrator.
+    if app.config['CATALOGUE_IMPORT_TOKEN']:
+        from library.adapters.catalogue_import import CatalogueImporter
+
+        CatalogueImporter(data_path, engine=database_engine).init_app(app)
+
+    # Optionally time each request's view, templates, repository calls and SQL statements, and count cache hits.
+    # Registered before the other extensions, so that their request hooks are timed too.
+    if app.config['INSTRUMENTATION']:
+        instrumentation = Instrumentation(
+            server_timing=app.config['INSTRUMENTATION_SERVER_TIMING'], log=app.config['INSTRUMENTATION_LOG']
+        )
+        instrumentation.init_app(app, engine=database_engine)
+
+    # Optionally log the SQL statements slower than a threshold, with their query plans, and rank them.
+    if app.config['SLOW_QUERY_LOG'] and database_engine is not None:
+        from library.adapters.slow_query_log import SlowQueryLog
+
+        SlowQueryLog(
+            threshold=app.config['SLOW_QUERY_THRESHOLD'],
+            explain=app.config['SLOW_QUERY_EXPLAIN'],
+            report_size=app.config['SLOW_QUERY_REPORT_SIZE']
+        ).init_app(app, database_engine)
+
+    # Optionally sample the stacks of some requests, for flamegraphs per endpoint. With signals, profiling can be
+    # switched on in a running process (SIGUSR1) and the stacks dumped (SIGUSR2).
+    if app.config['PROFILER'] or app.config['PROFILER_SIGNALS']:
+        SamplingProfiler(
+            endpoints=[endpoint.strip() for endpoint in app.config['PROFILER_ENDPOINTS'].split(',') if endpoint.strip()],
+            sample_rate=app.config['PROFILER_SAMPLE_RATE'],
+            interval=app.config['PROFILER_INTERVAL'],
+            directory=app.config['PROFILER_DIR'],
+            enabled=app.config['PROFILER']
+        ).init_app(app, signals=app.config['PROFILER_SIGNALS'])
+
+    repo.repo_instance = wrap_repository(app, repo.repo_instance)
+
+    # Optionally reload the catalogue when its CSV files change, without restarting.
+    if app.config['CATALOGUE_WATCH']:
+        from library.adapters.catalogue_watcher import CatalogueWatcher
+
+        CatalogueWatcher(
+            data_path,
+            engine=database_engine,
+            debounce=app.config['CATALOGUE_WATCH_DEBOUNCE'],
+            poll_interval=app.config['CATALOGUE_WATCH_POLL_INTERVAL'],
+            inotify=app.config['CATALOGUE_WATCH_INOTIFY']
+        ).init_app(app)
+
+    # Screen reviews for profanity; the word list is compiled when the first review is screened.
+    ProfanityFilter.from_default_wordlist().init_app(app)
+
+    # Optionally acknowledge reviews once journaled, and store them in the repository in batches.
+    if app.config['REVIEW_WRITE_BEHIND']:
+        ReviewWriteQueue(
+            app.config['REVIEW_JOURNAL_DIR'],
+            batch_size=app.config['REVIEW_BATCH_SIZE'],
+            flush_interval=app.config['REVIEW_FLUSH_INTERVAL']
+        ).init_app(app)
+
+    # Hash passwords as configured, and refuse floods of login attempts before any hash is checked.
+    password_policy = PasswordPolicy(
+        app.config['PASSWORD_HASH_METHOD'],
+        iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+        salt_length=app.config['PASSWORD_SALT_LENGTH']
+    )
+    if app.config['PASSWORD_HASH_WORKERS'] > 0:
+        # Hash in worker processes, so a burst of logins does not hold up other requests.
+        HashingPool(
+            password_policy,
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+            queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        ).init_app(app)
+    else:
+        password_policy.init_app(app)
+    LoginThrottle(
+        rate=app.config['LOGIN_RATE'],
+        burst=app.config['LOGIN_BURST'],
+        ip_rate=app.config['LOGIN_IP_RATE'],
+        ip_burst=app.config['LOGIN_IP_BURST']
+    ).init_app(app)
+
+    # Optionally keep sessions (and the logged-in user) on the server, with only a session id in the cookie.
+    if app.config['SESSION_BACKEND'] != 'cookie':
+        session_backend = None
+        if app.config['SESSION_BACKEND'] == 'file':
+            session_backend = FileSessionBackend(app.config['SESSION_FILE_DIR'])
+        elif app.config['SESSION_BACKEND'] == 'sqlite':
+            session_backend = SqliteSessionBackend(app.config['SESSION_SQLITE_PATH'])
+        ServerSideSessionInterface(session_backend, max_size=app.config['SESSION_CACHE_SIZE']).init_app(app)
+
+    # Cache rendered template fragments, and the data behind them, per repository version.
+    FragmentCache(max_size=app.config['FRAGMENT_CACHE_SIZE']).init_app(app)
+
+    # Link static files by content hash, so browsers can keep them until they change.
+    StaticAssets().init_app(app)
 
     # Build the application - these steps require an application context.
     with app.app_context():
@@ -86,17 +193,52 @@ def create_app(test_config=None):
         from .utilities import utilities
         app.register_blueprint(utilities.utilities_blueprint)
 
+        from .api import api
+        app.register_blueprint(api.api_blueprint)
+        app.register_blueprint(api.api_v1_blueprint)
+
         # Register a callback the makes sure that database sessions are associated with http requests
         # We reset the session inside the database repository before a new flask request is generated
         @app.before_request
         def before_flask_http_request_function():
-            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+            if hasattr(repo.repo_instance, 'reset_session'):
                 repo.repo_instance.reset_session()
+            # Drop what the repository cache holds if another process wrote to the repository meanwhile.
+            if isinstance(repo.repo_instance, CachingRepository):
+                repo.repo_instance.check_version()
+
+        # Optionally serve whole pages to anonymous visitors from memory. This has to be registered after the
+        # callback above, as looking up the repository version needs a fresh database session.
+        if app.config['RESPONSE_CACHE']:
+            ResponseCache(
+                max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'], ttl=app.config['RESPONSE_CACHE_TTL']
+            ).init_app(app)
+
+        # Compress responses for clients that accept it. Registered after the response cache, so that it runs
+        # first when responses are finished (Flask runs these callbacks in reverse) and compressed pages are cached.
+        if app.config['COMPRESS']:
+            ResponseCompressor(
+                min_size=app.config['COMPRESS_MIN_SIZE'], max_bytes=app.config['COMPRESS_CACHE_MAX_BYTES']
+            ).init_app(app)
 
         # Register a tear-down method that will be called after each request has been processed.
         @app.teardown_appcontext
         def shutdown_session(exception=None):
-            if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
+            if hasattr(repo.repo_instance, 'close_session'):
                 repo.repo_instance.close_session()
 
     return app
+
+
+def wrap_repository(app, repository):
+    """ Puts a repository behind the wrappers the application is configured with, as create_app does. """
+    instrumentation = app.extensions.get('instrumentation')
+    if instrumentation is not None:
+        # Wrapped inside the repository cache, so that only the calls reaching the repository are counted.
+        repository = InstrumentedRepository(repository, instrumentation.record_repository_call)
+
+    if app.config['REPOSITORY_CACHE']:
+        # Serve hot books, lists and navigation from memory rather than from the repository.
+        repository = CachingRepository(repository, max_size=app.config['REPOSITORY_CACHE_SIZE'])
+
+    return repository
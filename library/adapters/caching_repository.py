@@ -0,0 +1,211 @@
+from typing import List, Iterator
+
+from library.adapters.repository import AbstractRepository, RepositoryVersion, CatalogueDelta
+from library.domain.model import Publisher, Author, Book, Review, User, Genre
+from library.utilities.lru import LRUCache
+
+# Methods whose results contain books, and so go stale when a book gains a review.
+BOOK_METHODS = {
+    'get_book', 'get_books_by_id', 'get_books_by_release_year', 'get_all_books', 'get_first_book', 'get_last_book'
+}
+
+_MISSING = object()
+
+
+class CachingRepository(AbstractRepository):
+    """ A read-through cache in front of another repository.
+
+    Lookups of books, book ids, genres, authors, publishers and the release year navigation are served from a
+    size-bounded LRU cache, with a time-to-live per method. The cache holds detached copies made by the wrapped
+    repository (see AbstractRepository.detach), which each request gets its own copy of, so a database repository
+    is not queried for hot books. Writes go straight through to the wrapped repository and drop the entries they
+    affect; users, reviews, rankings and the repository version are never cached.
+
+    Other processes' writes are noticed by check_version(), called at the start of every request: one read of the
+    wrapped repository's version, which drops the whole cache when it moved on other than by this process's writes.
+    """
+
+    DEFAULT_TTLS = {
+        'get_book': 300,
+        'get_books_by_id': 300,
+        'get_books_by_release_year': 300,
+        'get_all_books': 300,
+        'get_first_book': 300,
+        'get_last_book': 300,
+        'get_number_of_books': 300,
+        'get_book_ids_for_genre': 600,
+        'get_book_ids_for_author': 600,
+        'get_book_ids_for_publisher': 600,
+        'get_release_year_of_previous_book': 3600,
+        'get_release_year_of_next_book': 3600,
+        'get_genres': 3600,
+        'get_authors': 3600,
+        'get_publishers': 3600,
+    }
+
+    def __init__(self, repository: AbstractRepository, max_size: int = 4096, ttls: dict = None):
+        self.repository = repository
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.cache = LRUCache(max_size=max_size, name='repository')
+        self.__counts = {method: [0, 0] for method in self.ttls}
+        self.__version = None  # The wrapped repository's version the cache holds the contents of.
+
+    def __getattr__(self, name):
+        # Anything else the wrapped repository offers (e.g. reset_session) is passed through.
+        return getattr(self.repository, name)
+
+    def stats(self) -> dict:
+        """ The cache's statistics, with hits and misses per method. """
+        stats = self.cache.stats()
+        stats['methods'] = {
+            method: {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / (hits + misses), 4)}
+            for method, (hits, misses) in self.__counts.items() if hits + misses > 0
+        }
+        return stats
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def check_version(self):
+        """ Drops the whole cache if the wrapped repository changed since the cache was last known to be current. """
+        version = self.repository.get_version().version
+        if version != self.__version:
+            self.invalidate()
+            self.__version = version
+
+    def get_version(self) -> RepositoryVersion:
+        return self.repository.get_version()
+
+    def bump_version(self):
+        self.repository.bump_version()
+
+    def detach(self, value):
+        return self.repository.detach(value)
+
+    def attach(self, value):
+        return self.repository.attach(value)
+
+    def add_user(self, user: User):
+        self.repository.add_user(user)
+
+    def get_user(self, user_name) -> User:
+        return self.repository.get_user(user_name)
+
+    def update_user(self, user: User):
+        self.repository.update_user(user)
+
+    def attach_user(self, user: User) -> User:
+        return self.repository.attach_user(user)
+
+    def add_book(self, book: Book):
+        self.repository.add_book(book)
+        self.invalidate()
+
+    def get_book(self, book_id: int) -> Book:
+        return self.__cached('get_book', book_id)
+
+    def get_all_books(self) -> List[Book]:
+        return self.__cached('get_all_books')
+
+    def iter_books(self, after_id: int = None, batch_size: int = 500) -> Iterator[Book]:
+        return self.repository.iter_books(after_id, batch_size)
+
+    def get_books_by_release_year(self, target_year: int) -> List[Book]:
+        return self.__cached('get_books_by_release_year', target_year)
+
+    def get_number_of_books(self) -> int:
+        return self.__cached('get_number_of_books')
+
+    def get_first_book(self) -> Book:
+        return self.__cached('get_first_book')
+
+    def get_last_book(self) -> Book:
+        return self.__cached('get_last_book')
+
+    def get_books_by_id(self, id_list):
+        return self.__cached('get_books_by_id', tuple(id_list))
+
+    def get_book_ids_for_genre(self, genre_name: str):
+        return list(self.__cached('get_book_ids_for_genre', genre_name))
+
+    def get_book_ids_for_author(self, author_name: str):
+        return list(self.__cached('get_book_ids_for_author', author_name))
+
+    def get_book_ids_for_publisher(self, publisher_name: str):
+        return list(self.__cached('get_book_ids_for_publisher', publisher_name))
+
+    def get_release_year_of_previous_book(self, book: Book):
+        return self.__cached('get_release_year_of_previous_book', book.release_year, call_with=(book,))
+
+    def get_release_year_of_next_book(self, book: Book):
+        return self.__cached('get_release_year_of_next_book', book.release_year, call_with=(book,))
+
+    def get_top_rated_books(self, quantity: int) -> List[Book]:
+        return self.repository.get_top_rated_books(quantity)
+
+    def get_most_reviewed_books(self, quantity: int) -> List[Book]:
+        return self.repository.get_most_reviewed_books(quantity)
+
+    def add_genre(self, genre: Genre):
+        self.repository.add_genre(genre)
+        self.invalidate()
+
+    def get_genres(self) -> List[Genre]:
+        return self.__cached('get_genres')
+
+    def add_author(self, author: Author):
+        self.repository.add_author(author)
+        self.invalidate()
+
+    def get_authors(self) -> List[Author]:
+        return self.__cached('get_authors')
+
+    def add_publisher(self, publisher: Publisher):
+        self.repository.add_publisher(publisher)
+        self.invalidate()
+
+    def get_publishers(self) -> List[Publisher]:
+        return self.__cached('get_publishers')
+
+    def add_review(self, review: Review):
+        version = self.repository.get_version().version
+        self.repository.add_review(review)
+        self.__invalidate_books([review], version)
+
+    def add_reviews(self, reviews: List[Review]):
+        version = self.repository.get_version().version
+        self.repository.add_reviews(reviews)
+        self.__invalidate_books(reviews, version)
+
+    def get_reviews(self):
+        return self.repository.get_reviews()
+
+    def apply_catalogue_delta(self, delta: CatalogueDelta):
+        self.repository.apply_catalogue_delta(delta)
+        self.invalidate()
+
+    def __cached(self, method: str, *key_args, call_with: tuple = None):
+        key = (method, key_args)
+        snapshot = self.cache.get(key, _MISSING)
+        if snapshot is not _MISSING:
+            self.__counts[method][0] += 1
+            return self.repository.attach(snapshot)
+
+        self.__counts[method][1] += 1
+        value = getattr(self.repository, method)(*(call_with if call_with is not None else key_args))
+        self.cache.set(key, self.repository.detach(value), ttl=self.ttls[method])
+        return value
+
+    def __invalidate_books(self, reviews, version: int):
+        # A new review changes its book (reviews, rating) wherever the book appears, but no ids or names.
+        book_ids = {review.book.book_id for review in reviews}
+        self.cache.discard_where(
+            lambda key: key[0] in BOOK_METHODS and (key[0] != 'get_book' or key[1][0] in book_ids)
+        )
+        # The write bumped the version once, or once per review. If it moved on by anything else, another process
+        # wrote too, and the next check_version() drops the rest.
+        written = self.repository.get_version().version
+        if version == self.__version and written - version in (1, len(reviews)):
+            self.__version = written
@@ -0,0 +1,297 @@
+import csv
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, namedtuple
+from pathlib import Path
+
+import click
+from flask import current_app, jsonify, request
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+import library.adapters.repository as repo
+from library.adapters.csv_data_importer import SOURCE_FILES, BOOK_COLUMNS
+from library.adapters.repository import AbstractRepository, CatalogueDelta, ReviewRow, book_row
+from library.domain.model import Author, Publisher, User, make_book
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks files are read in to digest them.
+CHUNK_SIZE = 1 << 20
+
+# Books compared with the repository are looked up this many at a time.
+LOOKUP_BATCH = 500
+
+# What the importer knows of a CSV file as the repository last took it in.
+FileSnapshot = namedtuple('FileSnapshot', ['size', 'mtime_ns', 'digest', 'ends_with_newline'])
+
+
+class CatalogueImportException(Exception):
+    pass
+
+
+class CatalogueImporter:
+    """ Applies the rows added to or changed in the catalogue's CSV files to a repository, without reloading it.
+
+    The importer keeps the size, modification time and SHA-256 digest of each file as the repository took it in.
+    import_changes() skips the files whose size and modification time are unchanged, and those whose digest is. A
+    file which only grew, its previous content intact, has just its new lines parsed; any other change has the whole
+    file parsed. The rows parsed are compared with the repository: authors, publishers and books by id and content,
+    users by name, and reviews (which have no id) by user, book, text and rating, so only the rows which are new or
+    differ are applied, in one call of the repository's apply_catalogue_delta(). Rows removed from a file are left in
+    the repository.
+
+    With the database repository, pass its engine: the population fingerprints are then recorded too, so restarting
+    does not update the database from the same files again.
+
+    on_import, if set, is called by import_view instead of importing: with the memory repository, every worker
+    process of a server holds a repository of its own, so the pre-forking server (library/server.py) sets it to have
+    its master rebuild the repository and replace the workers, or to refuse_import where there is no such master.
+    """
+
+    def __init__(self, data_path, engine=None, snapshots: dict = None):
+        self.data_path = Path(data_path)
+        self.engine = engine
+        self.on_import = None
+        self.__lock = threading.Lock()
+        # The files as the repository took them in, if known (see snapshot_files); by default, as they are now.
+        self.__snapshots = dict(snapshots) if snapshots is not None else snapshot_files(self.data_path)
+
+    def init_app(self, app):
+        app.extensions['catalogue_importer'] = self
+        app.add_url_rule('/admin/import-catalogue', 'import_catalogue', self.import_view, methods=['POST'])
+        app.cli.add_command(import_catalogue_command)
+
+    def reset(self, snapshots: dict = None):
+        """ Takes the files as they are now (or as in snapshots, see snapshot_files) to be what the repository holds,
+        as after it was populated from them again.
+        """
+        with self.__lock:
+            self.__snapshots = dict(snapshots) if snapshots is not None else snapshot_files(self.data_path)
+
+    def import_changes(self, repository: AbstractRepository) -> dict:
+        """ Applies what changed in the CSV files since they were last taken in, and returns what was applied. """
+        with self.__lock:
+            start = time.perf_counter()
+            changed = dict()  # source -> (snapshot, rows, whether the rows were appended)
+            for source in SOURCE_FILES:
+                path = self.data_path / source
+                previous = self.__snapshots[source]
+                stat = path.stat()
+                if (stat.st_size, stat.st_mtime_ns) == (previous.size, previous.mtime_ns):
+                    continue
+                # The previous content is only looked for if the file ended with a complete line.
+                snapshot, prefix_digest = _scan(path, previous.size if previous.ends_with_newline else None)
+                if snapshot.digest == previous.digest:
+                    self.__snapshots[source] = snapshot
+                elif prefix_digest == previous.digest:
+                    changed[source] = (snapshot, _read_rows(path, previous.size, snapshot.size), True)
+                else:
+                    changed[source] = (snapshot, _read_rows(path, 0, snapshot.size), False)
+
+            delta = self.__delta(repository, changed)
+            if delta:
+                repository.apply_catalogue_delta(delta)
+            for source, (snapshot, rows, appended) in changed.items():
+                self.__snapshots[source] = snapshot
+            if self.engine is not None and changed:
+                self.__record_fingerprints()
+
+            summary = dict(delta.counts(), files=[source for source in SOURCE_FILES if source in changed],
+                           seconds=round(time.perf_counter() - start, 3))
+            logger.info('Imported catalogue changes: %s', summary)
+            return summary
+
+    def import_view(self):
+        token = current_app.config['CATALOGUE_IMPORT_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return jsonify(error='A valid bearer token is required'), 401
+        try:
+            if self.on_import is not None:
+                self.on_import()
+                return jsonify(reloading=True), 202
+            return jsonify(self.import_changes(repo.repo_instance))
+        except CatalogueImportException as error:
+            return jsonify(error=str(error)), 400
+
+    def __delta(self, repository, changed) -> CatalogueDelta:
+        # Every row is checked before anything is applied, so a bad row leaves the repository as it was.
+        delta = CatalogueDelta()
+        try:
+            if 'authors.csv' in changed:
+                authors = {int(row[0]): Author(int(row[0]), row[1]) for row in changed['authors.csv'][1]}
+                stored = {author.unique_id: author.full_name for author in repository.get_authors()}
+                delta.authors = [author for author in authors.values()
+                                 if stored.get(author.unique_id) != author.full_name]
+
+            if 'publishers.csv' in changed:
+                publishers = {int(row[0]): Publisher(int(row[0]), row[1]) for row in changed['publishers.csv'][1]}
+                stored = {publisher.publisher_id: publisher.name for publisher in repository.get_publishers()}
+                delta.publishers = [publisher for publisher in publishers.values()
+                                    if stored.get(publisher.publisher_id) != publisher.name]
+
+            if 'books.csv' in changed:
+                books = dict()
+                for row in changed['books.csv'][1]:
+                    book = make_book(int(row[0]), int(row[1]), row[2], int(row[3]), int(row[4]), row[5], row[6])
+                    genres = tuple(sorted({genre for genre in row[BOOK_COLUMNS:] if genre != ''}))
+                    books[book.book_id] = book_row(book)._replace(genres=genres)
+                stored = _stored_books(repository, list(books))
+                delta.books = [row for book_id, row in books.items() if stored.get(book_id) != row]
+
+            if 'users.csv' in changed:
+                user_names = set()
+                for row in changed['users.csv'][1]:
+                    user = User(row[1], '')
+                    if user.user_name not in user_names and repository.get_user(user.user_name) is None:
+                        delta.users.append(User(row[1], generate_password_hash(row[2])))
+                    user_names.add(user.user_name)
+
+            if 'reviews.csv' in changed:
+                delta.reviews = self.__new_reviews(repository, changed, delta)
+        except (IndexError, ValueError) as error:
+            raise CatalogueImportException(f'Malformed row in the catalogue: {error!r}')
+        return delta
+
+    def __new_reviews(self, repository, changed, delta: CatalogueDelta) -> list:
+        # reviews.csv refers to users by their id in users.csv.
+        users_path = self.data_path / 'users.csv'
+        users_size = changed['users.csv'][0].size if 'users.csv' in changed else self.__snapshots['users.csv'].size
+        user_names = {row[0]: User(row[1], '').user_name for row in _read_rows(users_path, 0, users_size)}
+
+        snapshot, rows, appended = changed['reviews.csv']
+        reviews = list()
+        for row in rows:
+            if row[0] not in user_names:
+                raise CatalogueImportException(f'reviews.csv refers to user {row[0]}, who is not in users.csv')
+            reviews.append(ReviewRow(user_names[row[0]], int(row[1]), row[2], int(row[3])))
+
+        if not appended:
+            # Each stored review accounts for one identical row.
+            stored = Counter(
+                (review.user.user_name, review.book.book_id, review.review_text, review.rating)
+                for review in repository.get_reviews()
+            )
+            new_reviews = list()
+            for review in reviews:
+                if stored[review] > 0:
+                    stored[review] -= 1
+                else:
+                    new_reviews.append(review)
+            reviews = new_reviews
+
+        known_users = {user.user_name for user in delta.users}
+        known_books = {row.book_id for row in delta.books}
+        known_books.update(_stored_books(repository, list({review.book_id for review in reviews} - known_books)))
+        for review in reviews:
+            if review.user_name not in known_users:
+                if repository.get_user(review.user_name) is None:
+                    raise CatalogueImportException(f'reviews.csv refers to user {review.user_name}, who is not stored')
+                known_users.add(review.user_name)
+            if review.book_id not in known_books:
+                raise CatalogueImportException(f'reviews.csv refers to book {review.book_id}, which is not stored')
+            if not 1 <= review.rating <= 5:
+                raise CatalogueImportException(f'reviews.csv has a rating of {review.rating}, out of 1 to 5')
+        return reviews
+
+    def __record_fingerprints(self):
+        # Imported here, as SQLAlchemy is only loaded with the database repository.
+        from library.adapters import database_population
+
+        fingerprints = database_population.stored_fingerprints(self.engine) or dict()
+        fingerprints.update((source, snapshot.digest) for source, snapshot in self.__snapshots.items())
+        fingerprints[database_population.SCHEMA] = database_population.schema_digest(self.engine)
+        with self.engine.begin() as connection:
+            database_population.record_fingerprints(connection, fingerprints)
+
+
+@click.command('import-catalogue')
+@click.option('--url', help='Address of the running application, by default http://SERVER_HOST:SERVER_PORT.')
+@with_appcontext
+def import_catalogue_command(url):
+    """Apply the rows added to or changed in the CSV files to the running application."""
+    # The application serving requests holds the repository (in memory mode, the only copy of it), so it is asked to
+    # import rather than this process.
+    config = current_app.config
+    url = (url or f'http://{config["SERVER_HOST"]}:{config["SERVER_PORT"]}').rstrip('/') + '/admin/import-catalogue'
+    post = urllib.request.Request(url, data=b'', method='POST',
+                                  headers={'Authorization': 'Bearer ' + config['CATALOGUE_IMPORT_TOKEN']})
+    try:
+        with urllib.request.urlopen(post) as response:
+            summary = json.load(response)
+    except urllib.error.HTTPError as error:
+        raise click.ClickException(f'{url} answered {error.code}: {error.read().decode(errors="replace")}')
+    except urllib.error.URLError as error:
+        raise click.ClickException(f'Could not reach {url}: {error.reason}')
+    if summary.get('reloading'):
+        click.echo('The server is reloading the catalogue and replacing its workers')
+        return
+    click.echo(', '.join(f'{summary[name]} {name}' for name in ('authors', 'publishers', 'books', 'users', 'reviews'))
+               + f' imported from {", ".join(summary["files"]) or "no changed files"} in {summary["seconds"]} s')
+
+
+def refuse_import():
+    """ An on_import for servers with several worker processes, each holding a memory repository of its own. """
+    raise CatalogueImportException('Each worker holds its own memory repository; restart the server to load the '
+                                   'changed files, or set CATALOGUE_WATCH')
+
+
+def snapshot_files(data_path) -> dict:
+    """ The snapshot of each of the catalogue's CSV files in data_path, by file name. """
+    return {source: _scan(Path(data_path) / source)[0] for source in SOURCE_FILES}
+
+
+def _scan(path: Path, prefix_length: int = None):
+    # One pass over the file: its snapshot, and the digest of its first prefix_length bytes if it is that long.
+    digest = hashlib.sha256()
+    prefix_digest = None
+    with open(path, 'rb') as infile:
+        mtime_ns = os.fstat(infile.fileno()).st_mtime_ns
+        if prefix_length is not None:
+            remaining = prefix_length
+            while remaining > 0:
+                chunk = infile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if remaining == 0:
+                prefix_digest = digest.hexdigest()
+        for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+        size = infile.tell()
+        ends_with_newline = False
+        if size > 0:
+            infile.seek(size - 1)
+            ends_with_newline = infile.read(1) == b'\n'
+    return FileSnapshot(size, mtime_ns, digest.hexdigest(), ends_with_newline), prefix_digest
+
+
+def _read_rows(path: Path, start: int, end: int) -> list:
+    # The rows between two offsets, as read_csv_file yields them; only the digested bytes are read, even if the file
+    # has grown since. The header is skipped when reading from the start, and blank lines are.
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        text = infile.read(end - start).decode('utf-8-sig')
+    rows = csv.reader(io.StringIO(text))
+    if start == 0:
+        next(rows, None)
+    return [[item.strip() for item in row] for row in rows if any(item.strip() for item in row)]
+
+
+def _stored_books(repository: AbstractRepository, book_ids: list) -> dict:
+    # The repository's books with those ids, as rows to compare.
+    books = dict()
+    for start in range(0, len(book_ids), LOOKUP_BATCH):
+        books.update((book.book_id, book_row(book))
+                     for book in repository.get_books_by_id(book_ids[start:start + LOOKUP_BATCH]))
+    return books
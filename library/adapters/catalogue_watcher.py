@@ -0,0 +1,290 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+
+import library.adapters.repository as repo
+from library import wrap_repository
+from library.adapters import repository_populate
+from library.adapters.caching_repository import CachingRepository
+from library.adapters.catalogue_import import CatalogueImporter, snapshot_files
+from library.adapters.csv_data_importer import SOURCE_FILES
+from library.adapters.instrumented_repository import InstrumentedRepository
+from library.adapters.memory_repository import MemoryRepository
+from library.domain.model import User, make_review
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) flags and the events watched for: a file written, or replaced by renaming another over it.
+IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, 0o2000000
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x8, 0x40, 0x80, 0x100, 0x200
+IN_Q_OVERFLOW, IN_IGNORED = 0x4000, 0x8000
+WATCHED_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Seconds a replaced memory repository is kept for the requests still using it.
+RELEASE_DELAY = 60
+
+# struct inotify_event, which is followed by a name of its len bytes.
+EVENT = struct.Struct('iIII')
+
+
+class CatalogueWatcher:
+    """ Reloads the catalogue when its CSV files change, without restarting the application.
+
+    A background thread is told of changes to the data directory by inotify (on Linux), or otherwise polls the
+    files' sizes and modification times every poll_interval seconds. A burst of writes is taken as one change: the
+    catalogue is reloaded once no file has changed for debounce seconds, and only if the content of a file did.
+
+    With the database repository, the changes are imported into the database by the CatalogueImporter, in one
+    transaction, so requests see the catalogue before or after it. With the memory repository, a new repository is
+    populated on the watcher's thread, outside any request, and replaces repo.repo_instance in one assignment, so
+    requests see the old catalogue until the new one is complete. The users who signed up and the reviews written
+    since the old repository was populated are carried over, and those added to it later go to the new one (see
+    MemoryRepository.hand_over); its version is continued, so that caches keyed by the version drop what they held.
+    Server-side sessions look their users up again, in the new repository.
+
+    on_change(snapshots) is called for a change; it reloads by default. The pre-forking server (library/server.py)
+    sets it to rebuild in its master process instead, see there.
+    """
+
+    def __init__(self, data_path, engine=None, debounce: float = 2.0, poll_interval: float = 5.0,
+                 inotify: bool = True):
+        self.data_path = Path(data_path)
+        self.engine = engine
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.inotify = inotify
+        self.on_change = self.reload
+        self.app = None
+        self.uses_inotify = False
+
+        self.__snapshots = snapshot_files(self.data_path)
+        self.__importer = None
+        if engine is not None:
+            self.__importer = CatalogueImporter(self.data_path, engine=engine, snapshots=self.__snapshots)
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__wakeup = None
+        self.__worker = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['catalogue_watcher'] = self
+        repository = _unwrap(repo.repo_instance)
+        if self.engine is None and isinstance(repository, MemoryRepository):
+            repository.mark_populated()
+        self.start()
+
+    def start(self):
+        self.__stopped.clear()
+        self.__wakeup = os.pipe()
+        # Watched from here on, so that no change made once start() returned goes unnoticed.
+        watch = self.__open_inotify() if self.inotify else None
+        self.uses_inotify = watch is not None
+        self.__worker = threading.Thread(target=self.__run, args=(watch, _stats(self.data_path)),
+                                         name='catalogue-watcher', daemon=True)
+        self.__worker.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__worker is not None:
+            # In a forked child the thread is the parent's, which is left running.
+            if self.__worker.is_alive():
+                os.write(self.__wakeup[1], b'\0')
+                self.__worker.join()
+            self.__worker = None
+            for fd in self.__wakeup:
+                os.close(fd)
+
+    def check(self) -> bool:
+        """ Calls on_change if the content of a CSV file changed since the catalogue was loaded. """
+        snapshots = snapshot_files(self.data_path)
+        changed = _digests(snapshots) != _digests(self.__snapshots)
+        # Taken even if on_change fails, so that a broken file is not loaded again until it changes.
+        self.__snapshots = snapshots
+        if changed:
+            self.on_change(snapshots)
+        return changed
+
+    def reload(self, snapshots: dict = None) -> bool:
+        """ Loads the CSV files into the repository as described above. Returns whether repo.repo_instance was
+        replaced.
+        """
+        with self.__lock:
+            start = time.perf_counter()
+            if self.engine is not None:
+                summary = self.__import_changes()
+                logger.info('Imported the changed catalogue in %.1f s: %s', time.perf_counter() - start, summary)
+                return False
+
+            # The files are taken as they are before they are read; a change while they are read is loaded next time.
+            snapshots = snapshots or snapshot_files(self.data_path)
+            repository = MemoryRepository()
+            repository_populate.populate(self.data_path, repository, False)
+            repository.mark_populated()
+
+            previous = repo.repo_instance
+            previous_repository = _unwrap(previous)
+            if isinstance(previous_repository, MemoryRepository):
+                # From here on, what is added to the previous repository goes to the new one.
+                previous_repository.hand_over(lambda users, reviews: _carry_over(users, reviews, repository))
+            repository.continue_version(previous.get_version())
+            repo.repo_instance = wrap_repository(self.app, repository) if self.app is not None else repository
+            self.__snapshots = snapshots
+
+            # Emptied once the requests using it are done, so that it is freed without a full garbage collection.
+            self.__release(previous_repository)
+
+            # Logged-in users were resolved in the previous repository; they are looked up in the new one instead.
+            session_store = self.app.extensions.get('session_store') if self.app is not None else None
+            if session_store is not None:
+                session_store.forget_users()
+            importer = self.app.extensions.get('catalogue_importer') if self.app is not None else None
+            if importer is not None:
+                importer.reset(snapshots)
+            logger.info('Reloaded the catalogue in %.1f s: %s books', time.perf_counter() - start,
+                        repository.get_number_of_books())
+            return True
+
+    def __import_changes(self) -> dict:
+        # The application's importer, if it has one, so that both know what the database holds.
+        importer = self.app.extensions.get('catalogue_importer') if self.app is not None else None
+        importer = importer or self.__importer
+        repository = repo.repo_instance
+        try:
+            return importer.import_changes(repository)
+        finally:
+            # The session is this thread's own; requests' sessions are left alone.
+            if hasattr(repository, 'close_session'):
+                repository.close_session()
+
+    def __release(self, repository):
+        if isinstance(repository, MemoryRepository):
+            release = threading.Timer(RELEASE_DELAY, repository.release)
+            release.daemon = True
+            release.start()
+
+    def __run(self, watch, stats: dict):
+        changed_at = None
+        try:
+            while not self.__stopped.is_set():
+                timeout = self.poll_interval
+                if changed_at is not None:
+                    timeout = min(timeout, max(0.0, changed_at + self.debounce - time.monotonic()))
+
+                if watch is not None:
+                    changed, watch = self.__wait_for_event(watch, timeout)
+                else:
+                    self.__wait_for_wakeup(timeout)
+                    current = _stats(self.data_path)
+                    changed, stats = current != stats, current
+                if self.__stopped.is_set():
+                    return
+
+                if changed:
+                    changed_at = time.monotonic()
+                elif changed_at is not None and time.monotonic() >= changed_at + self.debounce:
+                    changed_at = None
+                    try:
+                        self.check()
+                    except Exception:
+                        # Keep watching; the next change is loaded as usual.
+                        logger.exception('Reloading the catalogue failed')
+        finally:
+            if watch is not None:
+                os.close(watch)
+
+    def __open_inotify(self):
+        functions = _inotify()
+        if functions is None:
+            logger.info('inotify is not available; polling %s every %s s', self.data_path, self.poll_interval)
+            return None
+        inotify_init1, inotify_add_watch = functions
+        fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.warning('inotify_init1 failed (%s); polling instead', os.strerror(ctypes.get_errno()))
+            return None
+        if inotify_add_watch(fd, os.fsencode(self.data_path), WATCHED_EVENTS) < 0:
+            logger.warning('Could not watch %s (%s); polling instead', self.data_path,
+                           os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return None
+        return fd
+
+    def __wait_for_event(self, watch: int, timeout: float):
+        # Returns whether a CSV file changed, and the inotify descriptor to go on with (None to poll from now on).
+        readable, _, _ = select.select([watch, self.__wakeup[0]], [], [], timeout)
+        if watch not in readable:
+            return False, watch
+        try:
+            events = os.read(watch, 1 << 16)
+        except BlockingIOError:
+            return False, watch
+
+        changed = False
+        offset = 0
+        while offset < len(events):
+            wd, mask, cookie, length = EVENT.unpack_from(events, offset)
+            name = events[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0').decode(errors='replace')
+            offset += EVENT.size + length
+            if mask & IN_IGNORED:
+                # The directory itself was removed or unmounted.
+                logger.warning('%s is no longer watched by inotify; polling instead', self.data_path)
+                os.close(watch)
+                self.uses_inotify = False
+                return True, None
+            if mask & IN_Q_OVERFLOW or name in SOURCE_FILES:
+                changed = True
+        return changed, watch
+
+    def __wait_for_wakeup(self, timeout: float):
+        select.select([self.__wakeup[0]], [], [], timeout)
+
+
+def _inotify():
+    # libc's inotify functions, where there are any (Linux).
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+def _stats(data_path: Path) -> dict:
+    stats = dict()
+    for source in SOURCE_FILES:
+        try:
+            stat = (data_path / source).stat()
+            stats[source] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stats[source] = None
+    return stats
+
+
+def _digests(snapshots: dict) -> dict:
+    return {source: snapshot.digest for source, snapshot in snapshots.items()}
+
+
+def _carry_over(users: list, reviews: list, repository: MemoryRepository):
+    # Users who signed up and reviews written while the application ran are not in the CSV files, so are added to the
+    # new repository, as far as their books are still in it.
+    for user in users:
+        if repository.get_user(user.user_name) is None:
+            repository.add_user(User(user.user_name, user.password))
+    for review in reviews:
+        user = repository.get_user(review.user.user_name)
+        book = repository.get_book(review.book.book_id)
+        if user is not None and book is not None:
+            repository.add_review(make_review(review.review_text, user, book, review.rating, review.timestamp))
+
+
+def _unwrap(repository):
+    # The repository behind the caching and instrumented ones.
+    while isinstance(repository, (CachingRepository, InstrumentedRepository)):
+        repository = repository.repository
+    return repository
@@ -4,7 +4,13 @@ from pathlib import Path
 from werkzeug.security import generate_password_hash
 
 from library.adapters.repository import AbstractRepository
-from library.domain.model import Publisher, Author, Book, User, Genre, make_genre_association, make_review, make_book
+from library.domain.model import Publisher, Author, Book, User, Genre, make_review, make_book
+
+# The CSV files a repository is populated from, in the order they are loaded.
+SOURCE_FILES = ('authors.csv', 'publishers.csv', 'books.csv', 'users.csv', 'reviews.csv')
+
+# Columns of books.csv before the genres.
+BOOK_COLUMNS = 7
 
 
 def read_csv_file(filename: str):
@@ -60,8 +66,8 @@ def load_books_and_genres(data_path: Path, repo: AbstractRepository, authors, pu
         number_of_genres = len(data_row) - 7
         book_genres = data_row[-number_of_genres:]
 
-        # Add any new genres; associate the current book with genres.
-        for genre in book_genres:
+        # Add any new genres; associate the current book with genres, each once.
+        for genre in dict.fromkeys(book_genres):
             if genre.strip() != "":
                 if genre not in genres.keys():
                     genres[genre] = list()
@@ -89,7 +95,10 @@ def load_books_and_genres(data_path: Path, repo: AbstractRepository, authors, pu
             if database_mode is True:
                 book.add_genre(genre)
             else:
-                make_genre_association(book, genre)
+                # Each book is listed once per genre, so the association is made without looking for it first, which
+                # took time growing with the genre's size.
+                book.add_genre(genre)
+                genre.add_book(book)
         repo.add_genre(genre)
 
 
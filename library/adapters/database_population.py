@@ -0,0 +1,275 @@
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import and_, bindparam, inspect, select, text
+from sqlalchemy.orm import clear_mappers
+from sqlalchemy.schema import CreateIndex, CreateTable
+from werkzeug.security import generate_password_hash
+
+from library.adapters import repository_populate
+from library.adapters.csv_data_importer import SOURCE_FILES, BOOK_COLUMNS, read_csv_file
+from library.adapters.orm import (
+    metadata, map_model_to_tables, authors_table, publishers_table, books_table, genres_table, book_genres_table,
+    users_table, reviews_table, population_fingerprints_table
+)
+from library.adapters.repository import AbstractRepository, _utc_now
+from library.domain.model import Author, Publisher, User, make_book
+
+# Fingerprint of the tables and indexes the database was created with.
+SCHEMA = 'schema'
+
+# What prepare_database did.
+RESET, UPDATED, CURRENT, ADOPTED = 'reset', 'updated', 'current', 'adopted'
+
+
+def prepare_database(engine, data_path: Path, repository: AbstractRepository, reset: bool = False) -> str:
+    """ Makes sure the database holds the content of the CSV files in data_path, doing as little as it can.
+
+    The digests of the CSV files and of the schema are stored in the population_fingerprints table. When they all
+    match, nothing is loaded. When only CSV files changed, their rows are upserted (see update_database) in one
+    transaction. When the schema changed, the database is empty, or reset is set, the tables are dropped and created
+    again, which is much faster than deleting their rows, and populated in full. A database populated before
+    fingerprints were kept is taken to be current, as it was before.
+
+    The domain model is mapped to the tables on return. Returns RESET, UPDATED, CURRENT or ADOPTED.
+    """
+    clear_mappers()
+    current = source_fingerprints(engine, data_path)
+    stored = stored_fingerprints(engine)
+
+    if stored is None and not reset and _has_table(engine, books_table.name):
+        # Databases created before the rating aggregates existed need the summary table, filled from the reviews.
+        missing_summaries = not _has_table(engine, 'book_rating_summaries')
+        metadata.create_all(engine)
+        map_model_to_tables()
+        if missing_summaries:
+            repository.rebuild_rating_summaries()
+        with engine.begin() as connection:
+            record_fingerprints(connection, current)
+        return ADOPTED
+
+    if reset or not stored or stored.get(SCHEMA) != current[SCHEMA]:
+        reset_database(engine)
+        map_model_to_tables()
+        repository_populate.populate(data_path, repository, True)
+        with engine.begin() as connection:
+            record_fingerprints(connection, current)
+        return RESET
+
+    map_model_to_tables()
+    changed = [source for source in SOURCE_FILES if stored.get(source) != current[source]]
+    if len(changed) == 0:
+        return CURRENT
+    with engine.begin() as connection:
+        update_database(connection, data_path, changed)
+        record_fingerprints(connection, current)
+    return UPDATED
+
+
+def source_fingerprints(engine, data_path: Path) -> dict:
+    fingerprints = {source: file_digest(Path(data_path) / source) for source in SOURCE_FILES}
+    fingerprints[SCHEMA] = schema_digest(engine)
+    return fingerprints
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema_digest(engine) -> str:
+    # The DDL of every table and index, so that any change to orm.py's tables changes it.
+    digest = hashlib.sha256()
+    for table in metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(str(CreateIndex(index).compile(dialect=engine.dialect)).encode())
+    return digest.hexdigest()
+
+
+def stored_fingerprints(engine):
+    """ The fingerprints recorded when the database was last populated, or None if it has never recorded any. """
+    if not _has_table(engine, population_fingerprints_table.name):
+        return None
+    with engine.connect() as connection:
+        return dict(connection.execute(
+            select(population_fingerprints_table.c.source, population_fingerprints_table.c.digest)
+        ).fetchall())
+
+
+def record_fingerprints(connection, fingerprints: dict):
+    connection.execute(population_fingerprints_table.delete())
+    connection.execute(population_fingerprints_table.insert(), [
+        {'source': source, 'digest': digest} for source, digest in fingerprints.items()
+    ])
+
+
+def reset_database(engine):
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+
+def update_database(connection, data_path: Path, changed):
+    """ Upserts the rows of the changed CSV files into the database.
+
+    Authors, publishers and books are matched by id: new ones are inserted, and those whose columns differ are
+    updated, along with the genres of changed books. Users are matched by name and only new ones are added, since
+    the stored password hashes are as good as the CSV's passwords. Reviews, which have no id, are matched by user,
+    book, text and rating, and only new ones are added. The rating aggregates are then recomputed. Rows missing from
+    a file are left in the database. The repository version is bumped, so caches in other processes drop what
+    changed.
+    """
+    data_path = Path(data_path)
+    if 'authors.csv' in changed:
+        authors = (Author(int(row[0]), row[1]) for row in read_csv_file(data_path / 'authors.csv'))
+        _upsert(connection, authors_table, 'author_id',
+                [{'author_id': author.unique_id, 'full_name': author.full_name} for author in authors])
+
+    if 'publishers.csv' in changed:
+        publishers = (Publisher(int(row[0]), row[1]) for row in read_csv_file(data_path / 'publishers.csv'))
+        _upsert(connection, publishers_table, 'publisher_id',
+                [{'publisher_id': publisher.publisher_id, 'name': publisher.name} for publisher in publishers])
+
+    if 'books.csv' in changed:
+        _update_books(connection, data_path / 'books.csv')
+
+    if 'users.csv' in changed:
+        existing = set(connection.execute(select(users_table.c.user_name)).scalars())
+        users = [User(row[1], generate_password_hash(row[2])) for row in read_csv_file(data_path / 'users.csv')
+                 if _user_name(row[1]) not in existing]
+        if users:
+            connection.execute(users_table.insert(), [
+                {'user_name': user.user_name, 'password': user.password} for user in users
+            ])
+
+    if 'users.csv' in changed or 'reviews.csv' in changed:
+        _add_new_reviews(connection, data_path)
+
+    if {'books.csv', 'users.csv', 'reviews.csv'} & set(changed):
+        _rebuild_rating_summaries(connection)
+
+    _bump_version(connection)
+
+
+def _update_books(connection, books_path: Path):
+    books = list()
+    book_genre_names = dict()
+    for row in read_csv_file(books_path):
+        book = make_book(int(row[0]), int(row[1]), row[2], int(row[3]), int(row[4]), row[5], row[6])
+        books.append({
+            'book_id': book.book_id, 'title': book.title, 'release_year': book.release_year,
+            'publisher': book.publisher, 'author': book.author, 'description': book.description,
+            'imgurl': book.imgurl
+        })
+        book_genre_names[book.book_id] = {genre for genre in row[BOOK_COLUMNS:] if genre.strip() != ''}
+    _upsert(connection, books_table, 'book_id', books)
+
+    genre_ids = dict(connection.execute(select(genres_table.c.genre_name, genres_table.c.genre_id)).fetchall())
+    new_genres = sorted(set().union(*book_genre_names.values()) - set(genre_ids))
+    if new_genres:
+        connection.execute(genres_table.insert(), [{'genre_name': name} for name in new_genres])
+        genre_ids = dict(connection.execute(select(genres_table.c.genre_name, genres_table.c.genre_id)).fetchall())
+
+    wanted = {(book_id, genre_ids[name]) for book_id, names in book_genre_names.items() for name in names}
+    stored = {
+        (book_id, genre_id)
+        for book_id, genre_id in connection.execute(select(book_genres_table.c.book_id, book_genres_table.c.genre_id))
+        if book_id in book_genre_names
+    }
+    if stored - wanted:
+        connection.execute(
+            book_genres_table.delete().where(and_(book_genres_table.c.book_id == bindparam('old_book_id'),
+                                                  book_genres_table.c.genre_id == bindparam('old_genre_id'))),
+            [{'old_book_id': book_id, 'old_genre_id': genre_id} for book_id, genre_id in sorted(stored - wanted)]
+        )
+    if wanted - stored:
+        connection.execute(book_genres_table.insert(), [
+            {'book_id': book_id, 'genre_id': genre_id} for book_id, genre_id in sorted(wanted - stored)
+        ])
+
+
+def _add_new_reviews(connection, data_path: Path):
+    # reviews.csv refers to users by their id in users.csv, and the database by the id it gave them.
+    user_names = {row[0]: _user_name(row[1]) for row in read_csv_file(data_path / 'users.csv')}
+    user_ids = dict(connection.execute(select(users_table.c.user_name, users_table.c.user_id)).fetchall())
+    book_ids = set(connection.execute(select(books_table.c.book_id)).scalars())
+
+    stored = dict()
+    for key in connection.execute(select(reviews_table.c.user_id, reviews_table.c.book_id,
+                                         reviews_table.c.review_text, reviews_table.c.rating)):
+        stored[tuple(key)] = stored.get(tuple(key), 0) + 1
+
+    timestamp = datetime.now()
+    new_reviews = list()
+    for row in read_csv_file(data_path / 'reviews.csv'):
+        key = (user_ids.get(user_names.get(row[0])), int(row[1]), row[2].strip(), int(row[3]))
+        if stored.get(key, 0) > 0:
+            # Each stored review accounts for one identical row.
+            stored[key] -= 1
+        elif key[0] is not None and key[1] in book_ids:
+            new_reviews.append({'user_id': key[0], 'book_id': key[1], 'review_text': key[2], 'rating': key[3],
+                                'timestamp': timestamp})
+    if new_reviews:
+        connection.execute(reviews_table.insert(), new_reviews)
+
+
+def _upsert(connection, table, key: str, rows: list):
+    # Inserts the rows with new keys, and updates those differing from what is stored.
+    columns = [table.c[name] for name in rows[0]] if rows else []
+    stored = {row[0]: tuple(row) for row in connection.execute(select(*columns))}
+    inserts = [row for row in rows if row[key] not in stored]
+    updates = [
+        dict(row, _key=row[key]) for row in rows if row[key] in stored and stored[row[key]] != tuple(row.values())
+    ]
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    if updates:
+        connection.execute(
+            table.update().where(table.c[key] == bindparam('_key')).values(
+                {name: bindparam(name) for name in rows[0] if name != key}
+            ),
+            updates
+        )
+
+
+def _rebuild_rating_summaries(connection):
+    # The same aggregation as SqlAlchemyRepository.rebuild_rating_summaries, inside the update's transaction, plus the
+    # empty summaries a full population stores for books without reviews.
+    connection.execute(text('DELETE FROM book_rating_summaries'))
+    connection.execute(text(
+        'INSERT INTO book_rating_summaries (book_id, review_count, rating_total, average_rating, latest_review, '
+        'one_star, two_stars, three_stars, four_stars, five_stars) '
+        'SELECT book_id, COUNT(*), SUM(rating), AVG(rating), MAX(timestamp), '
+        'SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5) '
+        'FROM reviews WHERE book_id IS NOT NULL GROUP BY book_id'))
+    connection.execute(text(
+        'INSERT INTO book_rating_summaries (book_id, review_count, rating_total, average_rating, latest_review, '
+        'one_star, two_stars, three_stars, four_stars, five_stars) '
+        'SELECT book_id, 0, 0, NULL, NULL, 0, 0, 0, 0, 0 FROM books '
+        'WHERE book_id NOT IN (SELECT book_id FROM book_rating_summaries)'))
+
+
+def _bump_version(connection):
+    # The same statements as SqlAlchemyRepository.bump_version.
+    parameters = {'last_modified': _utc_now()}
+    result = connection.execute(
+        text('UPDATE repository_version SET version = version + 1, last_modified = :last_modified '
+             'WHERE version_id = 1'),
+        parameters)
+    if result.rowcount == 0:
+        connection.execute(
+            text('INSERT INTO repository_version (version_id, version, last_modified) VALUES (1, 1, :last_modified)'),
+            parameters)
+
+
+def _has_table(engine, name: str) -> bool:
+    return inspect(engine).has_table(name)
+
+
+def _user_name(name: str) -> str:
+    # Normalised as the User model does.
+    return User(name, '').user_name
@@ -1,14 +1,26 @@
-from datetime import date
-from typing import List
+from datetime import date, datetime
+from typing import List, Iterator
 
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, inspect, bindparam, text
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import scoped_session, Session, selectinload
 from flask import _app_ctx_stack
 
-from library.domain.model import Publisher, Author, Book, Review, User, Genre
-from library.adapters.repository import AbstractRepository
+from library.domain.model import Publisher, Author, Book, Review, User, Genre, RatingSummary, make_book, make_review
+from library.adapters.repository import (
+    AbstractRepository, CatalogueDelta, RepositoryVersion, update_book, _started, _utc_now
+)
+
+# SQLite (before 3.32) refuses statements with more bound parameters than this.
+MAX_BOUND_PARAMETERS = 999
+
+# Every book's rating aggregates, computed from the reviews table.
+RATING_SUMMARIES = ('INSERT INTO book_rating_summaries (book_id, review_count, rating_total, average_rating, '
+                    'latest_review, one_star, two_stars, three_stars, four_stars, five_stars) '
+                    'SELECT book_id, COUNT(*), SUM(rating), AVG(rating), MAX(timestamp), '
+                    'SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5) '
+                    'FROM reviews WHERE book_id IS NOT NULL')
 
 
 class SessionContextManager:
@@ -54,6 +66,26 @@ class SqlAlchemyRepository(AbstractRepository):
     def reset_session(self):
         self._session_cm.reset_session()
 
+    def get_version(self) -> RepositoryVersion:
+        row = self._session_cm.session.execute(
+            'SELECT version, last_modified FROM repository_version WHERE version_id = 1').fetchone()
+
+        if row is None:
+            return RepositoryVersion(0, _started)
+        return RepositoryVersion(row[0], _to_datetime(row[1]))
+
+    def bump_version(self):
+        # Runs inside the caller's session, so the new version is committed together with the write it records.
+        session = self._session_cm.session
+        parameters = {'last_modified': _utc_now()}
+        result = session.execute(
+            'UPDATE repository_version SET version = version + 1, last_modified = :last_modified WHERE version_id = 1',
+            parameters)
+        if result.rowcount == 0:
+            session.execute(
+                'INSERT INTO repository_version (version_id, version, last_modified) VALUES (1, 1, :last_modified)',
+                parameters)
+
     def add_user(self, user: User):
         with self._session_cm as scm:
             scm.session.add(user)
@@ -69,9 +101,45 @@ class SqlAlchemyRepository(AbstractRepository):
 
         return user
 
+    def detach(self, value):
+        # Copies the entities, with everything a page shows of them loaded, into a throwaway session which is then
+        # closed. The copies belong to no session, so no commit can expire them and no request's session owns them.
+        entities = _mapped_entities(value)
+        if len(entities) == 0:
+            return value
+        for entity in entities:
+            _load_for_detaching(entity)
+        snapshot_session = Session()
+        copies = [snapshot_session.merge(entity, load=False) for entity in entities]
+        snapshot_session.close()
+        return copies if isinstance(value, list) else copies[0]
+
+    def attach(self, value):
+        # Copies a detached snapshot into the current session, without emitting any SQL.
+        entities = _mapped_entities(value)
+        if len(entities) == 0:
+            return value
+        session = self._session_cm.session
+        copies = [session.merge(entity, load=False) for entity in entities]
+        return copies if isinstance(value, list) else copies[0]
+
+    def attach_user(self, user: User) -> User:
+        session = self._session_cm.session
+        if user in session:
+            # Keep the caller's instance out of this session, so that commits here never expire it.
+            session.expunge(user)
+        # Copies the instance's state into the session without querying the database.
+        return session.merge(user, load=False)
+
+    def update_user(self, user: User):
+        with self._session_cm as scm:
+            scm.session.add(user)
+            scm.commit()
+
     def add_book(self, book: Book):
         with self._session_cm as scm:
             scm.session.add(book)
+            self.bump_version()
             scm.commit()
 
     def get_book(self, id: int) -> Book:
@@ -88,6 +156,30 @@ class SqlAlchemyRepository(AbstractRepository):
         books = self._session_cm.session.query(Book).all()
         return books
 
+    def iter_books(self, after_id: int = None, batch_size: int = 500) -> Iterator[Book]:
+        # Keyset pagination: each batch is a short query for the next batch_size ids, so no cursor (and no SQLite
+        # read lock) stays open while the caller consumes the books, and a batch is released before the next one
+        # is fetched. Only the batch's books and rating summaries are expunged; whatever else the request holds in
+        # the session stays attached.
+        session = self._session_cm.session
+        last_id = after_id
+        while True:
+            query = session.query(Book) \
+                .options(selectinload(Book._Book__genres), selectinload(Book._Book__rating_summary)) \
+                .order_by(asc(Book._Book__book_id))
+            if last_id is not None:
+                query = query.filter(Book._Book__book_id > last_id)
+            books = query.limit(batch_size).all()
+            if len(books) == 0:
+                return
+            last_id = books[-1].book_id
+            yield from books
+            for book in books:
+                summary = book._Book__rating_summary
+                if summary is not None and summary in session:
+                    session.expunge(summary)
+                session.expunge(book)
+
     def get_books_by_release_year(self, target_year) -> List[Book]:
         if target_year is None:
             books = self._session_cm.session.query(Book).all()
@@ -110,8 +202,21 @@ class SqlAlchemyRepository(AbstractRepository):
         return book
 
     def get_books_by_id(self, id_list: List[int]):
-        books = self._session_cm.session.query(Book).filter(Book._Book__book_id.in_(id_list)).all()
-        return books
+        # Deduplicate, keeping the requested order, and query in chunks that stay under SQLite's limit on the
+        # number of bound parameters. Reviews (with their users), genres and rating summaries are loaded for the
+        # whole chunk with one further query each, instead of one query per book as the page is rendered.
+        ids = list(dict.fromkeys(id_list))
+        books_by_id = dict()
+        for start in range(0, len(ids), MAX_BOUND_PARAMETERS):
+            chunk = ids[start:start + MAX_BOUND_PARAMETERS]
+            books = self._session_cm.session.query(Book) \
+                .filter(Book._Book__book_id.in_(chunk)) \
+                .options(selectinload(Book._Book__reviews).selectinload(Review._Review__user),
+                         selectinload(Book._Book__genres).selectinload(Genre._Genre__genre_books),
+                         selectinload(Book._Book__rating_summary)) \
+                .all()
+            books_by_id.update((book.book_id, book) for book in books)
+        return [books_by_id[id] for id in ids if id in books_by_id]
 
     def get_book_ids_for_genre(self, genre_name: str):
         book_ids = []
@@ -134,44 +239,24 @@ class SqlAlchemyRepository(AbstractRepository):
         return book_ids
 
     def get_book_ids_for_author(self, author_name: str):
-        book_ids = []
-
-        # Use native SQL to retrieve article ids, since there is no mapped class for the article_tags table.
-        row = self._session_cm.session.execute('SELECT authors.id FROM authors WHERE author.full_name = :author.full_name',{'author.full_name': author_name}).fetchall()
+        # Books refer to their author by id, without a mapped relationship.
+        book_ids = self._session_cm.session.execute(
+                'SELECT books.book_id FROM books JOIN authors ON books.author = authors.author_id '
+                'WHERE authors.full_name = :full_name ORDER BY books.book_id ASC',
+                {'full_name': author_name}
+        ).fetchall()
 
-        if row is None:
-            # No tag with the name tag_name - create an empty list.
-            book_ids = list()
-        else:
-            author_id = row[0]
-            # Retrieve article ids of articles associated with the tag.
-            book_ids = self._session_cm.session.execute(
-                    'SELECT books.id FROM authors WHERE author.id = :author.id ORDER BY author.id ASC',
-                    {'author.id': author_id}
-            ).fetchall()
-            book_ids = [id[0] for id in book_ids]
-
-        return book_ids
+        return [id[0] for id in book_ids]
 
     def get_book_ids_for_publisher(self, publisher_name: str):
-        book_ids = []
+        # Books refer to their publisher by id, without a mapped relationship.
+        book_ids = self._session_cm.session.execute(
+                'SELECT books.book_id FROM books JOIN publishers ON books.publisher = publishers.publisher_id '
+                'WHERE publishers.name = :name ORDER BY books.book_id ASC',
+                {'name': publisher_name}
+        ).fetchall()
 
-        # Use native SQL to retrieve article ids, since there is no mapped class for the article_tags table.
-        row = self._session_cm.session.execute('SELECT id FROM publishers WHERE publishers.name = :publishers.name', {'publishers.name': publisher_name}).fetchone()
-
-        if row is None:
-            # No tag with the name tag_name - create an empty list.
-            book_ids = list()
-        else:
-            publisher_id = row[0]
-            # Retrieve article ids of articles associated with the tag.
-            book_ids = self._session_cm.session.execute(
-                    'SELECT books.id FROM publishers WHERE publisher.id = :publisher.id ORDER BY publisher.id ASC',
-                    {'publisher_id': publisher_id}
-            ).fetchall()
-            book_ids = [id[0] for id in book_ids]
-
-        return book_ids
+        return [id[0] for id in book_ids]
 
     def get_release_year_of_previous_book(self, book: Book):
         result = None
@@ -194,6 +279,7 @@ class SqlAlchemyRepository(AbstractRepository):
     def add_author(self, author: Author):
         with self._session_cm as scm:
             scm.session.add(author)
+            self.bump_version()
             scm.commit()
 
     # def get_author(self, author_id: int) -> Author:
@@ -213,6 +299,7 @@ class SqlAlchemyRepository(AbstractRepository):
     def add_publisher(self, publisher: Publisher):
         with self._session_cm as scm:
             scm.session.add(publisher)
+            self.bump_version()
             scm.commit()
 
     # def get_publisher(self, publisher_id: int) -> Publisher:
@@ -232,6 +319,7 @@ class SqlAlchemyRepository(AbstractRepository):
     def add_genre(self, genre: Genre):
         with self._session_cm as scm:
             scm.session.add(genre)
+            self.bump_version()
             scm.commit()
 
     def get_genres(self) -> List[Genre]:
@@ -242,8 +330,148 @@ class SqlAlchemyRepository(AbstractRepository):
         super().add_review(review)
         with self._session_cm as scm:
             scm.session.add(review)
+            self.__update_rating_summaries(scm.session, [review.book])
+            self.bump_version()
+            scm.commit()
+
+    def add_reviews(self, reviews: List[Review]):
+        for review in reviews:
+            AbstractRepository.add_review(self, review)
+        with self._session_cm as scm:
+            scm.session.add_all(reviews)
+            self.__update_rating_summaries(scm.session, [review.book for review in reviews])
+            self.bump_version()
             scm.commit()
 
     def get_reviews(self) -> List[Review]:
         reviews = self._session_cm.session.query(Review).all()
-        return reviews
\ No newline at end of file
+        return reviews
+
+    def apply_catalogue_delta(self, delta: CatalogueDelta):
+        # One transaction: readers see the database as it was, or with the whole delta applied.
+        with self._session_cm as scm:
+            session = scm.session
+            for author in delta.authors:
+                session.merge(author)
+            for publisher in delta.publishers:
+                session.merge(publisher)
+
+            genres = {genre.genre_name: genre for genre in session.query(Genre).all()}
+            ids = [row.book_id for row in delta.books]
+            books = dict()
+            for start in range(0, len(ids), MAX_BOUND_PARAMETERS):
+                books.update((book.book_id, book) for book in session.query(Book)
+                             .filter(Book._Book__book_id.in_(ids[start:start + MAX_BOUND_PARAMETERS]))
+                             .options(selectinload(Book._Book__genres)))
+            for row in delta.books:
+                book = books.get(row.book_id)
+                if book is None:
+                    book = make_book(row.book_id, row.release_year, row.title, row.publisher, row.author,
+                                     row.description, row.imgurl)
+                    session.add(book)
+                    books[book.book_id] = book
+                else:
+                    update_book(book, row)
+
+                # The genre's side of the association follows, through back_populates.
+                for genre in list(book.genres):
+                    if genre.genre_name not in row.genres:
+                        book.remove_genre(genre)
+                book_genres = {genre.genre_name for genre in book.genres}
+                for genre_name in row.genres:
+                    if genre_name not in book_genres:
+                        if genre_name not in genres:
+                            genres[genre_name] = Genre(genre_name)
+                            session.add(genres[genre_name])
+                        book.add_genre(genres[genre_name])
+
+            session.add_all(delta.users)
+
+            users = dict()
+            reviewed = dict()
+            for row in delta.reviews:
+                if row.user_name not in users:
+                    users[row.user_name] = self.get_user(row.user_name)
+                book = books.get(row.book_id) or self.get_book(row.book_id)
+                reviewed[book.book_id] = book
+                session.add(make_review(row.review_text, users[row.user_name], book, row.rating))
+            if reviewed:
+                self.__update_rating_summaries(session, list(reviewed.values()))
+
+            self.bump_version()
+            scm.commit()
+
+    def get_top_rated_books(self, quantity: int) -> List[Book]:
+        books = self._session_cm.session.query(Book).join(Book._Book__rating_summary) \
+            .filter(RatingSummary._RatingSummary__review_count > 0) \
+            .order_by(desc(RatingSummary._RatingSummary__average_rating),
+                      desc(RatingSummary._RatingSummary__review_count),
+                      asc(Book._Book__book_id)) \
+            .limit(quantity).all()
+        return books
+
+    def get_most_reviewed_books(self, quantity: int) -> List[Book]:
+        books = self._session_cm.session.query(Book).join(Book._Book__rating_summary) \
+            .filter(RatingSummary._RatingSummary__review_count > 0) \
+            .order_by(desc(RatingSummary._RatingSummary__review_count),
+                      desc(RatingSummary._RatingSummary__average_rating),
+                      asc(Book._Book__book_id)) \
+            .limit(quantity).all()
+        return books
+
+    def rebuild_rating_summaries(self):
+        # Recomputes every book's rating aggregates from the reviews table, e.g. for a database created before the
+        # summary table existed.
+        with self._session_cm as scm:
+            scm.session.execute('DELETE FROM book_rating_summaries')
+            scm.session.execute(RATING_SUMMARIES + ' GROUP BY book_id')
+            self.bump_version()
+            scm.commit()
+
+    @staticmethod
+    def __update_rating_summaries(session, books: List[Book]):
+        # Adding a review updated its book's summary in memory. Writing those counts back would lose the reviews other
+        # processes stored since the summary was read, so the change is dropped, and the summaries of the books are
+        # computed again from the reviews table, in the transaction storing the reviews.
+        book_ids = list({book.book_id for book in books})
+        for book in books:
+            summary = book._Book__rating_summary
+            if summary is None:
+                continue
+            state = inspect(summary)
+            if state.persistent:
+                session.expire(summary)
+            elif state.pending:
+                # A book's first summary; the row is inserted below.
+                session.expunge(summary)
+        session.flush()
+        for start in range(0, len(book_ids), MAX_BOUND_PARAMETERS):
+            parameters = {'book_ids': book_ids[start:start + MAX_BOUND_PARAMETERS]}
+            session.execute(text('DELETE FROM book_rating_summaries WHERE book_id IN :book_ids')
+                            .bindparams(bindparam('book_ids', expanding=True)), parameters)
+            session.execute(text(RATING_SUMMARIES + ' AND book_id IN :book_ids GROUP BY book_id')
+                            .bindparams(bindparam('book_ids', expanding=True)), parameters)
+
+
+def _mapped_entities(value) -> list:
+    values = value if isinstance(value, list) else [value]
+    if len(values) == 0 or inspect(values[0], raiseerr=False) is None:
+        return []
+    return values
+
+
+def _load_for_detaching(entity):
+    # Loads the relationships that rendering a book touches, since a detached instance cannot lazy-load them.
+    if isinstance(entity, Book):
+        for review in entity.reviews:
+            review.user
+        for genre in entity.genres:
+            genre.genre_books
+        entity.rating_summary
+
+
+def _to_datetime(value):
+    # Raw SQL bypasses the DateTime column type, so SQLite hands the timestamp back as a string.
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
@@ -0,0 +1,41 @@
+import time
+from functools import wraps
+
+from library.adapters.repository import AbstractRepository
+
+# Every method of the repository interface, concrete or abstract.
+REPOSITORY_METHODS = frozenset(
+    name for name, value in vars(AbstractRepository).items() if callable(value) and not name.startswith('_')
+)
+
+
+class InstrumentedRepository:
+    """ Times every AbstractRepository method called on another repository.
+
+    record(method, seconds) is called after each call, whether it returned or raised. Methods returning a generator
+    (iter_books) are timed until the generator is returned, not while it is consumed. Anything else the wrapped
+    repository offers (e.g. reset_session) is passed through untimed.
+    """
+
+    def __init__(self, repository, record):
+        self.repository = repository
+        self.__record = record
+
+    def __getattr__(self, name):
+        attribute = getattr(self.repository, name)
+        if name not in REPOSITORY_METHODS:
+            return attribute
+
+        record = self.__record
+
+        @wraps(attribute)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+
+        # Kept on the instance, so later calls do not come through __getattr__ again.
+        setattr(self, name, timed)
+        return timed
@@ -1,10 +1,13 @@
-from typing import List
+import threading
+from typing import List, Iterator
 
-from bisect import bisect_left, insort_left
+from bisect import bisect_left, bisect_right, insort_left
 
 
-from library.adapters.repository import AbstractRepository
-from library.domain.model import Publisher, Author, Book, Review, User, Genre
+from library.adapters.repository import AbstractRepository, CatalogueDelta, update_book
+from library.domain.model import (
+    Publisher, Author, Book, Review, User, Genre, make_book, make_genre_association, make_review
+)
 
 class MemoryRepository(AbstractRepository):
     # Articles ordered by date, not id. id is assumed unique.
@@ -18,15 +21,42 @@ class MemoryRepository(AbstractRepository):
         self.__users = list()
         self.__reviews = list()
 
+        # Rankings of reviewed books, kept sorted as reviews arrive. Each maps a book id to its current sort key.
+        self.__top_rated = list()
+        self.__top_rated_keys = dict()
+        self.__most_reviewed = list()
+        self.__most_reviewed_keys = dict()
+
+        # Writes take the lock, so that a hand-over sees all of them or none. The users and reviews added since
+        # mark_populated() are recorded, and passed to the hand-over's carry_over once there is one.
+        self.__write_lock = threading.Lock()
+        self.__additions = None
+        self.__carry_over = None
+
     def add_user(self, user: User):
-        self.__users.append(user)
+        with self.__write_lock:
+            if self.__carry_over is not None:
+                self.__carry_over([user], [])
+                return
+            self.__users.append(user)
+            if self.__additions is not None:
+                self.__additions[0].append(user)
 
     def get_user(self, user_name) -> User:
         return next((user for user in self.__users if user.user_name == user_name), None)
 
+    def get_users(self) -> List[User]:
+        return self.__users
+
+    def update_user(self, user: User):
+        # Users are held by reference, so the change is already visible.
+        pass
+
     def add_book(self, book: Book):
         insort_left(self.__books, book)
         self.__books_index[book.book_id] = book
+        self.update_rankings(book)
+        self.bump_version()
 
     def get_book(self, book_id: int) -> Book:
         book = None
@@ -41,6 +71,13 @@ class MemoryRepository(AbstractRepository):
     def get_all_books(self) -> List[Book]:
         return self.__books
 
+    def iter_books(self, after_id: int = None, batch_size: int = 500) -> Iterator[Book]:
+        # Books are kept in order of id, so the position to resume from is found by bisection.
+        index = 0 if after_id is None else bisect_right(self.__books, Book(None, book_id=after_id))
+        while index < len(self.__books):
+            yield self.__books[index]
+            index += 1
+
     def get_books_by_release_year(self, target_year) -> List[Book]:
         matching_books = list()
         try:
@@ -71,11 +108,13 @@ class MemoryRepository(AbstractRepository):
         return book
 
     def get_books_by_id(self, id_list):
-        # Strip out any ids in id_list that don't represent Book ids in the repository.
-        existing_ids = [id for id in id_list if id in self.__books_index]
-
-        # Fetch the Articles.
-        books = [self.__books_index[id] for id in existing_ids]
+        # Fetch the Books in the requested order, skipping duplicates and ids that don't represent a Book.
+        books = []
+        seen = set()
+        for id in id_list:
+            if id not in seen and id in self.__books_index:
+                seen.add(id)
+                books.append(self.__books_index[id])
         return books
 
     def get_book_ids_for_genre(self, genre_name: str):
@@ -97,7 +136,7 @@ class MemoryRepository(AbstractRepository):
 
         # Retrieve the ids of articles associated with the Genre.
         if author is not None:
-            book_ids = [book.book_id for book in author.books]
+            book_ids = [book.book_id for book in self.__books if book.author == author.unique_id]
         else:
             # No genre with name genre_name, so return an empty list.
             book_ids = list()
@@ -110,7 +149,7 @@ class MemoryRepository(AbstractRepository):
 
         # Retrieve the ids of articles associated with the Genre.
         if publisher is not None:
-            book_ids = [book.book_id for book in publisher.books]
+            book_ids = [book.book_id for book in self.__books if book.publisher == publisher.publisher_id]
         else:
             # No genre with name genre_name, so return an empty list.
             book_ids = list()
@@ -149,18 +188,21 @@ class MemoryRepository(AbstractRepository):
 
     def add_author(self, author: Author):
         self.__authors.append(author)
+        self.bump_version()
 
     def get_authors(self) -> List[Author]:
         return self.__authors
 
     def add_publisher(self, publisher: Publisher):
         self.__publishers.append(publisher)
+        self.bump_version()
 
     def get_publishers(self) -> List[Publisher]:
         return self.__publishers
 
     def add_genre(self, genre: Genre):
         self.__genres.append(genre)
+        self.bump_version()
 
     def get_genres(self) -> List[Genre]:
         return self.__genres
@@ -168,11 +210,136 @@ class MemoryRepository(AbstractRepository):
     def add_review(self, review: Review):
         # call parent class first, add_review relies on implementation of code common to all derived classes
         super().add_review(review)
-        self.__reviews.append(review)
+        with self.__write_lock:
+            if self.__carry_over is not None:
+                self.__carry_over([], [review])
+                return
+            self.__reviews.append(review)
+            if self.__additions is not None:
+                self.__additions[1].append(review)
+            self.update_rankings(review.book)
+        self.bump_version()
 
     def get_reviews(self):
         return self.__reviews
 
+    def apply_catalogue_delta(self, delta: CatalogueDelta):
+        with self.__write_lock:
+            self.__apply_catalogue_delta(delta)
+        self.bump_version()
+
+    def __apply_catalogue_delta(self, delta: CatalogueDelta):
+        # Entities are changed in place, so everything holding them (genres, users, cached pages' data) sees the
+        # change; the indexes and rankings are updated as the add_* methods do. The users and reviews come from the
+        # CSV files, so are not recorded as additions.
+        authors = {author.unique_id: author for author in self.__authors}
+        for author in delta.authors:
+            if author.unique_id in authors:
+                authors[author.unique_id].full_name = author.full_name
+            else:
+                self.__authors.append(author)
+                authors[author.unique_id] = author
+
+        publishers = {publisher.publisher_id: publisher for publisher in self.__publishers}
+        for publisher in delta.publishers:
+            if publisher.publisher_id in publishers:
+                publishers[publisher.publisher_id].name = publisher.name
+            else:
+                self.__publishers.append(publisher)
+                publishers[publisher.publisher_id] = publisher
+
+        genres = {genre.genre_name: genre for genre in self.__genres}
+        for row in delta.books:
+            book = self.__books_index.get(row.book_id)
+            if book is None:
+                book = make_book(row.book_id, row.release_year, row.title, row.publisher, row.author, row.description,
+                                 row.imgurl)
+                insort_left(self.__books, book)
+                self.__books_index[book.book_id] = book
+            else:
+                update_book(book, row)
+
+            for genre in list(book.genres):
+                if genre.genre_name not in row.genres:
+                    book.remove_genre(genre)
+                    genre.remove_book(book)
+            book_genres = {genre.genre_name for genre in book.genres}
+            for genre_name in row.genres:
+                if genre_name not in book_genres:
+                    if genre_name not in genres:
+                        genres[genre_name] = Genre(genre_name)
+                        self.__genres.append(genres[genre_name])
+                    make_genre_association(book, genres[genre_name])
+
+        self.__users.extend(delta.users)
+
+        for row in delta.reviews:
+            book = self.__books_index[row.book_id]
+            self.__reviews.append(make_review(row.review_text, self.get_user(row.user_name), book, row.rating))
+            self.update_rankings(book)
+
+    def mark_populated(self):
+        """ Starts recording the users and reviews added to the repository from now on, as opposed to those it was
+        populated with (which are in the CSV files).
+        """
+        with self.__write_lock:
+            self.__additions = (list(), list())
+
+    def hand_over(self, carry_over):
+        """ Passes the users and reviews added since mark_populated() to carry_over(users, reviews), and from then on
+        each one added as it comes, instead of storing it: for a repository being replaced by another. Writes wait
+        meanwhile, so that none is lost or passed on twice.
+        """
+        with self.__write_lock:
+            users, reviews = self.__additions if self.__additions is not None else (list(), list())
+            carry_over(users, reviews)
+            self.__carry_over = carry_over
+
+    def get_top_rated_books(self, quantity: int) -> List[Book]:
+        return [self.__books_index[key[-1]] for key in self.__top_rated[:quantity]]
+
+    def get_most_reviewed_books(self, quantity: int) -> List[Book]:
+        return [self.__books_index[key[-1]] for key in self.__most_reviewed[:quantity]]
+
+    def release(self, batch_size: int = 1000):
+        """ Empties the repository, freeing its entities a batch at a time.
+
+        Books, genres, users and reviews refer to each other in cycles, which only a full garbage collection would
+        otherwise find; with a large catalogue it stops every thread for as long as a second. The references are
+        broken here instead, and the entities are freed as they are dropped. Call it once nothing uses the repository.
+        """
+        self.__books_index.clear()
+        for ranking in (self.__top_rated, self.__top_rated_keys, self.__most_reviewed, self.__most_reviewed_keys):
+            ranking.clear()
+        for genre in self.__genres:
+            genre.clear_references()
+        for user in self.__users:
+            user.clear_references()
+        for book in self.__books:
+            book.clear_references()
+        for entities in (self.__reviews, self.__books, self.__users, self.__genres, self.__authors, self.__publishers):
+            while entities:
+                del entities[-batch_size:]
+
+    # Helper method to move a book to its place in the rankings after its rating summary changed.
+    def update_rankings(self, book: Book):
+        summary = book.rating_summary
+        if summary.review_count == 0:
+            return
+
+        top_rated_key = (-summary.average_rating, -summary.review_count, book.book_id)
+        most_reviewed_key = (-summary.review_count, -summary.average_rating, book.book_id)
+        self.rerank(self.__top_rated, self.__top_rated_keys, book.book_id, top_rated_key)
+        self.rerank(self.__most_reviewed, self.__most_reviewed_keys, book.book_id, most_reviewed_key)
+
+    @staticmethod
+    def rerank(ranking: list, keys: dict, book_id: int, key: tuple):
+        old_key = keys.get(book_id)
+        if old_key is not None:
+            del ranking[bisect_left(ranking, old_key)]
+        insort_left(ranking, key)
+        keys[book_id] = key
+
     # Helper method to return book index.
     def book_index(self, book: Book):
         index = bisect_left(self.__books, book)
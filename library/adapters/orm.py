@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    Table, MetaData, Column, Integer, String, Date, DateTime, Boolean,
-    ForeignKey
+    Table, MetaData, Column, Integer, String, Date, DateTime, Boolean, Float,
+    ForeignKey, Index
 )
 from sqlalchemy.orm import mapper, relationship, synonym
 
@@ -65,6 +65,39 @@ book_genres_table = Table(
     Column('genre_id', ForeignKey('genres.genre_id'))
 )
 
+# Running rating aggregates per book, maintained alongside the reviews table; the indexes serve the rankings.
+book_rating_summaries_table = Table(
+    'book_rating_summaries', metadata,
+    Column('book_id', ForeignKey('books.book_id'), primary_key=True),
+    Column('review_count', Integer, nullable=False),
+    Column('rating_total', Integer, nullable=False),
+    Column('average_rating', Float, nullable=True),
+    Column('latest_review', DateTime, nullable=True),
+    Column('one_star', Integer, nullable=False),
+    Column('two_stars', Integer, nullable=False),
+    Column('three_stars', Integer, nullable=False),
+    Column('four_stars', Integer, nullable=False),
+    Column('five_stars', Integer, nullable=False),
+    Index('ix_book_rating_summaries_top_rated', 'average_rating', 'review_count'),
+    Index('ix_book_rating_summaries_most_reviewed', 'review_count', 'average_rating')
+)
+
+# Single-row table holding the repository's change version, so that every process sharing the database agrees on it.
+repository_version_table = Table(
+    'repository_version', metadata,
+    Column('version_id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('last_modified', DateTime, nullable=False)
+)
+
+# Digests of the CSV files the database was populated from, and of its schema, so that startup can tell whether it
+# needs populating again (see database_population).
+population_fingerprints_table = Table(
+    'population_fingerprints', metadata,
+    Column('source', String(255), primary_key=True),
+    Column('digest', String(64), nullable=False)
+)
+
 
 def map_model_to_tables():
     mapper(model.User, users_table, properties={
@@ -90,7 +123,19 @@ def map_model_to_tables():
         '_Book__ebook': books_table.c.ebook,
         '_Book__num_pages': books_table.c.num_pages,
         '_Book__reviews': relationship(model.Review, backref='_Review__book'),
-        '_Book__genres': relationship(model.Genre, secondary=book_genres_table, back_populates='_Genre__genre_books')
+        '_Book__genres': relationship(model.Genre, secondary=book_genres_table, back_populates='_Genre__genre_books'),
+        '_Book__rating_summary': relationship(model.RatingSummary, uselist=False)
+    })
+    mapper(model.RatingSummary, book_rating_summaries_table, properties={
+        '_RatingSummary__review_count': book_rating_summaries_table.c.review_count,
+        '_RatingSummary__rating_total': book_rating_summaries_table.c.rating_total,
+        '_RatingSummary__average_rating': book_rating_summaries_table.c.average_rating,
+        '_RatingSummary__latest_review': book_rating_summaries_table.c.latest_review,
+        '_RatingSummary__one_star': book_rating_summaries_table.c.one_star,
+        '_RatingSummary__two_stars': book_rating_summaries_table.c.two_stars,
+        '_RatingSummary__three_stars': book_rating_summaries_table.c.three_stars,
+        '_RatingSummary__four_stars': book_rating_summaries_table.c.four_stars,
+        '_RatingSummary__five_stars': book_rating_summaries_table.c.five_stars
     })
     mapper(model.Publisher, publishers_table, properties={
         '_Publisher__publisher_id': publishers_table.c.publisher_id,
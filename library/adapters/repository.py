@@ -1,10 +1,23 @@
 import abc
-from typing import List
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import List, Iterator
 
 from library.domain.model import Author, Book, Review, User, BooksInventory, Genre, Publisher
 
 repo_instance = None
 
+# A repository's change version together with the (UTC, whole second) time of the write that produced it.
+RepositoryVersion = namedtuple('RepositoryVersion', ['version', 'last_modified'])
+
+# A row of books.csv, with the book's genre names sorted, as compared and applied by the catalogue importer.
+BookRow = namedtuple('BookRow', ['book_id', 'release_year', 'title', 'publisher', 'author', 'description', 'imgurl',
+                                 'genres'])
+
+# A row of reviews.csv, with the user it refers to by name rather than by their id in users.csv.
+ReviewRow = namedtuple('ReviewRow', ['user_name', 'book_id', 'review_text', 'rating'])
+
 
 class RepositoryException(Exception):
 
@@ -14,6 +27,26 @@ class RepositoryException(Exception):
 
 class AbstractRepository(abc.ABC):
 
+    def get_version(self) -> RepositoryVersion:
+        """ Returns the repository's change version.
+
+        The version starts at 0 and increases monotonically with every write, so read-only views can derive cache
+        validators from it and tell whether anything they rendered earlier may have changed.
+        """
+        return getattr(self, '_AbstractRepository__version', RepositoryVersion(0, _started))
+
+    def bump_version(self):
+        """ Records that the contents of the repository have changed. Called by every add_* method. """
+        with _version_lock:
+            self.__version = RepositoryVersion(self.get_version().version + 1, _utc_now())
+
+    def continue_version(self, previous: RepositoryVersion):
+        """ Makes the version follow on from previous, that of the repository this one replaces, so that a version is
+        never seen twice with different contents.
+        """
+        with _version_lock:
+            self.__version = RepositoryVersion(max(self.get_version().version, previous.version) + 1, _utc_now())
+
     @abc.abstractmethod
     def add_user(self, user: User):
         """" Adds a User to the repository. """
@@ -27,6 +60,30 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def update_user(self, user: User):
+        """ Stores changes made to a User already in the repository, such as a new password hash. """
+        raise NotImplementedError
+
+    def detach(self, value):
+        """ Returns a copy of value (an entity, a list of entities or a plain value) that can be kept across requests.
+
+        Used by caches. Repositories whose entities are bound to a per-request session override this, along with
+        attach().
+        """
+        return value
+
+    def attach(self, value):
+        """ Returns a copy of a value made by detach(), for use in the current request. """
+        return value
+
+    def attach_user(self, user: User) -> User:
+        """ Returns the instance of a User, obtained in an earlier request (e.g. cached in a session), to use now.
+
+        Lets callers keep a User they have already looked up, rather than looking it up on every request.
+        """
+        return user
+
     @abc.abstractmethod
     def add_book(self, book: Book):
         """ Adds an Book to the repository. """
@@ -48,6 +105,14 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def iter_books(self, after_id: int = None, batch_size: int = 500) -> Iterator[Book]:
+        """ Yields every Book in order of id, starting after the Book with id after_id if one is given.
+
+        Books are fetched batch_size at a time, so memory use does not grow with the size of the catalogue.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_books_by_release_year(self, target_year: int) -> List[Book]:
         """ Returns a list of Books that were published on target_date.
@@ -81,7 +146,8 @@ class AbstractRepository(abc.ABC):
     def get_books_by_id(self, id_list):
         """ Returns a list of Books, whose ids match those in id_list, from the repository.
 
-        If there are no matches, this method returns an empty list.
+        Books are returned in the order of id_list, each only once; ids that match no Book are skipped. If there
+        are no matches, this method returns an empty list.
         """
         raise NotImplementedError
 
@@ -127,6 +193,22 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_top_rated_books(self, quantity: int) -> List[Book]:
+        """ Returns up to quantity reviewed Books, highest average rating first.
+
+        Ties are broken by the number of reviews, then by book id. Served from precomputed rating aggregates.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_most_reviewed_books(self, quantity: int) -> List[Book]:
+        """ Returns up to quantity reviewed Books, most reviews first.
+
+        Ties are broken by average rating, then by book id. Served from precomputed rating aggregates.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def add_genre(self, genre: Genre):
         raise NotImplementedError
@@ -163,22 +245,85 @@ class AbstractRepository(abc.ABC):
     @abc.abstractmethod
     def add_review(self, review: Review):
         """ Adds a Reviews to the repository. """
-        if review.user is None or review not in review.user.reviews:
+        if review.user is None or not _has_review(review.user.reviews, review):
             raise RepositoryException('Review not correctly attached to a User')
-        if review.book is None or review not in review.book.reviews:
+        if review.book is None or not _has_review(review.book.reviews, review):
             raise RepositoryException('Review not correctly attached to an Book')
 
+    def add_reviews(self, reviews: List[Review]):
+        """ Adds a batch of Reviews to the repository.
+
+        Implementations that pay a cost per write (such as a database commit) should override this to store the
+        whole batch at once.
+        """
+        for review in reviews:
+            self.add_review(review)
+
     @abc.abstractmethod
     def get_reviews(self):
         """ Returns the Reviews stored in the repository. """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def apply_catalogue_delta(self, delta: 'CatalogueDelta'):
+        """ Stores the new and changed rows of the catalogue's CSV files, as one write.
+
+        Authors, publishers and books are added, or updated if the repository has one with the same id; a book's
+        genres are set to those of its row, adding any new Genre. Users and reviews are added. The version is bumped
+        once.
+        """
+        raise NotImplementedError
+
+
+class CatalogueDelta:
+    """ The rows of the catalogue's CSV files which a repository does not hold yet, or holds differently. """
+
+    def __init__(self):
+        self.authors: List[Author] = list()
+        self.publishers: List[Publisher] = list()
+        self.books: List[BookRow] = list()
+        self.users: List[User] = list()
+        self.reviews: List[ReviewRow] = list()
+
+    def counts(self) -> dict:
+        return {
+            'authors': len(self.authors), 'publishers': len(self.publishers), 'books': len(self.books),
+            'users': len(self.users), 'reviews': len(self.reviews)
+        }
+
+    def __bool__(self):
+        return any(self.counts().values())
+
+
+def book_row(book: Book) -> BookRow:
+    return BookRow(book.book_id, book.release_year, book.title, book.publisher, book.author, book.description,
+                   book.imgurl, tuple(sorted(genre.genre_name for genre in book.genres)))
+
 
+def update_book(book: Book, row: BookRow):
+    """ Sets the columns of book, but not its genres, to those of row. """
+    book.release_year = row.release_year
+    book.title = row.title
+    book.publisher = row.publisher
+    book.author = row.author
+    book.description = row.description
+    book.imgurl = row.imgurl
 
 
+_version_lock = threading.Lock()
 
 
+def _has_review(reviews, review) -> bool:
+    # As review in reviews, but from the newest: a review is attached just before it is added, and looking through
+    # all the older ones first made loading many reviews of a user or a book take quadratic time.
+    if not isinstance(reviews, list):
+        reviews = list(reviews)
+    return any(other is review or other == review for other in reversed(reviews))
 
 
+def _utc_now():
+    # HTTP dates have a resolution of one second, and werkzeug compares them as naive UTC datetimes.
+    return datetime.utcnow().replace(microsecond=0)
 
 
+_started = _utc_now()
@@ -0,0 +1,193 @@
+import hmac
+import logging
+import re
+import sys
+import threading
+import time
+
+from flask import request, Response, current_app, jsonify
+from sqlalchemy import event
+
+from library.adapters.instrumented_repository import REPOSITORY_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Statements SQLite can explain; the others (transaction control, PRAGMA, DDL) are logged without a plan.
+EXPLAINABLE = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'))
+
+# Longest parameter list, as text, kept with a slow statement.
+MAX_PARAMETERS_LENGTH = 200
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+# Writes to the users table, whose parameters (password hashes among them) are never shown.
+_USERS_WRITE = re.compile(r'^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE)\s+["`]?users\b', re.IGNORECASE)
+REDACTED = '(redacted)'
+
+
+class SlowStatement:
+    """ The slow executions of one normalised statement, aggregated. """
+
+    __slots__ = ('statement', 'count', 'total', 'slowest', 'parameters', 'methods', 'plan')
+
+    def __init__(self, statement: str, plan: str = None):
+        self.statement = statement
+        self.count = 0
+        self.total = self.slowest = 0.0
+        self.parameters = None  # of the slowest execution
+        self.methods = dict()  # repository method -> slow executions
+        self.plan = plan
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class SlowQueryLog:
+    """ Logs the SQL statements taking longer than threshold seconds, and aggregates them by normalised statement.
+
+    Each slow statement is logged with its parameters, duration, the SqlAlchemyRepository method it was executed for
+    and, on SQLite, its EXPLAIN QUERY PLAN (taken once per normalised statement, on a cursor of its own). Statements
+    are normalised by replacing literals with ? and lists of placeholders (IN lists of any length) with '?, ...', so
+    report() ranks the statement shapes by the total time spent in their slow executions: a SCAN of a large table
+    in a plan is where an index in orm.py would help. The parameters of writes to the users table are not kept.
+
+    /debug/slow-queries serves the report to requests carrying SLOW_QUERY_TOKEN as a bearer token; it is not
+    installed if the token is empty.
+
+    Statements faster than the threshold cost two clock readings; the rest of the work is only done for slow ones.
+    """
+
+    def __init__(self, threshold: float = 0.1, explain: bool = True, report_size: int = 20):
+        self.threshold = threshold
+        self.explain = explain
+        self.report_size = report_size
+        self.__lock = threading.Lock()
+        self.__statements = dict()  # normalised statement -> SlowStatement
+
+    def init_app(self, app, engine):
+        self.install(engine)
+        if app.config.get('SLOW_QUERY_TOKEN'):
+            app.add_url_rule('/debug/slow-queries', 'slow_queries', self.report_view)
+        app.extensions['slow_query_log'] = self
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', _start_statement)
+        event.listen(engine, 'after_cursor_execute', self.record_statement)
+
+    def uninstall(self, engine):
+        event.remove(engine, 'before_cursor_execute', _start_statement)
+        event.remove(engine, 'after_cursor_execute', self.record_statement)
+
+    def record_statement(self, connection, cursor, statement, parameters, context, executemany):
+        starts = connection.info.get('slow_query_starts')
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        if seconds < self.threshold:
+            return
+
+        method = _repository_method()
+        normalised = normalise(statement)
+        with self.__lock:
+            entry = self.__statements.get(normalised)
+        if entry is None:
+            # Explained outside the lock; two threads explaining the same new statement at once is harmless.
+            plan = _query_plan(cursor, statement, parameters, executemany, connection) if self.explain else None
+            with self.__lock:
+                entry = self.__statements.setdefault(normalised, SlowStatement(normalised, plan))
+
+        shown_parameters = REDACTED if _USERS_WRITE.match(statement) else _shorten(repr(parameters))
+        with self.__lock:
+            entry.count += 1
+            entry.total += seconds
+            if seconds >= entry.slowest:
+                entry.slowest = seconds
+                entry.parameters = shown_parameters
+            entry.methods[method] = entry.methods.get(method, 0) + 1
+
+        logger.warning('slow query duration_ms=%.1f method=%s statement=%s parameters=%s plan=%s',
+                       seconds * 1000, method, _WHITESPACE.sub(' ', statement).strip(), shown_parameters, entry.plan)
+
+    def top(self, count: int = None) -> list:
+        """ The slow statements with the largest total time, slowest first. """
+        with self.__lock:
+            entries = sorted(self.__statements.values(), key=lambda entry: entry.total, reverse=True)
+        return entries[:count or self.report_size]
+
+    def report(self, count: int = None) -> str:
+        lines = [f'Slow statements (threshold {self.threshold * 1000:.1f} ms), by total time:', '']
+        for entry in self.top(count):
+            methods = ', '.join(f'{method} ({calls})' for method, calls in
+                                sorted(entry.methods.items(), key=lambda item: item[1], reverse=True))
+            lines.append(f'{entry.count:>8} calls {entry.total * 1000:>10.1f} ms total '
+                         f'{entry.mean * 1000:>8.1f} ms mean {entry.slowest * 1000:>8.1f} ms max')
+            lines.append(f'    {entry.statement}')
+            lines.append(f'    methods: {methods}')
+            lines.append(f'    slowest parameters: {entry.parameters}')
+            if entry.plan is not None:
+                lines.append(f'    plan: {entry.plan}')
+            lines.append('')
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self.__lock:
+            self.__statements.clear()
+
+    def report_view(self):
+        token = current_app.config['SLOW_QUERY_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return jsonify(error='A valid bearer token is required'), 401
+        count = request.args.get('top', type=int)
+        return Response(self.report(count), mimetype='text/plain')
+
+
+def normalise(statement: str) -> str:
+    """ The statement with its literals replaced by ?, lists of placeholders shortened, and whitespace collapsed. """
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('?, ...', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def _start_statement(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('slow_query_starts', []).append(time.perf_counter())
+
+
+def _repository_method():
+    # The outermost SqlAlchemyRepository method on the stack, i.e. the one the application called (add_review rather
+    # than the bump_version it calls). Only looked for when a statement is slow.
+    method = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if (frame.f_code.co_name in REPOSITORY_METHODS
+                and frame.f_globals.get('__name__') == 'library.adapters.database_repository'):
+            method = frame.f_code.co_name
+        frame = frame.f_back
+    return method or 'unknown'
+
+
+def _query_plan(cursor, statement, parameters, executemany, connection):
+    words = statement.split(None, 1)
+    if connection.dialect.name != 'sqlite' or not words or words[0].upper() not in EXPLAINABLE:
+        return None
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    plan_cursor = cursor.connection.cursor()
+    try:
+        plan_cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        # Rows are (id, parent, notused, detail); the details, in order, read as the plan's steps.
+        return '; '.join(row[-1] for row in plan_cursor.fetchall())
+    except Exception as error:
+        logger.debug('No query plan for %s: %s', statement, error)
+        return None
+    finally:
+        plan_cursor.close()
+
+
+def _shorten(text: str) -> str:
+    return text if len(text) <= MAX_PARAMETERS_LENGTH else text[:MAX_PARAMETERS_LENGTH - 3] + '...'
@@ -0,0 +1,155 @@
+import click
+from flask import Blueprint, Response, request, stream_with_context, jsonify, url_for, abort, current_app
+from werkzeug.exceptions import HTTPException
+
+import library.adapters.repository as repo
+import library.api.services as services
+import library.utilities.utilities as utilities
+from library.book.services import NonExistentBookException
+
+# Configure Blueprint. Its commands are top-level ('flask export-books'), like the application's other commands.
+api_blueprint = Blueprint('api_bp', __name__, url_prefix='/api', cli_group=None)
+
+# The versioned JSON API, for clients that would otherwise scrape the HTML pages.
+api_v1_blueprint = Blueprint('api_v1_bp', __name__, url_prefix='/api/v1')
+
+
+@api_blueprint.route('/books', methods=['GET'])
+def export_books():
+    # Streams the whole catalogue as newline-delimited JSON, in order of book id. A client that lost the connection
+    # resumes with after_id set to the last book_id it received.
+    after_id = request.args.get('after_id')
+    if after_id is not None:
+        try:
+            after_id = int(after_id)
+        except ValueError:
+            return jsonify(error='after_id must be a book id'), 400
+
+    records = services.export_books(repo.repo_instance, after_id)
+    return Response(stream_with_context(services.to_ndjson(records)), mimetype='application/x-ndjson')
+
+
+@api_blueprint.cli.command('export-books')
+@click.option('--after-id', type=int, default=None, help='Only export books with a greater id (to resume).')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='File to write (default stdout).')
+def export_books_command(after_id, output):
+    """Export the catalogue as newline-delimited JSON."""
+    for line in services.to_ndjson(services.export_books(repo.repo_instance, after_id)):
+        output.write(line)
+
+
+@api_v1_blueprint.route('/books', methods=['GET'])
+@utilities.conditional_get
+def books():
+    # Without a filter, pages through the whole catalogue in order of book id (keyset paging with after_id);
+    # with a genre, author or publisher, pages through its books as the HTML pages list them (offset cursor).
+    limit = page_size()
+    filters = {name: request.args.get(name) for name in ('genre', 'author', 'publisher') if name in request.args}
+
+    if len(filters) > 1:
+        abort(400, description='Filter by one of genre, author or publisher')
+
+    if not filters:
+        page, next_after_id = services.get_books(repo.repo_instance, int_arg('after_id'), limit)
+        next_url = None
+        if next_after_id is not None:
+            next_url = url_for('api_v1_bp.books', after_id=next_after_id, limit=limit, **field_args())
+    else:
+        cursor = int_arg('cursor', 0)
+        if cursor < 0:
+            abort(400, description='cursor must not be negative')
+        book_ids = services.get_book_ids(repo.repo_instance, **filters)
+        page = services.get_books_by_id(book_ids[cursor:cursor + limit], repo.repo_instance)
+        next_url = None
+        if cursor + limit < len(book_ids):
+            next_url = url_for('api_v1_bp.books', cursor=cursor + limit, limit=limit, **filters, **field_args())
+
+    return jsonify(books=selected(page, services.BOOK_FIELDS), next=next_url)
+
+
+@api_v1_blueprint.route('/books/<int:book_id>', methods=['GET'])
+@utilities.conditional_get
+def book(book_id):
+    try:
+        book_dict = services.get_book(book_id, repo.repo_instance)
+    except NonExistentBookException:
+        abort(404, description='No such book')
+
+    return jsonify(selected([book_dict], services.BOOK_FIELDS)[0])
+
+
+@api_v1_blueprint.route('/books/<int:book_id>/reviews', methods=['GET'])
+@utilities.conditional_get
+def reviews(book_id):
+    try:
+        reviews_list = services.get_reviews_for_book(book_id, repo.repo_instance)
+    except NonExistentBookException:
+        abort(404, description='No such book')
+
+    return jsonify(reviews=selected(reviews_list, services.REVIEW_FIELDS))
+
+
+@api_v1_blueprint.route('/years/<int:release_year>', methods=['GET'])
+@utilities.conditional_get
+def release_year(release_year):
+    try:
+        year = services.get_release_year(release_year, repo.repo_instance)
+    except services.NonExistentYearException:
+        abort(404, description='No books were released in this year')
+
+    year['books'] = selected(year['books'], services.BOOK_FIELDS)
+    return jsonify(year)
+
+
+@api_v1_blueprint.route('/genres', methods=['GET'])
+@utilities.conditional_get
+def genres():
+    return jsonify(genres=selected(services.get_genres(repo.repo_instance), services.GENRE_FIELDS))
+
+
+@api_v1_blueprint.route('/authors', methods=['GET'])
+@utilities.conditional_get
+def authors():
+    return jsonify(authors=selected(services.get_authors(repo.repo_instance), services.AUTHOR_FIELDS))
+
+
+@api_v1_blueprint.route('/publishers', methods=['GET'])
+@utilities.conditional_get
+def publishers():
+    return jsonify(publishers=selected(services.get_publishers(repo.repo_instance), services.PUBLISHER_FIELDS))
+
+
+@api_v1_blueprint.errorhandler(HTTPException)
+def json_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, description=f'{name} must be an integer')
+
+
+def page_size():
+    limit = int_arg('limit', current_app.config['API_PAGE_SIZE'])
+    if not 0 < limit <= current_app.config['API_MAX_PAGE_SIZE']:
+        abort(400, description=f'limit must be between 1 and {current_app.config["API_MAX_PAGE_SIZE"]}')
+    return limit
+
+
+def field_args():
+    # Keeps the field selection in the links to further pages.
+    return {'fields': request.args['fields']} if 'fields' in request.args else {}
+
+
+def selected(records, known_fields):
+    # Applies the comma-separated field selection of the request, e.g. ?fields=book_id,title
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    try:
+        return services.select_fields(records, fields, known_fields)
+    except services.UnknownFieldException as e:
+        abort(400, description=f'Unknown fields: {e}')
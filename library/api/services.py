@@ -0,0 +1,159 @@
+import json
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+import library.book.services as book_services
+from library.adapters.repository import AbstractRepository
+from library.domain.model import Book, Review, Genre, Author, Publisher
+
+
+class UnknownFieldException(Exception):
+    pass
+
+
+class NonExistentYearException(Exception):
+    pass
+
+
+# The fields of each kind of record, as made by the functions at the end of this module.
+BOOK_FIELDS = ('book_id', 'title', 'release_year', 'author_id', 'publisher_id', 'description', 'imgurl', 'genres',
+               'review_count', 'average_rating')
+REVIEW_FIELDS = ('book_id', 'user_name', 'rating', 'review_text', 'timestamp')
+GENRE_FIELDS = ('genre_name',)
+AUTHOR_FIELDS = ('author_id', 'full_name')
+PUBLISHER_FIELDS = ('publisher_id', 'name')
+
+
+def export_books(repo: AbstractRepository, after_id: int = None) -> Iterator[dict]:
+    # Converts one Book at a time, so exporting never holds more than the repository's current batch.
+    for book in repo.iter_books(after_id):
+        yield book_to_export_dict(book)
+
+
+def to_ndjson(records: Iterable[dict]) -> Iterator[str]:
+    # One compact JSON document per line (newline-delimited JSON).
+    for record in records:
+        yield json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def get_books(repo: AbstractRepository, after_id: int = None, limit: int = 20):
+    # Returns a page of the whole catalogue in order of book id, and the after_id of the next page (None if last).
+    books = list(islice(repo.iter_books(after_id, batch_size=limit + 1), limit + 1))
+    next_after_id = books[limit - 1].book_id if len(books) > limit else None
+
+    return books_to_api_dict(books[:limit]), next_after_id
+
+
+def get_book_ids(repo: AbstractRepository, genre: str = None, author: str = None, publisher: str = None):
+    # The ids of the books with the given genre, author or publisher, as listed by the HTML pages.
+    if genre is not None:
+        return book_services.get_book_ids_for_genre(genre, repo)
+    if author is not None:
+        return book_services.get_book_ids_for_author(author, repo)
+    return book_services.get_book_ids_for_publisher(publisher, repo)
+
+
+def get_books_by_id(id_list, repo: AbstractRepository):
+    return books_to_api_dict(repo.get_books_by_id(id_list))
+
+
+def get_book(book_id: int, repo: AbstractRepository):
+    return book_to_api_dict(book_services.find_book(book_id, repo))
+
+
+def get_reviews_for_book(book_id: int, repo: AbstractRepository):
+    return reviews_to_api_dict(book_services.find_book(book_id, repo).reviews)
+
+
+def get_release_year(release_year: int, repo: AbstractRepository):
+    # The books of a release year, with the neighbouring and outermost years to navigate to.
+    books, previous_year, next_year = book_services.find_books_by_release_year(release_year, repo)
+    if len(books) == 0:
+        raise NonExistentYearException
+
+    return {
+        'release_year': release_year,
+        'first_year': repo.get_first_book().release_year,
+        'previous_year': previous_year,
+        'next_year': next_year,
+        'last_year': repo.get_last_book().release_year,
+        'books': books_to_api_dict(books)
+    }
+
+
+def get_genres(repo: AbstractRepository):
+    return [genre_to_api_dict(genre) for genre in repo.get_genres()]
+
+
+def get_authors(repo: AbstractRepository):
+    return [author_to_api_dict(author) for author in repo.get_authors()]
+
+
+def get_publishers(repo: AbstractRepository):
+    return [publisher_to_api_dict(publisher) for publisher in repo.get_publishers()]
+
+
+def select_fields(records: List[dict], fields: List[str], known_fields: Iterable[str]):
+    # Keeps only the requested fields of each record. The names are checked against the fields of the kind of record
+    # (e.g. BOOK_FIELDS), so an unknown name is rejected even when there are no records.
+    if not fields:
+        return records
+    unknown_fields = [field for field in fields if field not in known_fields]
+    if unknown_fields:
+        raise UnknownFieldException(', '.join(unknown_fields))
+    return [{field: record[field] for field in fields} for record in records]
+
+
+# ===================================================
+# Functions to convert model entities to dictionaries
+# ===================================================
+
+def book_to_export_dict(book: Book):
+    book_dict = {
+        'book_id': book.book_id,
+        'title': book.title,
+        'release_year': book.release_year,
+        'author_id': book.author,
+        'publisher_id': book.publisher,
+        'description': book.description,
+        'imgurl': book.imgurl,
+        'genres': [genre.genre_name for genre in book.genres],
+        'review_count': book.rating_summary.review_count,
+        'average_rating': book.rating_summary.average_rating
+    }
+    return book_dict
+
+
+# The API's books are the exported books: flat, with genres by name rather than with their books.
+book_to_api_dict = book_to_export_dict
+
+
+def books_to_api_dict(books: Iterable[Book]):
+    return [book_to_api_dict(book) for book in books]
+
+
+def review_to_api_dict(review: Review):
+    review_dict = {
+        'book_id': review.book.book_id,
+        'user_name': review.user.user_name,
+        'rating': review.rating,
+        'review_text': review.review_text,
+        'timestamp': review.timestamp.isoformat(timespec='seconds')
+    }
+    return review_dict
+
+
+def reviews_to_api_dict(reviews: Iterable[Review]):
+    return [review_to_api_dict(review) for review in reviews]
+
+
+def genre_to_api_dict(genre: Genre):
+    return {'genre_name': genre.genre_name}
+
+
+def author_to_api_dict(author: Author):
+    return {'author_id': author.unique_id, 'full_name': author.full_name}
+
+
+def publisher_to_api_dict(publisher: Publisher):
+    return {'publisher_id': publisher.publisher_id, 'name': publisher.name}
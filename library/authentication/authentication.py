@@ -1,17 +1,14 @@
-from flask import Blueprint, render_template, redirect, url_for, session, request
-
-from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField
-from wtforms.validators import DataRequired, Length, ValidationError
-
-from password_validator import PasswordValidator
+from flask import Blueprint, render_template, redirect, url_for, session, request, current_app
 
 from functools import wraps
 
 import library.utilities.utilities as utilities
 import library.authentication.services as services
+from library.authentication.hashing_pool import HashingBusyException
 import library.adapters.repository as repo
 
+BUSY_MESSAGE = 'The server is busy - please try again in a moment'
+
 # Configure Blueprint.
 authentication_blueprint = Blueprint(
     'authentication_bp', __name__, url_prefix='/authentication')
@@ -19,19 +16,27 @@ authentication_blueprint = Blueprint(
 
 @authentication_blueprint.route('/register', methods=['GET', 'POST'])
 def register():
+    from library.authentication.forms import RegistrationForm
+
     form = RegistrationForm()
     user_name_not_unique = None
+    busy = None
+    status = 200
 
     if form.validate_on_submit():
         # Successful POST, i.e. the user name and password have passed validation checking.
         # Use the service layer to attempt to add the new user.
         try:
-            services.add_user(form.user_name.data, form.password.data, repo.repo_instance)
+            services.add_user(form.user_name.data, form.password.data, repo.repo_instance,
+                              current_app.extensions['password_policy'])
 
             # All is well, redirect the user to the login page.
             return redirect(url_for('authentication_bp.login'))
         except services.NameNotUniqueException:
             user_name_not_unique = 'Your user name is already taken - please supply another'
+        except HashingBusyException:
+            busy = BUSY_MESSAGE
+            status = 503
 
     # For a GET or a failed POST request, return the Registration Web page.
     return render_template(
@@ -39,39 +44,52 @@ def register():
         title='Register',
         form=form,
         user_name_error_message=user_name_not_unique,
+        error_message=busy,
         handler_url=url_for('authentication_bp.register'),
         selected_articles=utilities.get_selected_books(),
         tag_urls=utilities.get_genres_and_urls()
-    )
+    ), status, retry_after(status)
 
 
 @authentication_blueprint.route('/login', methods=['GET', 'POST'])
 def login():
+    from library.authentication.forms import LoginForm
+
     form = LoginForm()
     user_name_not_recognised = None
     password_does_not_match_user_name = None
+    refused = None
+    status = 200
 
     if form.validate_on_submit():
         # Successful POST, i.e. the user name and password have passed validation checking.
-        # Use the service layer to lookup the user.
-        try:
-            user = services.get_user(form.user_name.data, repo.repo_instance)
-
-            # Authenticate user.
-            services.authenticate_user(user['user_name'], form.password.data, repo.repo_instance)
-
-            # Initialise session and redirect the user to the home page.
-            session.clear()
-            session['user_name'] = user['user_name']
-            return redirect(url_for('home_bp.home'))
-
-        except services.UnknownUserException:
-            # User name not known to the system, set a suitable error message.
-            user_name_not_recognised = 'User name not recognised - please supply another'
-
-        except services.AuthenticationException:
-            # Authentication failed, set a suitable error message.
-            password_does_not_match_user_name = 'Password does not match supplied user name - please check and try again'
+        # Refuse the attempt outright if this user name or address has been trying too often.
+        if not current_app.extensions['login_throttle'].allow(form.user_name.data, request.remote_addr):
+            refused = 'Too many login attempts - please wait a minute and try again'
+            status = 429
+        else:
+            # Use the service layer to lookup and authenticate the user.
+            try:
+                user = services.login(form.user_name.data, form.password.data, repo.repo_instance,
+                                      current_app.extensions['password_policy'])
+
+                # Initialise session and redirect the user to the home page.
+                session.clear()
+                session['user_name'] = user['user_name']
+                return redirect(url_for('home_bp.home'))
+
+            except services.UnknownUserException:
+                # User name not known to the system, set a suitable error message.
+                user_name_not_recognised = 'User name not recognised - please supply another'
+
+            except services.AuthenticationException:
+                # Authentication failed, set a suitable error message.
+                password_does_not_match_user_name = 'Password does not match supplied user name - please check and try again'
+
+            except HashingBusyException:
+                # Too many passwords are being checked already; ask the user to come back rather than queueing.
+                refused = BUSY_MESSAGE
+                status = 503
 
     # For a GET or a failed POST, return the Login Web page.
     return render_template(
@@ -79,10 +97,11 @@ def login():
         title='Login',
         user_name_error_message=user_name_not_recognised,
         password_error_message=password_does_not_match_user_name,
+        error_message=refused,
         form=form,
         selected_articles=utilities.get_selected_books(),
         tag_urls=utilities.get_genres_and_urls()
-    )
+    ), status, retry_after(status)
 
 
 @authentication_blueprint.route('/logout')
@@ -91,6 +110,25 @@ def logout():
     return redirect(url_for('home_bp.home'))
 
 
+def retry_after(status: int) -> dict:
+    # Tells clients refused for being too many when they may try again.
+    return {'Retry-After': '60' if status == 429 else '1'} if status in (429, 503) else {}
+
+
+def current_user():
+    """ Returns the logged-in User.
+
+    A server-side session keeps the User once resolved, so it is only looked up in the repository once per
+    session (and process); with cookie sessions it is looked up on every call.
+    """
+    user = getattr(session, 'user', None)
+    if user is None:
+        user = repo.repo_instance.get_user(session['user_name'])
+        if hasattr(session, 'user'):
+            session.user = user
+    return user
+
+
 def login_required(view):
     @wraps(view)
     def wrapped_view(**kwargs):
@@ -98,39 +136,3 @@ def login_required(view):
             return redirect(url_for('authentication_bp.login'))
         return view(**kwargs)
     return wrapped_view
-
-
-class PasswordValid:
-    def __init__(self, message=None):
-        if not message:
-            message = u'Your password must be at least 8 characters, and contain an upper case letter,\
-            a lower case letter and a digit'
-        self.message = message
-
-    def __call__(self, form, field):
-        schema = PasswordValidator()
-        schema \
-            .min(8) \
-            .has().uppercase() \
-            .has().lowercase() \
-            .has().digits()
-        if not schema.validate(field.data):
-            raise ValidationError(self.message)
-
-
-class RegistrationForm(FlaskForm):
-    user_name = StringField('Username', [
-        DataRequired(message='Your user name is required'),
-        Length(min=3, message='Your user name is too short')])
-    password = PasswordField('Password', [
-        DataRequired(message='Your password is required'),
-        PasswordValid()])
-    submit = SubmitField('Register')
-
-
-class LoginForm(FlaskForm):
-    user_name = StringField('Username', [
-        DataRequired()])
-    password = PasswordField('Password', [
-        DataRequired()])
-    submit = SubmitField('Login')
@@ -0,0 +1,46 @@
+"""Forms of the authentication blueprint.
+
+Imported by the views that use them, rather than with the blueprint, so that wtforms and password_validator are
+only loaded once a form is needed.
+"""
+from flask_wtf import FlaskForm
+from wtforms import StringField, PasswordField, SubmitField
+from wtforms.validators import DataRequired, Length, ValidationError
+
+from password_validator import PasswordValidator
+
+
+class PasswordValid:
+    def __init__(self, message=None):
+        if not message:
+            message = u'Your password must be at least 8 characters, and contain an upper case letter,\
+            a lower case letter and a digit'
+        self.message = message
+
+    def __call__(self, form, field):
+        schema = PasswordValidator()
+        schema \
+            .min(8) \
+            .has().uppercase() \
+            .has().lowercase() \
+            .has().digits()
+        if not schema.validate(field.data):
+            raise ValidationError(self.message)
+
+
+class RegistrationForm(FlaskForm):
+    user_name = StringField('Username', [
+        DataRequired(message='Your user name is required'),
+        Length(min=3, message='Your user name is too short')])
+    password = PasswordField('Password', [
+        DataRequired(message='Your password is required'),
+        PasswordValid()])
+    submit = SubmitField('Register')
+
+
+class LoginForm(FlaskForm):
+    user_name = StringField('Username', [
+        DataRequired()])
+    password = PasswordField('Password', [
+        DataRequired()])
+    submit = SubmitField('Login')
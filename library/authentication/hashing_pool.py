@@ -0,0 +1,71 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from library.authentication.password_policy import PasswordPolicy
+
+
+class HashingBusyException(Exception):
+    pass
+
+
+class HashingPool:
+    """ Runs a PasswordPolicy's hashing and verification in a bounded pool of worker processes.
+
+    Each hash keeps a core busy for as long as it runs (hashlib releases the GIL while it does), so a burst of logins
+    hashed on request threads takes as many cores as there are threads, and the other requests compete with it for
+    CPU. Here at most workers hashes run at once, whatever the number of request threads, and the request thread only
+    waits on the result. At most max_pending hashes may be queued or running; a request that cannot get a slot within
+    queue_timeout seconds raises HashingBusyException rather than adding to the backlog.
+
+    Has the same hash/verify/needs_rehash interface as PasswordPolicy, so services use either without knowing.
+    """
+
+    def __init__(self, policy: PasswordPolicy, workers: int = 2, max_pending: int = None, queue_timeout: float = 1):
+        self.policy = policy
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else workers * 4
+        self.queue_timeout = queue_timeout
+
+        self.__slots = threading.BoundedSemaphore(self.max_pending)
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['password_policy'] = self
+
+    def hash(self, password: str) -> str:
+        return self.__run(self.policy.hash, password)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        if password_hash is None:
+            return False
+        return self.__run(self.policy.verify, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return self.policy.needs_rehash(password_hash)
+
+    def shutdown(self):
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
+
+    def __run(self, function, *args):
+        if not self.__slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusyException
+        try:
+            return self.__get_executor().submit(function, *args).result()
+        finally:
+            self.__slots.release()
+
+    def __get_executor(self):
+        # Started on first use, so applications that never hash a password never start the worker processes.
+        # Workers are spawned rather than forked: the web server and the review queue run threads, which a fork
+        # would copy in whatever state their locks happen to be in.
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.__executor
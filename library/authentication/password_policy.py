@@ -0,0 +1,42 @@
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordPolicy:
+    """ How passwords are hashed: the algorithm (a werkzeug method such as 'pbkdf2:sha256') and its cost.
+
+    Hashes record the method and iteration count they were made with, so a hash made under an older policy can
+    still be verified, and needs_rehash() tells when it should be replaced by one made under the current policy.
+    """
+
+    def __init__(self, method: str = 'pbkdf2:sha256', iterations: int = 150000, salt_length: int = 8):
+        self.method = method
+        self.iterations = iterations
+        self.salt_length = salt_length
+
+    def init_app(self, app):
+        app.extensions['password_policy'] = self
+
+    @property
+    def full_method(self) -> str:
+        if self.method.startswith('pbkdf2:'):
+            return f'{self.method}:{self.iterations}'
+        return self.method
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, method=self.full_method, salt_length=self.salt_length)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        if password_hash is None:
+            return False
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        method, _, _ = password_hash.partition('$')
+        return method != self.full_method
+
+    def __repr__(self):
+        return f'<PasswordPolicy {self.full_method}>'
+
+
+# The policy werkzeug applies by default, used when the caller has no configured policy.
+default_policy = PasswordPolicy()
@@ -1,6 +1,5 @@
-from werkzeug.security import generate_password_hash, check_password_hash
-
 from library.adapters.repository import AbstractRepository
+from library.authentication.password_policy import PasswordPolicy, default_policy
 from library.domain.model import User
 
 
@@ -16,14 +15,14 @@ class AuthenticationException(Exception):
     pass
 
 
-def add_user(user_name: str, password: str, repo: AbstractRepository):
+def add_user(user_name: str, password: str, repo: AbstractRepository, policy: PasswordPolicy = default_policy):
     # Check that the given user name is available.
     user = repo.get_user(user_name)
     if user is not None:
         raise NameNotUniqueException
 
     # Encrypt password so that the database doesn't store passwords 'in the clear'.
-    password_hash = generate_password_hash(password)
+    password_hash = policy.hash(password)
 
     # Create and store the new User, with password encrypted.
     user = User(user_name, password_hash)
@@ -38,16 +37,37 @@ def get_user(user_name: str, repo: AbstractRepository):
     return user_to_dict(user)
 
 
-def authenticate_user(user_name: str, password: str, repo: AbstractRepository):
+def authenticate_user(user_name: str, password: str, repo: AbstractRepository,
+                      policy: PasswordPolicy = default_policy):
     authenticated = False
 
     user = repo.get_user(user_name)
     if user is not None:
-        authenticated = check_password_hash(user.password, password)
+        authenticated = policy.verify(user.password, password)
     if not authenticated:
         raise AuthenticationException
 
 
+def login(user_name: str, password: str, repo: AbstractRepository, policy: PasswordPolicy = default_policy):
+    """ Looks the user up once and checks the password, returning the user as a dictionary.
+
+    A hash made under an older policy is replaced by one made under the current policy, while the plain text
+    password is at hand.
+    """
+    user = repo.get_user(user_name)
+    if user is None:
+        raise UnknownUserException
+
+    if not policy.verify(user.password, password):
+        raise AuthenticationException
+
+    if policy.needs_rehash(user.password):
+        user.password = policy.hash(password)
+        repo.update_user(user)
+
+    return user_to_dict(user)
+
+
 # ===================================================
 # Functions to convert model entities to dictionaries
 # ===================================================
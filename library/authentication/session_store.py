@@ -0,0 +1,231 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from flask.sessions import SessionInterface, SecureCookieSession, session_json_serializer
+from itsdangerous import Signer, BadSignature
+
+from library.utilities.lru import LRUCache
+
+
+class ServerSideSession(SecureCookieSession):
+    """ A session whose data is kept on the server; the cookie only carries its signed id.
+
+    The User resolved for the session is kept in the in-process cache (never in the backend), so authenticated
+    requests do not look the user up in the repository again.
+    """
+
+    def __init__(self, initial=None, sid=None, user=None, generation=0):
+        super().__init__(initial)
+        self.sid = sid
+        self.user = user
+        self.generation = generation
+        self.loaded_user_name = self.get('user_name')
+        self.accessed = False
+
+
+class FileSessionBackend:
+    """ Stores each session as a JSON file named by its id. """
+
+    def __init__(self, directory):
+        self.__directory = Path(directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+
+    def load(self, sid: str):
+        try:
+            with open(self.__directory / sid, encoding='utf-8') as infile:
+                record = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if record['expires'] <= time.time():
+            self.delete(sid)
+            return None
+        return record['data']
+
+    def save(self, sid: str, data: str, expires: float):
+        # Written to a temporary file and renamed into place, so a reader never sees half a session.
+        path = self.__directory / sid
+        temporary_path = path.with_name(f'.{sid}.{os.getpid()}.{threading.get_ident()}')
+        temporary_path.write_text(json.dumps({'expires': expires, 'data': data}), encoding='utf-8')
+        os.replace(temporary_path, path)
+
+    def delete(self, sid: str):
+        try:
+            (self.__directory / sid).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SqliteSessionBackend:
+    """ Stores sessions in a table of an SQLite database file, which several processes can share. """
+
+    def __init__(self, path):
+        self.__path = str(path)
+        with self.__connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+
+    def load(self, sid: str):
+        with self.__connect() as connection:
+            row = connection.execute('SELECT data, expires FROM sessions WHERE sid = ?', (sid,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                connection.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+                return None
+            return row[0]
+
+    def save(self, sid: str, data: str, expires: float):
+        with self.__connect() as connection:
+            connection.execute('REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+
+    def delete(self, sid: str):
+        with self.__connect() as connection:
+            connection.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def __connect(self):
+        return _Connection(self.__path)
+
+
+class _Connection:
+    # A connection that commits on success and is always closed, for use in a with statement.
+    def __init__(self, path):
+        self.__connection = sqlite3.connect(path, timeout=10)
+
+    def __enter__(self):
+        return self.__connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with closing(self.__connection):
+            if exc_type is None:
+                self.__connection.commit()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """ Keeps session data on the server: in an in-process LRU cache, or in a shared backend.
+
+    The cookie holds a random session id signed with the application's secret key. Without a backend, sessions
+    live only in the cache of the process that created them, so this suits a single process. With a file or
+    SQLite backend, the session data is read from the backend on every request, so that a change or a logout in
+    one process is seen by all of them (and by restarts); the cache then only keeps the User resolved for each
+    session, as long as the session is still that user's.
+
+    The session id is replaced whenever a different user logs in, and a cleared session (logout) is removed
+    from the cache and the backend. forget_users() drops the cached Users, for when the repository they came from
+    is replaced.
+    """
+
+    def __init__(self, backend=None, max_size: int = 10000):
+        self.backend = backend
+        # Maps session id -> (data, User or None, generation the User was resolved in).
+        self.cache = LRUCache(max_size=max_size, name='sessions')
+        self.__generation = 0
+
+    def init_app(self, app):
+        self.cache.ttl = app.permanent_session_lifetime.total_seconds()
+        app.session_interface = self
+        app.extensions['session_store'] = self
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+
+        signed_sid = request.cookies.get(app.session_cookie_name)
+        if signed_sid is None:
+            return ServerSideSession(generation=self.__generation)
+        try:
+            sid = _signer(app).unsign(signed_sid).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            return ServerSideSession(generation=self.__generation)
+
+        entry = self.cache.get(sid)
+        if self.backend is None:
+            if entry is None:
+                # Expired or unknown; start afresh rather than trusting the id.
+                return ServerSideSession(generation=self.__generation)
+            return ServerSideSession(session_json_serializer.loads(entry[0]), sid=sid, user=self.__user(entry),
+                                     generation=self.__generation)
+
+        data = self.backend.load(sid)
+        if data is None:
+            # Expired, unknown or logged out (perhaps by another process).
+            if entry is not None:
+                self.cache.pop(sid)
+            return ServerSideSession(generation=self.__generation)
+        session = ServerSideSession(session_json_serializer.loads(data), sid=sid, generation=self.__generation)
+        user = self.__user(entry) if entry is not None else None
+        if user is not None and user.user_name == session.get('user_name'):
+            session.user = user
+        else:
+            self.cache.set(sid, (data, None, self.__generation))
+        return session
+
+    def forget_users(self):
+        """ Stops handing out the Users resolved so far, so that each session looks its user up again. """
+        self.__generation += 1
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                self.discard(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.get('user_name') != session.loaded_user_name:
+            # A different user now owns this session: never carry a session id (or cached user) across users.
+            self.discard(session.sid)
+            session.sid = None
+            session.user = None
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = secrets.token_urlsafe(32)
+
+        # A User resolved before forget_users() was called is not kept.
+        user = session.user if session.generation == self.__generation else None
+        entry = self.cache.get(session.sid) if not new_sid else None
+        if session.modified or new_sid or entry is None or self.__user(entry) is not user:
+            data = session_json_serializer.dumps(dict(session))
+            self.cache.set(session.sid, (data, user, self.__generation))
+            if self.backend is not None and (session.modified or new_sid):
+                expires = time.time() + app.permanent_session_lifetime.total_seconds()
+                self.backend.save(session.sid, data, expires)
+
+        if new_sid or self.should_set_cookie(app, session):
+            response.set_cookie(
+                app.session_cookie_name,
+                _signer(app).sign(session.sid.encode('ascii')).decode('ascii'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+    def discard(self, sid: str):
+        if sid is None:
+            return
+        self.cache.pop(sid)
+        if self.backend is not None:
+            self.backend.delete(sid)
+
+    def __user(self, entry):
+        data, user, generation = entry
+        return user if generation == self.__generation else None
+
+
+def _signer(app):
+    return Signer(app.secret_key, salt='server-side-session')
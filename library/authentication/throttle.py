@@ -0,0 +1,49 @@
+import threading
+import time
+
+from library.utilities.lru import LRUCache
+
+
+class TokenBucketThrottle:
+    """ Limits how often an action can be attempted per key, with a token bucket per key.
+
+    Each bucket holds up to burst tokens and refills at rate tokens per minute; an attempt takes one token and is
+    refused when the bucket is empty. Buckets are kept in an LRU cache so a flood of distinct keys cannot exhaust
+    memory.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000):
+        self.rate = rate / 60
+        self.burst = burst
+        self.__buckets = LRUCache(max_size=max_keys)
+        self.__lock = threading.Lock()
+
+    def allow(self, key) -> bool:
+        now = time.monotonic()
+        with self.__lock:
+            tokens, updated = self.__buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.__buckets.set(key, (tokens, now))
+        return allowed
+
+
+class LoginThrottle:
+    """ Throttles login attempts per user name and IP address pair, and per IP address.
+
+    Checked before any password hash is verified, so a flood of failed logins is refused cheaply instead of
+    keeping workers busy hashing.
+    """
+
+    def __init__(self, rate: float = 5, burst: int = 5, ip_rate: float = 50, ip_burst: int = 50):
+        self.__per_user = TokenBucketThrottle(rate, burst)
+        self.__per_ip = TokenBucketThrottle(ip_rate, ip_burst)
+
+    def init_app(self, app):
+        app.extensions['login_throttle'] = self
+
+    def allow(self, user_name: str, ip_address: str) -> bool:
+        user_name = (user_name or '').strip().lower()
+        return self.__per_ip.allow(ip_address) and self.__per_user.allow((user_name, ip_address))
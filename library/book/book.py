@@ -1,26 +1,25 @@
 from datetime import date
 
 from flask import Blueprint
-from flask import request, render_template, redirect, url_for, session
-
-from better_profanity import profanity
-from flask_wtf import FlaskForm
-from wtforms import TextAreaField, HiddenField, SubmitField
-from wtforms.validators import DataRequired, Length, ValidationError
+from flask import request, render_template, redirect, url_for, session, current_app, abort
 
 import library.adapters.repository as repo
 import library.utilities.utilities as utilities
 import library.book.services as services
 
-from library.authentication.authentication import login_required
+from library.authentication.authentication import login_required, current_user
 
 
 # Configure Blueprint.
 book_blueprint = Blueprint(
     'book_bp', __name__)
 
+# Number of books listed by the top rated and most reviewed pages.
+books_per_ranking = 10
+
 
 @book_blueprint.route('/books_by_release_year', methods=['GET'])
+@utilities.conditional_get
 def books_by_release_year():
     # Read query parameters.
     target_year = request.args.get('release_year')
@@ -65,6 +64,8 @@ def books_by_release_year():
             next_book_url = url_for('book_bp.books_by_release_year', release_year=next_year)
             last_book_url = url_for('book_bp.books_by_release_year', release_year=last_book['release_year'])
 
+        with_pending_reviews(books)
+
         # Construct urls for viewing article comments and adding comments.
         for book in books:
             book['view_review_url'] = url_for('book_bp.books_by_release_year', release_year=target_year, view_reviews_for=book['book_id'])
@@ -92,6 +93,7 @@ def books_by_release_year():
 
 
 @book_blueprint.route('/list_of_authors', methods=['GET'])
+@utilities.conditional_get
 def list_of_authors():
     authors = utilities.get_genres_and_urls()
     if len(authors) > 0:
@@ -106,6 +108,7 @@ def list_of_authors():
 
 
 @book_blueprint.route('/books_by_author', methods=['GET'])
+@utilities.conditional_get
 def books_by_author():
     books_per_page = 3
 
@@ -153,6 +156,8 @@ def books_by_author():
             last_cursor -= books_per_page
         last_book_url = url_for('book_bp.books_by_author', author=author_name, cursor=last_cursor)
 
+    with_pending_reviews(books)
+
     # Construct urls for viewing article comments and adding comments.
     for book in books:
         book['view_review_url'] = url_for('book_bp.books_by_author', author=author_name, cursor=cursor, view_reviews_for=book['book_id'])
@@ -177,6 +182,7 @@ def books_by_author():
 
 
 @book_blueprint.route('/list_of_publishers', methods=['GET'])
+@utilities.conditional_get
 def list_of_publishers():
     publishers = utilities.get_publishers_and_urls()
     if len(publishers) > 0:
@@ -191,6 +197,7 @@ def list_of_publishers():
 
 
 @book_blueprint.route('/books_by_publisher', methods=['GET'])
+@utilities.conditional_get
 def books_by_publisher():
     books_per_page = 3
 
@@ -238,6 +245,8 @@ def books_by_publisher():
             last_cursor -= books_per_page
         last_book_url = url_for('book_bp.books_by_publisher', publisher=publisher_name, cursor=last_cursor)
 
+    with_pending_reviews(books)
+
     # Construct urls for viewing article comments and adding comments.
     for book in books:
         book['view_review_url'] = url_for('book_bp.books_by_publisher', publisher=publisher_name, cursor=cursor, view_reviews_for=book['book_id'])
@@ -262,6 +271,7 @@ def books_by_publisher():
 
 
 @book_blueprint.route('/list_of_genres', methods=['GET'])
+@utilities.conditional_get
 def list_of_genres():
     genres = utilities.get_genres_and_urls()
     if len(genres) > 0:
@@ -276,6 +286,7 @@ def list_of_genres():
 
 
 @book_blueprint.route('/books_by_genre', methods=['GET'])
+@utilities.conditional_get
 def books_by_genre():
     books_per_page = 3
 
@@ -323,6 +334,8 @@ def books_by_genre():
             last_cursor -= books_per_page
         last_book_url = url_for('book_bp.books_by_genre', genre=genre_name, cursor=last_cursor)
 
+    with_pending_reviews(books)
+
     # Construct urls for viewing article comments and adding comments.
     for book in books:
         book['view_review_url'] = url_for('book_bp.books_by_genre', genre=genre_name, cursor=cursor, view_reviews_for=book['book_id'])
@@ -346,6 +359,52 @@ def books_by_genre():
     )
 
 
+@book_blueprint.route('/books_top_rated', methods=['GET'])
+@utilities.conditional_get
+def books_top_rated():
+    books = services.get_top_rated_books(books_per_ranking, repo.repo_instance)
+    return render_ranking('book_bp.books_top_rated', 'Top rated books', books)
+
+
+@book_blueprint.route('/books_most_reviewed', methods=['GET'])
+@utilities.conditional_get
+def books_most_reviewed():
+    books = services.get_most_reviewed_books(books_per_ranking, repo.repo_instance)
+    return render_ranking('book_bp.books_most_reviewed', 'Most reviewed books', books)
+
+
+def render_ranking(endpoint: str, title: str, books):
+    book_to_show_reviews = request.args.get('view_reviews_for')
+
+    if book_to_show_reviews is None:
+        # No view-comments query parameter, so set to a non-existent article id.
+        book_to_show_reviews = -1
+    else:
+        # Convert article_to_show_comments from string to int.
+        book_to_show_reviews = int(book_to_show_reviews)
+
+    with_pending_reviews(books)
+
+    # Construct urls for viewing book reviews and adding reviews.
+    for book in books:
+        book['view_review_url'] = url_for(endpoint, view_reviews_for=book['book_id'])
+        book['add_review_url'] = url_for('book_bp.review_on_book', book=book['book_id'])
+
+    # Rankings are a single page, so the navigation buttons stay disabled.
+    return render_template(
+        'book/books.html',
+        title=title,
+        books=books,
+        selected_books=utilities.get_selected_books(3),
+        genre_urls=utilities.get_genres_and_urls(),
+        first_book_url=None,
+        last_book_url=None,
+        prev_book_url=None,
+        next_book_url=None,
+        show_reviews_for_book=book_to_show_reviews
+    )
+
+
 @book_blueprint.route('/review', methods=['GET', 'POST'])
 @login_required
 def review_on_book():
@@ -355,6 +414,8 @@ def review_on_book():
     # Create form. The form maintains state, e.g. when this method is called with a HTTP GET request and populates
     # the form with an article id, when subsequently called with a HTTP POST request, the article id remains in the
     # form.
+    from library.book.forms import CommentForm
+
     form = CommentForm()
 
     if form.validate_on_submit():
@@ -362,11 +423,22 @@ def review_on_book():
         # Extract the article id, representing the commented article, from the form.
         book_id = int(form.book_id.data)
 
-        # Use the service layer to store the new comment.
-        services.add_review(book_id, form.review.data, user_name, int(form.review_rating.data), repo.repo_instance)
+        review_queue = current_app.extensions.get('review_queue')
+        if review_queue is None:
+            # Use the service layer to store the new comment.
+            services.add_review(book_id, form.review.data, user_name, int(form.review_rating.data), repo.repo_instance,
+                                current_user())
 
-        # Retrieve the article in dict form.
-        book = services.get_book(book_id, repo.repo_instance)
+            # Retrieve the article in dict form.
+            book = services.get_book(book_id, repo.repo_instance)
+        else:
+            # The form checked the book and the rating, so the queue is only given reviews it can store. Journal the
+            # review and leave storing it to the write-behind queue.
+            book = services.get_book(book_id, repo.repo_instance)
+            submission = review_queue.submit(book_id, form.review.data, user_name, int(form.review_rating.data))
+
+            # Remember the submission, so this session keeps seeing the review until it has been stored.
+            session['pending_reviews'] = session.get('pending_reviews', []) + [submission.submission_id]
 
         # Cause the web browser to display the page of all articles that have the same date as the commented article,
         # and display all comments, including the new comment.
@@ -380,13 +452,17 @@ def review_on_book():
         # Store the article id in the form.
         form.book_id.data = book_id
     else:
-        # Request is a HTTP POST where form validation has failed.
+        # Request is a HTTP POST where form validation has failed. A review of a book that does not exist has no page
+        # to show the form on.
+        if form.book_id.errors:
+            abort(404, form.book_id.errors[0])
         # Extract the article id of the article being commented from the form.
         book_id = int(form.book_id.data)
 
     # For a GET or an unsuccessful POST, retrieve the article to comment in dict form, and return a Web page that allows
     # the user to enter a comment. The generated Web page includes a form object.
     book = services.get_book(book_id, repo.repo_instance)
+    with_pending_reviews([book])
     return render_template(
         'book/review_on_book.html',
         title='Edit book review',
@@ -400,24 +476,24 @@ def review_on_book():
     )
 
 
-class ProfanityFree:
-    def __init__(self, message=None):
-        if not message:
-            message = u'Field must not contain profanity'
-        self.message = message
-
-    def __call__(self, form, field):
-        if profanity.contains_profanity(field.data):
-            raise ValidationError(self.message)
+def with_pending_reviews(books):
+    # Adds reviews the current user submitted that the write-behind queue has not stored yet, so they can see their
+    # own reviews straight away.
+    review_queue = current_app.extensions.get('review_queue')
+    if review_queue is None or 'pending_reviews' not in session:
+        return
 
+    # Only the ids of reviews known to be stored are forgotten: a review submitted to another worker process of a
+    # pre-forking server is pending there, and only that process can tell when it has been stored.
+    outstanding = review_queue.outstanding(session['pending_reviews'])
+    if len(outstanding) == 0:
+        session.pop('pending_reviews')
+        return
+    if len(outstanding) < len(session['pending_reviews']):
+        session['pending_reviews'] = outstanding
+    pending = review_queue.pending(outstanding, session.get('user_name'))
 
-class CommentForm(FlaskForm):
-    review = TextAreaField('Review', [
-        DataRequired(),
-        Length(min=4, message='Your review is too short'),
-        ProfanityFree(message='Your review must not contain profanity')])
-    review_rating = TextAreaField('Review_rating', [
-        DataRequired(),
-        Length(min=1, max=1, message='Your review rating has to be from 1 to 5')])
-    book_id = HiddenField("Book id")
-    submit = SubmitField('Submit')
+    for book in books:
+        book['reviews'].extend(
+            services.submission_to_dict(submission) for submission in pending if submission.book_id == book['book_id']
+        )
@@ -0,0 +1,50 @@
+"""Forms of the book blueprint.
+
+Imported by the views that use them, rather than with the blueprint, so that wtforms is only loaded once a form is
+needed.
+"""
+from flask import current_app
+
+from flask_wtf import FlaskForm
+from wtforms import TextAreaField, HiddenField, SubmitField
+from wtforms.validators import AnyOf, DataRequired, Length, ValidationError
+
+import library.adapters.repository as repo
+
+
+class ProfanityFree:
+    def __init__(self, message=None):
+        if not message:
+            message = u'Field must not contain profanity'
+        self.message = message
+
+    def __call__(self, form, field):
+        if current_app.extensions['profanity_filter'].contains_profanity(field.data):
+            raise ValidationError(self.message)
+
+
+class ExistingBook:
+    def __init__(self, message=None):
+        if not message:
+            message = u'Field must be the id of a book'
+        self.message = message
+
+    def __call__(self, form, field):
+        try:
+            book_id = int(field.data)
+        except (TypeError, ValueError):
+            raise ValidationError(self.message)
+        if repo.repo_instance.get_book(book_id) is None:
+            raise ValidationError(self.message)
+
+
+class CommentForm(FlaskForm):
+    review = TextAreaField('Review', [
+        DataRequired(),
+        Length(min=4, message='Your review is too short'),
+        ProfanityFree(message='Your review must not contain profanity')])
+    review_rating = TextAreaField('Review_rating', [
+        DataRequired(),
+        AnyOf(['1', '2', '3', '4', '5'], message='Your review rating has to be from 1 to 5')])
+    book_id = HiddenField("Book id", [ExistingBook(message='There is no such book')])
+    submit = SubmitField('Submit')
@@ -0,0 +1,266 @@
+import functools
+import importlib.util
+import json
+import re
+import string
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Iterable, List
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import library.adapters.repository as repo
+
+# Characters that may stand in for a letter ("leetspeak"), the same substitutions better_profanity allows.
+CHAR_VARIANTS = {
+    'a': 'a@*4',
+    'i': 'i*l1',
+    'o': 'o*0@',
+    'u': 'u*v',
+    'v': 'v*u',
+    'l': 'l1',
+    'e': 'e*3',
+    's': 's$5',
+    't': 't7',
+}
+
+# Characters that are part of a word, as in better_profanity: letters, digits and a few substitution and quote
+# characters, to which the alphabetic characters listed in its alphabetic_unicode.json are added. Every other character
+# separates words.
+WORD_CHARACTERS = frozenset(string.ascii_letters + string.digits + '@$*"\'')
+
+
+def _canonical_classes() -> dict:
+    # Letters that can stand in for each other collapse into one canonical character, so a single pass over the
+    # normalised text finds every spelling of a word. '*' links all the vowels together, so they share a class.
+    parent = dict()
+
+    def find(c):
+        while parent.setdefault(c, c) != c:
+            c = parent[c]
+        return c
+
+    for letter, variants in CHAR_VARIANTS.items():
+        for variant in variants:
+            parent[find(variant)] = find(letter)
+
+    classes = dict()
+    for c in parent:
+        classes.setdefault(find(c), []).append(c)
+    return {c: min(members) for members in classes.values() for c in members}
+
+
+CANONICAL_CHARACTERS = _canonical_classes()
+
+
+class NormalisationTable(dict):
+    """ The str.translate table reducing a text to canonical form: a word character becomes the canonical character
+    of its lower case, any other character a space. Each character is looked up once, then kept in the table.
+    """
+
+    def __init__(self, word_characters: frozenset):
+        super().__init__()
+        self.word_characters = word_characters
+
+    def __missing__(self, code: int) -> str:
+        c = chr(code)
+        if c in self.word_characters:
+            lowered = c.lower()
+            # A few characters lower-case to more than one; those are kept as they are.
+            c = lowered if len(lowered) == 1 else c
+            normalised = CANONICAL_CHARACTERS.get(c, c)
+        else:
+            normalised = ' '
+        self[code] = normalised
+        return normalised
+
+
+class ProfanityFilter:
+    """ Detects profanity in review text with a precompiled Aho-Corasick automaton.
+
+    Matches what better_profanity's contains_profanity matches. A text is split into words at every character that is
+    not a word character (see WORD_CHARACTERS). A listed word matches one to a few consecutive words of the text,
+    spelt together ("f-u-c-ks" is "fucks"), and a listed word with separators ("blow job", "f.u.c.k") matches the
+    words with exactly these separators between them. better_profanity's quirks are kept: a listed word spreads over
+    at most one word more than the separators in the longest listed word, and a single character ending the text is
+    not joined to the words before it, so "f.u.c.k" is not profane where "f.u.c.k." is.
+
+    The word list is compiled once: every word is reduced to its canonical form without separators (see
+    NormalisationTable) and added to the automaton, and a regular expression spelling out the exact substitutions
+    allowed for the word is kept alongside it. Screening normalises the text with str.translate, runs the automaton
+    over its word characters once, and only checks the few candidates which start and end at word boundaries against
+    their expressions. Cost grows with the length of the text, not with the size of the word list.
+
+    Compiling the default word list takes a few hundred milliseconds, so it is done when the first text is screened
+    (or when compile() is called, e.g. before forking workers that can then share it), not when the filter is made.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.__words = sorted(set(word.strip().lower() for word in words))
+        self.__lock = threading.Lock()
+        self.__compiled = False
+
+    def compile(self):
+        with self.__lock:
+            if self.__compiled:
+                return
+            self.__table = NormalisationTable(_word_characters())
+            self.__goto = [dict()]
+            self.__fail = [0]
+            self.__outputs = [list()]
+            # better_profanity joins a word with as many following ones as the longest listed word has separators.
+            self.__max_words = 1 + max([1] + [self.__separators(word) for word in self.__words])
+
+            for word in self.__words:
+                if self.__separators(word) < len(word):
+                    self.__add_word(word)
+            self.__build_failure_links()
+            self.__compiled = True
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def from_default_wordlist(cls):
+        # Read better_profanity's word list without importing the package, which would expand every word into its
+        # variants at import time. The compiled filter is immutable, so one per process is enough.
+        with open(_package_file('profanity_wordlist.txt'), encoding='utf-8') as infile:
+            return cls(infile)
+
+    def init_app(self, app):
+        app.extensions['profanity_filter'] = self
+        app.cli.add_command(screen_reviews_command)
+
+    def contains_profanity(self, text: str) -> bool:
+        return self.find(text, first_only=True) != []
+
+    def find(self, text: str, first_only: bool = False) -> List[str]:
+        """ Returns the profane words (as spelt in text), in the order they appear. """
+        if not self.__compiled:
+            self.compile()
+        normalised = text.translate(self.__table)
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+        goto, fail, outputs = self.__goto, self.__fail, self.__outputs
+        matches = dict()  # start -> (words, end)
+        state = 0
+        for end, c in enumerate(normalised):
+            # Separators are skipped, so that a listed word is found however it is split into words.
+            if c == ' ':
+                continue
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if not outputs[state] or (end + 1 < len(normalised) and normalised[end + 1] != ' '):
+                continue
+
+            for length, verifier, separated in outputs[state]:
+                start, words = self.__start_of_match(normalised, end, length)
+                if not self.__is_candidate(normalised, start, end, words):
+                    continue
+                spelling = lowered[start:end + 1]
+                if not separated:
+                    spelling = ''.join(c for c, n in zip(spelling, normalised[start:end + 1]) if n != ' ')
+                if verifier.fullmatch(spelling):
+                    if first_only:
+                        return [text[start:end + 1]]
+                    # Like better_profanity, a match spreading over more words is preferred, then the shortest one.
+                    if start not in matches or (words > 1) > (matches[start][0] > 1) \
+                            or 1 < words < matches[start][0]:
+                        matches[start] = (words, end)
+
+        found = list()
+        resume = 0
+        for start in sorted(matches):
+            if start >= resume:
+                end = matches[start][1]
+                found.append(text[start:end + 1])
+                resume = end + 1
+        return found
+
+    def screen(self, texts: Iterable[str]) -> List[bool]:
+        """ Batch API: returns, for each text, whether it contains profanity. """
+        return [self.contains_profanity(text) for text in texts]
+
+    def screen_reviews(self, reviews) -> list:
+        """ Batch API: returns the reviews whose text contains profanity. """
+        return [review for review in reviews if self.contains_profanity(review.review_text)]
+
+    def __add_word(self, word: str):
+        canonical = word.translate(self.__table).replace(' ', '')
+        state = 0
+        for c in canonical:
+            if c not in self.__goto[state]:
+                self.__goto.append(dict())
+                self.__fail.append(0)
+                self.__outputs.append(list())
+                self.__goto[state][c] = len(self.__goto) - 1
+            state = self.__goto[state][c]
+
+        # The exact spellings allowed for this word, used to confirm what the (lossy) canonical form matched. A word
+        # with separators is checked against the text as it is, one without against the text's word characters.
+        pattern = ''.join('[' + re.escape(CHAR_VARIANTS.get(c, c)) + ']' for c in word)
+        separated = self.__separators(word) > 0
+        self.__outputs[state].append((len(canonical), re.compile(pattern), separated))
+
+    def __build_failure_links(self):
+        queue = deque(self.__goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self.__goto[state].items():
+                queue.append(child)
+                fallback = self.__fail[state]
+                while fallback and c not in self.__goto[fallback]:
+                    fallback = self.__fail[fallback]
+                self.__fail[child] = self.__goto[fallback].get(c, 0)
+                self.__outputs[child] = self.__outputs[child] + self.__outputs[self.__fail[child]]
+
+    def __separators(self, word: str) -> int:
+        return sum(1 for c in word if c not in self.__table.word_characters)
+
+    def __is_candidate(self, normalised: str, start: int, end: int, words: int) -> bool:
+        # Whether better_profanity looks at the words from start to end together.
+        if start > 0 and normalised[start - 1] != ' ' or words > self.__max_words:
+            return False
+        if end == len(normalised) - 1 and (end == 0 or normalised[end - 1] == ' '):
+            # A single character ending the text is not joined to the words before it, nor looked at if it is the
+            # only word of the text.
+            return words == 1 and normalised[:start].strip(' ') != ''
+        return True
+
+    @staticmethod
+    def __start_of_match(normalised: str, end: int, length: int):
+        # Walks back over length word characters; returns where they start, and the number of words they spread over.
+        position = end
+        words = 1
+        for _ in range(length - 1):
+            position -= 1
+            if normalised[position] == ' ':
+                words += 1
+                while normalised[position] == ' ':
+                    position -= 1
+        return position, words
+
+
+def _package_file(name: str) -> Path:
+    return Path(importlib.util.find_spec('better_profanity').submodule_search_locations[0]) / name
+
+
+@functools.lru_cache(maxsize=None)
+def _word_characters() -> frozenset:
+    with open(_package_file('alphabetic_unicode.json'), encoding='utf-8') as infile:
+        return WORD_CHARACTERS | frozenset(json.load(infile))
+
+
+@click.command('screen-reviews')
+@with_appcontext
+def screen_reviews_command():
+    """Re-screen every stored review for profanity."""
+    profanity_filter = current_app.extensions['profanity_filter']
+    flagged = profanity_filter.screen_reviews(repo.repo_instance.get_reviews())
+    for review in flagged:
+        click.echo(f'{review.book.book_id}\t{review.user}\t{review.review_text}')
+    click.echo(f'{len(flagged)} reviews contain profanity')
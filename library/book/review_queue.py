@@ -0,0 +1,243 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import weakref
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import library.adapters.repository as repo
+import library.book.services as services
+
+logger = logging.getLogger(__name__)
+
+# seq orders the submissions in a journal; submission_id ('<pid>-<seq>') tells them apart across processes.
+ReviewSubmission = namedtuple('ReviewSubmission', ['seq', 'book_id', 'user_name', 'review_text', 'rating', 'timestamp',
+                                                   'submission_id'])
+
+# Queues of this process, restarted in forked children (e.g. the workers of a pre-forking server).
+_queues = weakref.WeakSet()
+
+
+class ReviewWriteQueue:
+    """ Write-behind queue for review submissions.
+
+    A validated review is appended to a per-process journal file (fsync'ed, so it survives a crash) and the request
+    is acknowledged straight away. A background thread stores queued reviews in the repository in batches, so
+    bursts of submissions share database commits instead of each request waiting on SQLite's writer lock.
+
+    Journals left behind by processes that have exited are replayed when a queue starts. Until a review has been
+    flushed, pending() lets the submitting user's session see it (read-your-writes). Submissions are told apart by
+    an id made of the process id and a sequence number, so the processes of a pre-forking server never hand out the
+    same one.
+    """
+
+    def __init__(self, journal_dir, batch_size: int = 50, flush_interval: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.__journal_dir = Path(journal_dir)
+        self.__journal_dir.mkdir(parents=True, exist_ok=True)
+        self.__journal_path = self.__journal_dir / f'review-journal-{os.getpid()}.jsonl'
+
+        self.__pending = list()
+        self.__seq = 0
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stopped = threading.Event()
+        self.__worker = None
+        _queues.add(self)
+
+    def init_app(self, app):
+        self.replay_orphaned_journals()
+        app.extensions['review_queue'] = self
+        self.start()
+
+    def start(self):
+        self.__worker = threading.Thread(target=self.__run, name='review-write-behind', daemon=True)
+        self.__worker.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.__stopped.set()
+        self.__wakeup.set()
+        if self.__worker is not None:
+            self.__worker.join()
+            self.__worker = None
+        self.flush()
+
+    def restart_after_fork(self):
+        """ Gives a forked child its own journal, locks and background thread (only the forking thread survives).
+
+        Submissions the parent has not flushed yet stay with the parent, which still journals them.
+        """
+        self.__journal_path = self.__journal_dir / f'review-journal-{os.getpid()}.jsonl'
+        self.__pending = list()
+        self.__seq = 0
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stopped = threading.Event()
+        if self.__worker is not None:
+            self.start()
+
+    def submit(self, book_id: int, review_text: str, user_name: str, rating: int) -> ReviewSubmission:
+        with self.__lock:
+            self.__seq += 1
+            submission = ReviewSubmission(self.__seq, book_id, user_name, review_text, rating, datetime.now(),
+                                          f'{os.getpid()}-{self.__seq}')
+            self.__append_to_journal(_to_record(submission))
+            self.__pending.append(submission)
+            full = len(self.__pending) >= self.batch_size
+
+        if full:
+            self.__wakeup.set()
+        return submission
+
+    def pending(self, submission_ids, user_name: str) -> list:
+        """ Returns the submissions of user_name, out of those with the given ids, that have not been flushed yet. """
+        submission_ids = set(submission_ids)
+        with self.__lock:
+            return [submission for submission in self.__pending
+                    if submission.submission_id in submission_ids and submission.user_name == user_name]
+
+    def outstanding(self, submission_ids) -> list:
+        """ Returns the ids, out of those given, of submissions that may not have been stored yet: those still
+        pending in this process, and those of other processes that are still running (which only they know about).
+        """
+        with self.__lock:
+            own = {submission.submission_id for submission in self.__pending}
+        pid = str(os.getpid())
+        outstanding = list()
+        for submission_id in submission_ids:
+            submission_pid = str(submission_id).split('-', 1)[0]
+            if submission_id in own or (submission_pid != pid and _pid_is_alive(submission_pid)):
+                outstanding.append(submission_id)
+        return outstanding
+
+    def flush(self):
+        """ Stores everything queued so far in the repository, one batch at a time. """
+        with self.__flush_lock:
+            while True:
+                with self.__lock:
+                    batch = self.__pending[:self.batch_size]
+                if len(batch) == 0:
+                    return
+                self.__store(batch, repo.repo_instance)
+
+    def replay_orphaned_journals(self):
+        """ Stores the reviews journaled by processes that exited before storing them (e.g. crashed workers). """
+        for journal_path in sorted(self.__journal_dir.glob('review-journal-*.jsonl')):
+            if journal_path == self.__journal_path or _process_is_alive(journal_path):
+                continue
+            # Claimed by renaming, so that of the processes starting together (e.g. respawned workers) only one
+            # replays it. The claim names this process, so a journal whose replay was cut short is replayed again.
+            original_pid = journal_path.stem.split('-')[2].split('.')[0]
+            claimed_path = journal_path.with_name(f'review-journal-{original_pid}.replaying-{os.getpid()}.jsonl')
+            try:
+                os.rename(journal_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            submissions = _read_journal(claimed_path)
+            if len(submissions) > 0:
+                logger.info('Replaying %d reviews from %s', len(submissions), journal_path)
+                rejected = services.add_reviews(submissions, repo.repo_instance)
+                _log_rejected(rejected)
+            claimed_path.unlink()
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Leave the batch queued; it is retried on the next round.
+                logger.exception('Flushing queued reviews failed')
+                self.__stopped.wait(self.flush_interval)
+
+    def __store(self, batch, repository):
+        try:
+            rejected = services.add_reviews(batch, repository)
+        finally:
+            close_session = getattr(repository, 'close_session', None)
+            if close_session is not None:
+                close_session()
+        _log_rejected(rejected)
+
+        with self.__lock:
+            del self.__pending[:len(batch)]
+            if len(self.__pending) == 0:
+                # Everything journaled so far is in the repository now.
+                self.__journal_path.write_text('')
+            else:
+                self.__append_to_journal({'applied': batch[-1].seq})
+
+    def __append_to_journal(self, record: dict):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        fd = os.open(self.__journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _restart_queues_after_fork():
+    for queue in list(_queues):
+        queue.restart_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_queues_after_fork)
+
+
+def _to_record(submission: ReviewSubmission) -> dict:
+    record = submission._asdict()
+    record['timestamp'] = submission.timestamp.isoformat()
+    return record
+
+
+def _read_journal(journal_path: Path) -> list:
+    submissions = list()
+    applied = 0
+    with open(journal_path, encoding='utf-8') as infile:
+        for line in infile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-append; the review was never acknowledged.
+                continue
+            if 'applied' in record:
+                applied = record['applied']
+            else:
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                submissions.append(ReviewSubmission(**record))
+    return [submission for submission in submissions if submission.seq > applied]
+
+
+def _process_is_alive(journal_path: Path) -> bool:
+    # The process that wrote the journal, or that is replaying it.
+    return _pid_is_alive(journal_path.stem.rsplit('-', 1)[1])
+
+
+def _pid_is_alive(pid) -> bool:
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _log_rejected(rejected):
+    for submission in rejected:
+        logger.warning('Dropping queued review %s: unknown book or user, or invalid rating', submission)
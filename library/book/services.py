@@ -1,7 +1,7 @@
 from typing import List, Iterable
 
 from library.adapters.repository import AbstractRepository
-from library.domain.model import make_review, Book, Review, Genre
+from library.domain.model import make_review, Book, Review, Genre, User
 
 
 class NonExistentBookException(Exception):
@@ -12,13 +12,16 @@ class UnknownUserException(Exception):
     pass
 
 
-def add_review(book_id: int, review_text: str, user_name: str, rating: int, repo: AbstractRepository):
+def add_review(book_id: int, review_text: str, user_name: str, rating: int, repo: AbstractRepository,
+               user: User = None):
     # Check that the article exists.
-    book = repo.get_book(book_id)
-    if book is None:
-        raise NonExistentBookException
+    book = find_book(book_id, repo)
 
-    user = repo.get_user(user_name)
+    if user is not None:
+        # The caller already resolved the user (e.g. the session caches it).
+        user = repo.attach_user(user)
+    else:
+        user = repo.get_user(user_name)
     if user is None:
         raise UnknownUserException
 
@@ -29,13 +32,48 @@ def add_review(book_id: int, review_text: str, user_name: str, rating: int, repo
     repo.add_review(review)
 
 
-def get_book(book_id: int, repo: AbstractRepository):
+def add_reviews(submissions, repo: AbstractRepository):
+    # Stores a batch of submitted reviews (objects with book_id, review_text, user_name, rating and timestamp
+    # attributes) in one repository write. Returns the submissions that could not be stored: those for an unknown
+    # book or user, or with an invalid rating.
+    reviews = list()
+    rejected = list()
+    users = dict()
+
+    for submission in submissions:
+        book = repo.get_book(submission.book_id)
+        if submission.user_name not in users:
+            users[submission.user_name] = repo.get_user(submission.user_name)
+        user = users[submission.user_name]
+
+        if book is None or user is None:
+            rejected.append(submission)
+            continue
+        try:
+            reviews.append(Review(book, submission.review_text, user, submission.rating, submission.timestamp))
+        except ValueError:
+            rejected.append(submission)
+
+    # Attached only once every review of the batch has been made, so a rejected one leaves the others unattached.
+    for review in reviews:
+        review.user.add_review(review)
+        review.book.add_review(review)
+    repo.add_reviews(reviews)
+    return rejected
+
+
+def find_book(book_id: int, repo: AbstractRepository) -> Book:
+    # Returns the Book itself, for callers converting it their own way (e.g. the JSON API).
     book = repo.get_book(book_id)
 
     if book is None:
         raise NonExistentBookException
 
-    return book_to_dict(book)
+    return book
+
+
+def get_book(book_id: int, repo: AbstractRepository):
+    return book_to_dict(find_book(book_id, repo))
 
 
 def get_all_books(repo: AbstractRepository):
@@ -58,24 +96,44 @@ def get_last_book(repo: AbstractRepository):
     return book_to_dict(book)
 
 
-def get_books_by_release_year(release_year, repo: AbstractRepository):
-    # Returns articles for the target date (empty if no matches), the date of the previous article (might be null), the date of the next article (might be null)
+def find_books_by_release_year(release_year, repo: AbstractRepository):
+    # Returns the Books of the target year (empty if no matches), the previous year (might be null) and the next year
+    # (might be null).
 
     books = repo.get_books_by_release_year(target_year=release_year)
 
-    books_dto = list()
     prev_year = next_year = None
 
     if len(books) > 0:
         prev_year = repo.get_release_year_of_previous_book(books[0])
         next_year = repo.get_release_year_of_next_book(books[0])
 
-        # Convert Articles to dictionary form.
-        books_dto = books_to_dict(books)
+    return books, prev_year, next_year
+
+
+def get_books_by_release_year(release_year, repo: AbstractRepository):
+    # Returns articles for the target date (empty if no matches), the date of the previous article (might be null), the date of the next article (might be null)
+
+    books, prev_year, next_year = find_books_by_release_year(release_year, repo)
+
+    # Convert Articles to dictionary form.
+    books_dto = books_to_dict(books)
 
     return books_dto, prev_year, next_year
 
 
+def get_top_rated_books(quantity: int, repo: AbstractRepository):
+    books = repo.get_top_rated_books(quantity)
+
+    return books_to_dict(books)
+
+
+def get_most_reviewed_books(quantity: int, repo: AbstractRepository):
+    books = repo.get_most_reviewed_books(quantity)
+
+    return books_to_dict(books)
+
+
 def get_book_ids_for_genre(genre_name, repo: AbstractRepository):
     book_ids = repo.get_book_ids_for_genre(genre_name)
 
@@ -104,12 +162,7 @@ def get_books_by_id(id_list, repo: AbstractRepository):
 
 
 def get_reviews_for_book(book_id, repo: AbstractRepository):
-    book = repo.get_book(book_id)
-
-    if book is None:
-        raise NonExistentBookException
-
-    return reviews_to_dict(book.reviews)
+    return reviews_to_dict(find_book(book_id, repo).reviews)
 
 
 # ============================================
@@ -125,7 +178,9 @@ def book_to_dict(book: Book):
         'description': book.description,
         'imgurl': book.imgurl,
         'reviews': reviews_to_dict(book.reviews),
-        'genres': genres_to_dict(book.genres)
+        'genres': genres_to_dict(book.genres),
+        'review_count': book.rating_summary.review_count,
+        'average_rating': book.rating_summary.average_rating
     }
     return book_dict
 
@@ -148,6 +203,16 @@ def reviews_to_dict(reviews: Iterable[Review]):
     return [review_to_dict(review) for review in reviews]
 
 
+def submission_to_dict(submission):
+    submission_dict = {
+        'book_id': submission.book_id,
+        'review_text': submission.review_text,
+        'user_name': submission.user_name,
+        'rating': submission.rating,
+    }
+    return submission_dict
+
+
 def genre_to_dict(genre: Genre):
     genre_dict = {
         'genre_name': genre.genre_name,
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Iterable
+from typing import Dict, List, Iterable
 
 
 class Publisher:
@@ -141,6 +141,71 @@ class Author:
         return hash(self.unique_id)
 
 
+class RatingSummary:
+    """ Running aggregate of the ratings a Book has received, kept up to date as reviews are added. """
+
+    def __init__(self):
+        self.__review_count: int = 0
+        self.__rating_total: int = 0
+        self.__average_rating: float = None
+        self.__latest_review: datetime = None
+
+        # Histogram of ratings, one counter per star.
+        self.__one_star: int = 0
+        self.__two_stars: int = 0
+        self.__three_stars: int = 0
+        self.__four_stars: int = 0
+        self.__five_stars: int = 0
+
+    @property
+    def review_count(self) -> int:
+        return self.__review_count
+
+    @property
+    def rating_total(self) -> int:
+        return self.__rating_total
+
+    @property
+    def average_rating(self) -> float:
+        return self.__average_rating
+
+    @property
+    def latest_review(self) -> datetime:
+        return self.__latest_review
+
+    @property
+    def histogram(self) -> Dict[int, int]:
+        return {
+            1: self.__one_star,
+            2: self.__two_stars,
+            3: self.__three_stars,
+            4: self.__four_stars,
+            5: self.__five_stars
+        }
+
+    def add_rating(self, rating: int, timestamp: datetime):
+        self.__review_count += 1
+        self.__rating_total += rating
+        self.__average_rating = self.__rating_total / self.__review_count
+
+        if self.__latest_review is None or timestamp > self.__latest_review:
+            self.__latest_review = timestamp
+
+        if rating == 1:
+            self.__one_star += 1
+        elif rating == 2:
+            self.__two_stars += 1
+        elif rating == 3:
+            self.__three_stars += 1
+        elif rating == 4:
+            self.__four_stars += 1
+        else:
+            self.__five_stars += 1
+
+    def __repr__(self):
+        return f'<RatingSummary {self.__review_count} reviews, average = {self.__average_rating}>'
+
+
 class Book:
     def __init__(self, release_year: int, book_title: str = None, book_publisher: int = None, book_author: int = None, book_id: int = None):
 
@@ -152,6 +217,7 @@ class Book:
 
         self.__reviews: List[Review] = list()
         self.__genres: List[Genre] = list()
+        self.__rating_summary: RatingSummary = RatingSummary()
 
         self.__author = book_author
         self.__description = None
@@ -183,6 +249,11 @@ class Book:
     def release_year(self) -> int:
         return self.__release_year
 
+    @release_year.setter
+    def release_year(self, release_year: int):
+        if isinstance(release_year, int):
+            self.__release_year = release_year
+
     @property
     def description(self) -> str:
         return self.__description
@@ -200,9 +271,10 @@ class Book:
     # def publisher(self) -> Publisher:
     #     return self.__publisher
 
-    # @publisher.setter
-    # def publisher(self, publisher: int):
-    #     self.__publisher = publisher
+    @publisher.setter
+    def publisher(self, publisher: int):
+        if isinstance(publisher, int):
+            self.__publisher = publisher
 
     # @publisher.setter
     # def publisher(self, publisher: Publisher):
@@ -216,9 +288,10 @@ class Book:
     # def author(self) -> Author:
     #     return self.__author
 
-    # @author.setter
-    # def author(self, author: int):
-    #     self.__author = author
+    @author.setter
+    def author(self, author: int):
+        if isinstance(author, int):
+            self.__author = author
 
     # @author.setter
     # def author(self, author: Author):
@@ -259,8 +332,18 @@ class Book:
     def number_of_reviews(self) -> int:
         return len(self.__reviews)
 
+    @property
+    def rating_summary(self) -> RatingSummary:
+        if self.__rating_summary is None:
+            # Books loaded from a database have no summary row until their first review.
+            return RatingSummary()
+        return self.__rating_summary
+
     def add_review(self, review: 'Review'):
         self.__reviews.append(review)
+        if self.__rating_summary is None:
+            self.__rating_summary = RatingSummary()
+        self.__rating_summary.add_rating(review.rating, review.timestamp)
 
     @property
     def genres(self) -> Iterable['Genre']:
@@ -279,6 +362,15 @@ class Book:
     def add_genre(self, genre: 'Genre'):
         self.__genres.append(genre)
 
+    def remove_genre(self, genre: 'Genre'):
+        if genre in self.__genres:
+            self.__genres.remove(genre)
+
+    def clear_references(self):
+        # Reviews and genres refer back to the book; see MemoryRepository.release.
+        self.__reviews.clear()
+        self.__genres.clear()
+
     def __repr__(self):
         return f'<Book {self.title}, book id = {self.book_id}>'
 
@@ -296,7 +388,7 @@ class Book:
 
 class Review:
 
-    def __init__(self, book: Book, review_text: str, user: 'User', rating: int):
+    def __init__(self, book: Book, review_text: str, user: 'User', rating: int, timestamp: datetime = None):
         if isinstance(book, Book):
             self.__book = book
         else:
@@ -317,7 +409,10 @@ class Review:
         else:
             raise ValueError
 
-        self.__timestamp = datetime.now()
+        if isinstance(timestamp, datetime):
+            self.__timestamp = timestamp
+        else:
+            self.__timestamp = datetime.now()
 
     @property
     def book(self) -> Book:
@@ -375,6 +470,13 @@ class User:
     def password(self) -> str:
         return self.__password
 
+    @password.setter
+    def password(self, password: str):
+        if password == "" or not isinstance(password, str) or len(password) < 7:
+            self.__password = None
+        else:
+            self.__password = password
+
     @property
     def read_books(self) -> List[Book]:
         return self.__read_books
@@ -398,6 +500,11 @@ class User:
             # Review objects are in practice always considered different due to their timestamp.
             self.__reviews.append(review)
 
+    def clear_references(self):
+        # Reviews refer back to the user; see MemoryRepository.release.
+        self.__reviews.clear()
+        self.__read_books.clear()
+
     def __repr__(self):
         return f'{self.user_name}'
 
@@ -436,6 +543,14 @@ class Genre:
     def add_book(self, book: Book):
         self.__genre_books.append(book)
 
+    def remove_book(self, book: Book):
+        if book in self.__genre_books:
+            self.__genre_books.remove(book)
+
+    def clear_references(self):
+        # Books refer back to the genre; see MemoryRepository.release.
+        self.__genre_books.clear()
+
     def __eq__(self, other):
         if not isinstance(other, Genre):
             return False
@@ -492,8 +607,8 @@ def make_genre_association(book: Book, genre: Genre):
         genre.add_book(book)
 
 
-def make_review(review_text: str, user: User, book: Book, rating: int):
-    review = Review(book, review_text, user, rating)
+def make_review(review_text: str, user: User, book: Book, rating: int, timestamp: datetime = None):
+    review = Review(book, review_text, user, rating, timestamp)
     user.add_review(review)
     book.add_review(review)
 
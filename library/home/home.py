@@ -8,6 +8,7 @@ home_blueprint = Blueprint(
 
 
 @home_blueprint.route('/', methods=['GET'])
+@utilities.conditional_get
 def home():
     return render_template(
         'home/home.html',
@@ -0,0 +1,322 @@
+"""A pre-forking WSGI server for running the application without further dependencies.
+
+gunicorn (see gunicorn.conf.py) is the production path. This server handles HTTP with werkzeug, which has no request
+timeouts, no limits on header sizes and no keep-alive, so run it behind a reverse proxy that has them (or on a trusted
+network). What it adds is the integration with the memory repository: its master rebuilds the repository for a
+catalogue reload or import and replaces the workers.
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+import library.adapters.repository as repo
+from library.adapters.catalogue_import import refuse_import
+
+logger = logging.getLogger(__name__)
+
+# A worker failing this many times in a row, each within MIN_WORKER_LIFETIME seconds of being started, stops the server.
+MAX_WORKER_FAILURES = 10
+MIN_WORKER_LIFETIME = 10
+# Longest wait, in seconds, before a failed worker is replaced; the wait doubles with each failure in a row.
+MAX_RESPAWN_DELAY = 30
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ werkzeug's WSGI server, handling requests on a fixed pool of threads rather than a thread per request.
+
+    No connection is accepted while every thread is busy: connections wait in the listening socket's backlog, where
+    another worker process sharing the socket can take them, rather than in a queue of this one.
+    """
+
+    multithread = True
+    daemon_threads = True
+
+    def __init__(self, host, port, app, threads: int = 4, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        # werkzeug takes the port from a placeholder socket when given an inherited one.
+        self.port = self.socket.getsockname()[1]
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+        self.__idle_threads = threading.BoundedSemaphore(threads)
+
+    def get_request(self):
+        self.__idle_threads.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self.__idle_threads.release()
+            raise
+
+    def shutdown_request(self, request):
+        # Called once for every connection accepted, whether it was handled or not.
+        try:
+            super().shutdown_request(request)
+        finally:
+            self.__idle_threads.release()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        # Waits for the requests being handled to finish; call after shutdown() stopped accepting new ones.
+        self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+class PreforkServer:
+    """ Serves a WSGI application from several worker processes, each handling requests on a pool of threads.
+
+    The master process binds the listening socket and forks the workers, which all accept from it. With preload,
+    the application (and with it the repository population) is built once in the master before forking, so the
+    workers share its memory copy-on-write; without it, each worker builds its own application.
+
+    Signals to the master:
+        SIGHUP: graceful restart. New workers are started (from a freshly built application, with preload) and the
+            old ones are then asked to stop; they finish the requests they are handling first.
+        SIGTERM, SIGINT: graceful shutdown. Workers still busy after graceful_timeout seconds are killed.
+
+    With preload, a change to the catalogue's CSV files seen by the catalogue watcher (memory repository) restarts
+    the workers as SIGHUP does. Workers that exit unexpectedly are replaced, after a wait that doubles with each one
+    failing shortly after it was started; after MAX_WORKER_FAILURES of those in a row the server stops, with exit
+    status 1. Where os.fork is not available, the application is served by a single process.
+    """
+
+    def __init__(self, app_factory, host: str = 'localhost', port: int = 5000, workers: int = None, threads: int = 4,
+                 preload: bool = True, graceful_timeout: float = 30):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.preload = preload
+        self.graceful_timeout = graceful_timeout
+
+        self.app = None
+        self.listener = None
+        self.__workers = dict()  # pid -> generation
+        self.__started = dict()  # pid -> time.monotonic() it was forked at
+        self.__generation = 0
+        self.__signals = list()
+        self.__failures = 0  # Workers that failed shortly after starting, in a row.
+        self.__respawn_at = 0.0
+
+    @classmethod
+    def from_config(cls, app_factory, config):
+        return cls(
+            app_factory,
+            host=config.SERVER_HOST,
+            port=config.SERVER_PORT,
+            workers=config.SERVER_WORKERS,
+            threads=config.SERVER_THREADS,
+            preload=config.SERVER_PRELOAD,
+            graceful_timeout=config.SERVER_GRACEFUL_TIMEOUT
+        )
+
+    def serve_forever(self):
+        self.listener = socket.create_server((self.host, self.port), backlog=2048)
+        self.listener.set_inheritable(True)
+        if self.preload:
+            self.__load_app()
+
+        if not hasattr(os, 'fork'):
+            logger.info('Serving on http://%s:%s with 1 process x %s threads', self.host, self.port, self.threads)
+            self.__serve(self.app or self.app_factory())
+            return
+
+        logger.info('Serving on http://%s:%s with %s workers x %s threads', self.host, self.port, self.workers,
+                    self.threads)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda received, frame: self.__signals.append(received))
+        try:
+            self.__supervise()
+        finally:
+            self.listener.close()
+
+    def __supervise(self):
+        while True:
+            self.__reap()
+            while self.__signals:
+                signum = self.__signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.__restart()
+                else:
+                    self.__stop()
+                    return
+            if self.__failures >= MAX_WORKER_FAILURES:
+                logger.error('%s workers in a row failed shortly after starting; stopping', self.__failures)
+                self.__stop()
+                raise SystemExit(1)
+            if self.__failures and self.__has_settled_worker():
+                self.__failures = 0
+            while len(self.__workers) < self.workers and time.monotonic() >= self.__respawn_at:
+                self.__spawn()
+            time.sleep(0.1)
+
+    def __has_settled_worker(self) -> bool:
+        now = time.monotonic()
+        return any(now - self.__started[pid] >= MIN_WORKER_LIFETIME
+                   for pid, generation in self.__workers.items() if generation == self.__generation)
+
+    def __load_app(self):
+        previous_app, self.app = self.app, self.app_factory()
+        if previous_app is not None:
+            stop_extensions(previous_app)
+        # Compiled once here rather than on the first review in each worker, so the workers share it.
+        profanity_filter = self.app.extensions.get('profanity_filter')
+        if profanity_filter is not None:
+            profanity_filter.compile()
+        # Forked workers must not share the master's database connection.
+        if hasattr(repo.repo_instance, 'close_session'):
+            repo.repo_instance.close_session()
+        # In memory mode every worker holds a copy of the repository, forked from the master's. When the catalogue
+        # changes, the master builds the new one and the workers are replaced, rather than each worker building its
+        # own while serving requests.
+        catalogue_watcher = self.app.extensions.get('catalogue_watcher')
+        if catalogue_watcher is not None and catalogue_watcher.engine is None and hasattr(os, 'fork'):
+            catalogue_watcher.on_change = lambda snapshots: self.__signals.append(signal.SIGHUP)
+        # Likewise for an import asked of a worker, which has the master restart them all.
+        catalogue_importer = self.app.extensions.get('catalogue_importer')
+        if catalogue_importer is not None and catalogue_importer.engine is None and hasattr(os, 'fork'):
+            master = os.getpid()
+            catalogue_importer.on_import = lambda: os.kill(master, signal.SIGHUP)
+
+        # What the previous application held is freed here rather than by a long collection in every worker, and the
+        # rest is frozen: the workers' collections then neither walk a large repository, pausing all their requests
+        # for up to seconds, nor copy the memory pages it is in.
+        del previous_app
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def __spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, signal.SIG_DFL)
+                app = self.app or self.app_factory()
+                # Without preload there is no repository in the master to rebuild.
+                catalogue_importer = app.extensions.get('catalogue_importer')
+                if self.app is None and self.workers > 1 and catalogue_importer is not None \
+                        and catalogue_importer.engine is None:
+                    catalogue_importer.on_import = refuse_import
+                # A worker replacing one that crashed stores the reviews the crashed one had only journaled. Without
+                # preload, building the application has done so.
+                review_queue = app.extensions.get('review_queue')
+                if self.app is not None and review_queue is not None:
+                    review_queue.replay_orphaned_journals()
+                self.__serve(app)
+                status = 0
+            except Exception:
+                logger.exception('Worker %s failed', os.getpid())
+            finally:
+                # Never return into the master's loop.
+                os._exit(status)
+        self.__workers[pid] = self.__generation
+        self.__started[pid] = time.monotonic()
+
+    def __serve(self, app):
+        # Requests are not logged one by one; that costs more than many of them take to handle.
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = PooledWSGIServer(self.host, self.port, app, threads=self.threads, fd=self.listener.fileno())
+
+        # Connections are accepted on a thread of their own, so that the signal handlers (which always run on the
+        # main thread) only have to note the request to stop.
+        accepting = threading.Thread(target=server.serve_forever, name='accept')
+        accepting.start()
+        stop_signals = list()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda received, frame: stop_signals.append(received))
+        try:
+            while not stop_signals and accepting.is_alive():
+                time.sleep(0.5)
+        finally:
+            server.shutdown()
+            accepting.join()
+            server.drain()
+            stop_extensions(app)
+
+    def __restart(self):
+        if self.preload:
+            try:
+                self.__load_app()
+            except Exception:
+                logger.exception('Could not rebuild the application; keeping the current workers')
+                return
+
+        old_workers = list(self.__workers)
+        self.__generation += 1
+        self.__failures, self.__respawn_at = 0, 0.0
+        logger.info('Restarting %s workers', len(old_workers))
+        for _ in range(self.workers):
+            self.__spawn()
+        for pid in old_workers:
+            self.__signal_worker(pid, signal.SIGTERM)
+
+    def __stop(self):
+        logger.info('Stopping %s workers', len(self.__workers))
+        for pid in self.__workers:
+            self.__signal_worker(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.__workers and time.monotonic() < deadline:
+            self.__reap()
+            time.sleep(0.1)
+        for pid in self.__workers:
+            self.__signal_worker(pid, signal.SIGKILL)
+        while self.__workers:
+            self.__reap(block=True)
+
+    def __reap(self, block: bool = False):
+        while self.__workers:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.__workers.clear()
+                return
+            if pid == 0:
+                return
+            generation = self.__workers.pop(pid, None)
+            started = self.__started.pop(pid, None)
+            if generation == self.__generation and status != 0:
+                logger.warning('Worker %s exited unexpectedly (status %s)', pid, status)
+                if started is not None and time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    self.__failures += 1
+                    self.__respawn_at = time.monotonic() + min(0.1 * 2 ** self.__failures, MAX_RESPAWN_DELAY)
+            if block:
+                return
+
+    @staticmethod
+    def __signal_worker(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def stop_extensions(app):
+    # Flush reviews waiting to be written, and stop the password hashing processes and the catalogue watcher.
+    review_queue = app.extensions.get('review_queue')
+    if review_queue is not None:
+        review_queue.stop()
+    password_policy = app.extensions.get('password_policy')
+    if hasattr(password_policy, 'shutdown'):
+        password_policy.shutdown()
+    catalogue_watcher = app.extensions.get('catalogue_watcher')
+    if catalogue_watcher is not None:
+        catalogue_watcher.stop()
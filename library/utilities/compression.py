@@ -0,0 +1,111 @@
+import gzip
+from hashlib import sha1
+
+from flask import request, current_app
+
+from library.utilities.lru import LRUCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it, responses are only gzipped.
+    brotli = None
+
+# Bodies smaller than this are sent as they are: compressing them saves too little to be worth the time.
+MIN_SIZE = 500
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript', 'application/json',
+    'application/x-ndjson', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon'
+}
+
+
+def supported_encodings():
+    # In order of preference: brotli compresses text better than gzip, at a similar cost.
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encodings):
+    """ The supported encoding the client accepts with the highest quality (None if it accepts none). """
+    best_encoding, best_quality = None, 0
+    for encoding in supported_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+class ResponseCompressor:
+    """ Compresses HTML, JSON, CSS and other text responses for clients that accept gzip (or brotli).
+
+    Responses smaller than min_size are left alone. The compressed bodies of cacheable responses (views marked as
+    cacheable, see utilities.conditional_get, and static files) are kept in a size-bounded LRU cache keyed by a
+    digest of the uncompressed body, so a page or asset that many clients ask for is only compressed once.
+    """
+
+    def __init__(self, min_size: int = MIN_SIZE, max_bytes: int = 4 * 1024 * 1024):
+        self.min_size = min_size
+        self.cache = LRUCache(max_size=100000, max_weight=max_bytes, weigher=len, name='compression')
+
+    def init_app(self, app):
+        app.after_request(self.compress)
+        app.extensions['response_compressor'] = self
+
+    def compress(self, response):
+        cacheable = self.__cacheable()
+        if cacheable and response.direct_passthrough and response.mimetype in COMPRESSIBLE_MIMETYPES:
+            # Static files are sent straight from disk; read them in so they can be compressed like any response.
+            response.direct_passthrough = False
+            response.make_sequence()
+        return compress_response(response, self.min_size, self.cache if cacheable else None)
+
+    @staticmethod
+    def __cacheable():
+        if request.endpoint == 'static':
+            return True
+        view = current_app.view_functions.get(request.endpoint)
+        return getattr(view, 'cacheable', False)
+
+
+def compress_response(response, min_size: int = MIN_SIZE, cache: LRUCache = None):
+    """ Compresses a complete, successful text response in place, if the client accepts an encoding we support.
+
+    With a cache, compressed bodies are looked up by encoding and a digest of the uncompressed body.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    # Caches must keep the encodings of the same URL apart, even when this client gets the body as it is.
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if cache is not None:
+        key = (encoding, sha1(data).digest())
+        body = cache.get(key)
+        if body is None:
+            body = compress(data, encoding)
+            cache.set(key, body)
+    else:
+        body = compress(data, encoding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed body is a different representation, so a strong validator of the original no longer applies.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
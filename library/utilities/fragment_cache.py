@@ -0,0 +1,55 @@
+from flask import has_request_context, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+import library.adapters.repository as repo
+from library.utilities.lru import LRUCache
+
+
+class FragmentCache:
+    """ Caches rendered template fragments (and the data behind them) per repository version.
+
+    Keys always include the repository's change version and whether a user is logged in, so a write to the
+    repository or a login makes earlier entries unreachable; the LRU policy then ages them out.
+    """
+
+    def __init__(self, max_size: int = 512):
+        self.cache = LRUCache(max_size=max_size, name='fragments')
+
+    def init_app(self, app):
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+        app.extensions['fragment_cache'] = self
+
+    def make_key(self, name, vary=()):
+        logged_in = has_request_context() and 'user_name' in session
+        return (name, tuple(vary), repo.repo_instance.get_version().version, logged_in)
+
+    def get_or_set(self, name, vary, factory):
+        return self.cache.get_or_set(self.make_key(name, vary), factory)
+
+
+class FragmentCacheExtension(Extension):
+    """ Adds a {% cache name[, vary...] %} ... {% endcache %} tag to templates.
+
+    The body is rendered once per key and served from the FragmentCache afterwards. Anything the body depends on
+    other than the repository and the logged-in state must be passed as a vary argument, e.g.
+    {% cache 'navigation', session.get('user_name') %}.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        name = parser.parse_expression()
+        vary = []
+        while parser.stream.skip_if('comma'):
+            vary.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_cached', [name, nodes.List(vary)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, name, vary, caller):
+        return self.environment.fragment_cache.get_or_set(name, vary, caller)
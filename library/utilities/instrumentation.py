@@ -0,0 +1,262 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, jsonify, request
+from jinja2 import Template
+from werkzeug.wrappers import Response
+
+from library.utilities import lru
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request duration histogram's buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'library_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'library_request_duration_seconds': ('histogram', 'Time from the start of a request to its response.'),
+    'library_view_seconds_total': ('counter', 'Time spent in view functions.'),
+    'library_template_renders_total': ('counter', 'Templates rendered.'),
+    'library_template_render_seconds_total': ('counter', 'Time spent rendering templates.'),
+    'library_repository_calls_total': ('counter', 'Calls that reached the repository, by method.'),
+    'library_repository_call_seconds_total': ('counter', 'Time spent in repository methods.'),
+    'library_sql_statements_total': ('counter', 'SQL statements executed, by kind.'),
+    'library_sql_seconds_total': ('counter', 'Time spent executing SQL statements.'),
+    'library_cache_lookups_total': ('counter', 'Cache lookups, by cache and result.'),
+}
+
+
+class Instrumentation:
+    """ Times every request's view, template renders, repository calls and SQL statements, and counts cache hits.
+
+    Each response carries a Server-Timing header (see the browser's developer tools) with the request's timings,
+    each request can be logged as a line of key=value pairs, and the totals are served at /metrics in the Prometheus
+    text format. Repository calls are counted once they reach the repository, so the repository cache's hits show
+    up as cache lookups rather than repository calls. Nothing of this is installed unless INSTRUMENTATION is set.
+
+    Metrics are kept per process: with several server workers, each scrape of /metrics reaches one of them. /metrics
+    is only installed if METRICS_TOKEN is set, and scrapes have to carry it as a bearer token. Cache lookups are
+    counted by the instrumentation of the application they are made for, so several applications in one process
+    (e.g. in tests) keep their counts apart.
+    """
+
+    def __init__(self, server_timing: bool = True, log: bool = False):
+        self.server_timing = server_timing
+        self.log = log
+        self.metrics = Metrics()
+
+    def init_app(self, app, engine=None):
+        # Registered before the other extensions' hooks, so that the timing covers them too.
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.before_first_request(lambda: self.instrument_views(app))
+        app.jinja_env.template_class = TimedTemplate
+        lru.observe_lookups(_record_cache_lookup)
+        if engine is not None:
+            # Imported here, as SQLAlchemy is only loaded with the database repository.
+            from sqlalchemy import event
+
+            event.listen(engine, 'before_cursor_execute', _start_statement)
+            event.listen(engine, 'after_cursor_execute', self.record_statement)
+        if app.config.get('METRICS_TOKEN'):
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['instrumentation'] = self
+
+    def instrument_views(self, app):
+        # Views are wrapped once all blueprints are registered; functools.wraps keeps markers such as cacheable.
+        for endpoint, view in list(app.view_functions.items()):
+            if endpoint != 'metrics':
+                app.view_functions[endpoint] = self.__timed_view(view)
+
+    def start_request(self):
+        g.request_timings = RequestTimings()
+
+    def finish_request(self, response):
+        timings = g.pop('request_timings', None)
+        if timings is None or request.endpoint == 'metrics':
+            return response
+
+        total = time.perf_counter() - timings.start
+        endpoint = request.endpoint or 'unmatched'
+        self.metrics.inc('library_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                                    ('status', str(response.status_code))))
+        self.metrics.observe('library_request_duration_seconds', (('endpoint', endpoint),), total)
+        if timings.view:
+            self.metrics.inc('library_view_seconds_total', (('endpoint', endpoint),), timings.view)
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = timings.server_timing(total)
+        if self.log:
+            logger.info('request method=%s path=%s endpoint=%s status=%s %s', request.method, request.path, endpoint,
+                        response.status_code, timings.log_fields(total))
+        return response
+
+    def record_repository_call(self, method: str, seconds: float):
+        self.metrics.inc('library_repository_calls_total', (('method', method),))
+        self.metrics.inc('library_repository_call_seconds_total', (('method', method),), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.repository += seconds
+            timings.repository_calls += 1
+
+    def record_template(self, name: str, seconds: float):
+        self.metrics.inc('library_template_renders_total', (('template', name),))
+        self.metrics.inc('library_template_render_seconds_total', (('template', name),), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.template += seconds
+            timings.templates += 1
+
+    def record_statement(self, connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info['statement_starts'].pop()
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'EMPTY'
+        self.metrics.inc('library_sql_statements_total', (('kind', kind),))
+        self.metrics.inc('library_sql_seconds_total', (('kind', kind),), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.sql += seconds
+            timings.sql_statements += 1
+
+    def record_cache_lookup(self, cache: str, hit: bool):
+        self.metrics.inc('library_cache_lookups_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+        timings = _current_timings()
+        if timings is not None:
+            if hit:
+                timings.cache_hits += 1
+            else:
+                timings.cache_misses += 1
+
+    def metrics_view(self):
+        token = current_app.config['METRICS_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return jsonify(error='A valid bearer token is required'), 401
+        return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def __timed_view(self, view):
+        @wraps(view)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                timings = _current_timings()
+                if timings is not None:
+                    timings.view += time.perf_counter() - start
+
+        return timed
+
+
+class RequestTimings:
+    """ What one request has spent its time on so far, in seconds. """
+
+    __slots__ = ('start', 'view', 'template', 'templates', 'repository', 'repository_calls', 'sql', 'sql_statements',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view = self.template = self.repository = self.sql = 0.0
+        self.templates = self.repository_calls = self.sql_statements = self.cache_hits = self.cache_misses = 0
+
+    def server_timing(self, total: float) -> str:
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'view;dur={self.view * 1000:.1f}',
+            f'template;dur={self.template * 1000:.1f};desc="{self.templates} rendered"',
+            f'repository;dur={self.repository * 1000:.1f};desc="{self.repository_calls} calls"',
+            f'sql;dur={self.sql * 1000:.1f};desc="{self.sql_statements} statements"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+        ])
+
+    def log_fields(self, total: float) -> str:
+        return (f'total_ms={total * 1000:.1f} view_ms={self.view * 1000:.1f} template_ms={self.template * 1000:.1f} '
+                f'templates={self.templates} repository_ms={self.repository * 1000:.1f} '
+                f'repository_calls={self.repository_calls} sql_ms={self.sql * 1000:.1f} '
+                f'sql_statements={self.sql_statements} cache_hits={self.cache_hits} cache_misses={self.cache_misses}')
+
+
+class TimedTemplate(Template):
+    """ A template reporting how long each render takes; includes and extends are timed with the outer template. """
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            instrumentation = current_app.extensions.get('instrumentation')
+            if instrumentation is not None:
+                instrumentation.record_template(self.name or 'string', time.perf_counter() - start)
+
+
+class Metrics:
+    """ Thread-safe counters and histograms, rendered in the Prometheus text exposition format. """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = dict()  # name -> {labels: value}
+        self.__histograms = dict()  # name -> {labels: [count per bucket..., sum]}
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        with self.__lock:
+            series = self.__counters.setdefault(name, dict())
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self.__lock:
+            series = self.__histograms.setdefault(name, dict())
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            counts[bisect_left(DURATION_BUCKETS, value)] += 1
+            counts[-1] += value
+
+    def render(self) -> str:
+        lines = list()
+        with self.__lock:
+            for name, (kind, description) in METRICS.items():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'counter':
+                    for labels, value in sorted(self.__counters.get(name, {}).items()):
+                        lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                for labels, counts in sorted(self.__histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(DURATION_BUCKETS + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(counts[-1])}')
+                    lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _current_timings():
+    return g.get('request_timings') if has_request_context() else None
+
+
+def _record_cache_lookup(cache: str, hit: bool):
+    # The observer of every LRUCache in the process; lookups made outside an application are not counted.
+    instrumentation = current_app.extensions.get('instrumentation') if has_app_context() else None
+    if instrumentation is not None:
+        instrumentation.record_cache_lookup(cache, hit)
+
+
+def _start_statement(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('statement_starts', []).append(time.perf_counter())
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value) -> str:
+    return str(value) if isinstance(value, int) else repr(round(value, 6))
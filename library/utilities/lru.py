@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ A thread-safe, size-bounded mapping that evicts the least recently used entry first.
+
+    Entries can optionally expire after a time-to-live, and the cache can be bounded by total weight (for example
+    the number of bytes held) as well as by the number of entries. Hits, misses and evictions are counted so callers
+    can report a hit ratio; the lookups of named caches are also reported to the observer set with observe_lookups.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None, max_weight: int = None, weigher=None,
+                 name: str = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.__weigher = weigher if weigher is not None else (lambda value: 1)
+
+        # Maps key -> (value, weight, expiry time or None).
+        self.__entries = OrderedDict()
+        self.__weight = 0
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self.__remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+
+        if _observer is not None and self.name is not None:
+            _observer(self.name, entry is not None)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        if self.max_size <= 0:
+            return
+
+        weight = self.__weigher(value)
+        if self.max_weight is not None and weight > self.max_weight:
+            # Never worth holding; it would evict everything else.
+            return
+
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (value, weight, expires)
+            self.__weight += weight
+
+            while len(self.__entries) > self.max_size or \
+                    (self.max_weight is not None and self.__weight > self.max_weight):
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def get_or_set(self, key, factory, ttl: float = None):
+        """ Returns the value cached for key, calling factory() to compute and store it on a miss. """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            if key not in self.__entries:
+                return default
+            return self.__remove(key)
+
+    def discard_where(self, predicate):
+        """ Removes every entry whose key satisfies predicate. """
+        with self.__lock:
+            for key in [key for key in self.__entries if predicate(key)]:
+                self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__weight = 0
+
+    @property
+    def weight(self) -> int:
+        return self.__weight
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'weight': self.__weight,
+            'max_weight': self.max_weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hit_ratio, 4)
+        }
+
+    def __remove(self, key):
+        value, weight, _ = self.__entries.pop(key)
+        self.__weight -= weight
+        return value
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        # A membership test is not a lookup, so it leaves recency and the counters alone.
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+
+
+_MISSING = object()
+
+_observer = None
+
+
+def observe_lookups(observer):
+    """ Calls observer(cache_name, hit) after every lookup in a named cache; None stops observing. """
+    global _observer
+    _observer = observer
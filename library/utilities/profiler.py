@@ -0,0 +1,176 @@
+import hmac
+import logging
+import os
+import random
+import signal
+import sys
+import sysconfig
+import threading
+import time
+import weakref
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from flask import request, Response, current_app, jsonify
+
+logger = logging.getLogger(__name__)
+
+# Profilers of this process, restarted in forked children (e.g. the workers of a pre-forking server).
+_profilers = weakref.WeakSet()
+
+# Frame file names are shown relative to the project, or to where the standard library and packages live.
+_PATH_PREFIXES = sorted({
+    str(Path(__file__).resolve().parents[2]) + os.sep,
+    sysconfig.get_paths()['purelib'] + os.sep,
+    sysconfig.get_paths()['platlib'] + os.sep,
+    sysconfig.get_paths()['stdlib'] + os.sep,
+}, key=len, reverse=True)
+
+
+class SamplingProfiler:
+    """ Samples the stacks of the threads handling selected requests, and aggregates them per endpoint.
+
+    A request is profiled if its endpoint is one of endpoints, or else with probability sample_rate. While any
+    profiled request is running, a background thread takes the stack of each one every interval seconds; when none
+    is, the thread waits, so requests that are not profiled cost no more than the choice. Stacks are counted with the
+    endpoint (e.g. book_bp.books_by_genre) as their root frame, so a flamegraph of them attributes CPU to views.
+
+    dump() writes the stacks counted so far in the collapsed format flamegraph.pl, speedscope and similar tools
+    read. With signals, SIGUSR1 switches profiling on and off and SIGUSR2 dumps, in the process that receives them
+    (with a pre-forking server, signal the workers). /debug/profile serves the collapsed stacks as text, to requests
+    carrying PROFILER_TOKEN as a bearer token; it is not installed if the token is empty.
+    """
+
+    MAX_STACKS = 50000
+
+    def __init__(self, endpoints=(), sample_rate: float = 0.1, interval: float = 0.005, directory='profiles',
+                 enabled: bool = True):
+        self.endpoints = frozenset(endpoints)
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self.__restart()
+        _profilers.add(self)
+
+    def init_app(self, app, signals: bool = False):
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+        if app.config.get('PROFILER_TOKEN'):
+            app.add_url_rule('/debug/profile', 'profile', self.profile_view)
+        if signals and threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda received, frame: self.toggle())
+            signal.signal(signal.SIGUSR2, lambda received, frame: self.dump())
+        app.extensions['profiler'] = self
+
+    def start_request(self):
+        if not self.enabled or request.endpoint in (None, 'profile', 'static'):
+            return
+        if request.endpoint in self.endpoints or random.random() < self.sample_rate:
+            with self.__lock:
+                self.__profiled[threading.get_ident()] = request.endpoint
+                if self.__sampler is None:
+                    self.__sampler = threading.Thread(target=self.__sample, name='profiler', daemon=True)
+                    self.__sampler.start()
+            self.__wakeup.set()
+
+    def finish_request(self, exception=None):
+        if self.__profiled:
+            with self.__lock:
+                self.__profiled.pop(threading.get_ident(), None)
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        logger.info('Profiling %s in process %s', 'enabled' if self.enabled else 'disabled', os.getpid())
+
+    def collapsed(self, endpoint: str = None) -> str:
+        """ The stacks counted so far, one 'frame;frame;... count' line each, outermost frame first. """
+        with self.__lock:
+            stacks = sorted(self.__stacks.items())
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks
+                       if endpoint is None or stack.split(';', 1)[0] == endpoint)
+
+    def dump(self) -> Path:
+        """ Writes the stacks counted so far to a new file in the profile directory, and returns its path. """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.collapsed'
+        path.write_text(self.collapsed(), encoding='utf-8')
+        logger.info('Profile written to %s', path)
+        return path
+
+    def clear(self):
+        with self.__lock:
+            self.__stacks.clear()
+
+    def profile_view(self):
+        token = current_app.config['PROFILER_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return jsonify(error='A valid bearer token is required'), 401
+        return Response(self.collapsed(request.args.get('endpoint')), mimetype='text/plain')
+
+    def restart_after_fork(self):
+        # Only the forking thread survives a fork; the child counts its own samples on its own thread.
+        self.__restart()
+
+    def __restart(self):
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__profiled = dict()  # thread ident -> endpoint
+        self.__stacks = Counter()  # 'endpoint;frame;...' -> samples
+        self.__sampler = None
+
+    def __sample(self):
+        current_frames = sys._current_frames
+        while True:
+            if not self.__profiled:
+                self.__wakeup.clear()
+                # Checked again after clearing, so a request starting in between is not missed.
+                if not self.__profiled:
+                    self.__wakeup.wait()
+            frames = current_frames()
+            with self.__lock:
+                profiled = list(self.__profiled.items())
+            for ident, endpoint in profiled:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.__count(endpoint + ';' + ';'.join(_frame_names(frame)))
+            del frames
+            time.sleep(self.interval)
+
+    def __count(self, stack: str):
+        with self.__lock:
+            if stack in self.__stacks or len(self.__stacks) < self.MAX_STACKS:
+                self.__stacks[stack] += 1
+            else:
+                self.__stacks[stack.split(';', 1)[0] + ';[other stacks]'] += 1
+
+
+def _frame_names(frame):
+    names = list()
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})')
+        if code.co_name == 'wsgi_app':
+            # The server's frames below the application are the same for every request.
+            break
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _short_path(filename: str):
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def _restart_profilers_after_fork():
+    for profiler in list(_profilers):
+        profiler.restart_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_profilers_after_fork)
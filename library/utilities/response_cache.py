@@ -0,0 +1,97 @@
+import hmac
+
+from flask import request, session, current_app, jsonify
+from werkzeug.urls import url_encode
+from werkzeug.wrappers import Response
+
+import library.adapters.repository as repo
+from library.adapters.caching_repository import CachingRepository
+from library.utilities.compression import negotiate_encoding
+from library.utilities.lru import LRUCache
+
+
+class ResponseCache:
+    """ Caches whole responses of cacheable views for anonymous visitors.
+
+    Only GET/HEAD requests without a logged-in user are served from or stored in the cache, and only for views
+    marked as cacheable (see utilities.conditional_get). Entries are keyed by the normalised path and query string,
+    bounded by total body size with LRU eviction and a TTL, and dropped as soon as the repository version changes.
+
+    /debug/cache serves the statistics of the application's caches to requests carrying CACHE_STATS_TOKEN as a bearer
+    token; it is not installed if the token is empty.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 300):
+        self.cache = LRUCache(max_size=100000, ttl=ttl, max_weight=max_bytes, weigher=_response_weight,
+                              name='responses')
+        self.__version = None
+
+    def init_app(self, app):
+        # Registered after the repository's own before_request hook, so the database session is ready by now.
+        app.before_request(self.serve_cached)
+        app.after_request(self.store)
+        if app.config.get('CACHE_STATS_TOKEN'):
+            app.add_url_rule('/debug/cache', 'cache_stats', self.stats_view)
+        app.extensions['response_cache'] = self
+
+    def serve_cached(self):
+        if not self.__applies():
+            return None
+
+        self.__check_version()
+        entry = self.cache.get(self.__key())
+        if entry is None:
+            return None
+
+        status, headers, body = entry
+        response = Response(body, status=status, headers=headers)
+        response.headers['X-Response-Cache'] = 'HIT'
+        return response.make_conditional(request)
+
+    def store(self, response):
+        if self.__applies() and response.status_code == 200 and 'X-Response-Cache' not in response.headers \
+                and not session.modified and not response.is_streamed \
+                and repo.repo_instance.get_version().version == self.__version:
+            headers = [(name, value) for name, value in response.headers if name.lower() != 'date']
+            self.cache.set(self.__key(), (response.status_code, headers, response.get_data()))
+            response.headers['X-Response-Cache'] = 'MISS'
+        return response
+
+    def stats_view(self):
+        token = current_app.config['CACHE_STATS_TOKEN']
+        authorization = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return jsonify(error='A valid bearer token is required'), 401
+        stats = {'response_cache': self.cache.stats()}
+        fragment_cache = current_app.extensions.get('fragment_cache')
+        if fragment_cache is not None:
+            stats['fragment_cache'] = fragment_cache.cache.stats()
+        response_compressor = current_app.extensions.get('response_compressor')
+        if response_compressor is not None:
+            stats['compression_cache'] = response_compressor.cache.stats()
+        if isinstance(repo.repo_instance, CachingRepository):
+            stats['repository_cache'] = repo.repo_instance.stats()
+        return jsonify(stats)
+
+    def __applies(self):
+        view = current_app.view_functions.get(request.endpoint)
+        return request.method in ('GET', 'HEAD') and getattr(view, 'cacheable', False) and 'user_name' not in session
+
+    def __check_version(self):
+        # Every write to the repository can change any page, so the whole cache is invalidated at once.
+        version = repo.repo_instance.get_version().version
+        if version != self.__version:
+            self.cache.clear()
+            self.__version = version
+
+    def __key(self):
+        path = request.path.rstrip('/') or '/'
+        query = url_encode(sorted(request.args.items(multi=True)))
+        # Compressed responses are only served to clients that accept the same encoding.
+        encoding = negotiate_encoding(request.accept_encodings) or 'identity'
+        return f'{path}?{query}#{encoding}'
+
+
+def _response_weight(entry):
+    status, headers, body = entry
+    return len(body) + sum(len(name) + len(value) for name, value in headers)
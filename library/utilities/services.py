@@ -35,8 +35,10 @@ def get_random_books(quantity, repo: AbstractRepository):
         # Reduce the quantity of ids to generate if the repository has an insufficient number of articles.
         quantity = book_count - 1
 
-    # Pick distinct and random articles.
-    random_ids = random.sample(range(1, book_count), quantity)
+    # Pick distinct and random articles. Seeding with the repository version keeps the picks stable until the
+    # catalogue changes, so pages showing them stay cacheable (see utilities.conditional_get).
+    picker = random.Random(repo.get_version().version)
+    random_ids = picker.sample(range(1, book_count), quantity)
     books = repo.get_books_by_id(random_ids)
 
     return books_to_dict(books)
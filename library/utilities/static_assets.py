@@ -0,0 +1,55 @@
+import os
+from hashlib import sha1
+
+from flask import request, safe_join
+
+
+class StaticAssets:
+    """ Gives static files content-hash URLs, which browsers may then cache for good.
+
+    url_for('static', filename=...) gains a v query argument holding a digest of the file's content. A request that
+    carries the file's current digest is answered with a far-future, immutable Cache-Control, so repeat visitors
+    do not ask for the file again; once the file changes, pages link to it under a new URL. Digests are recomputed
+    when a file's modification time changes.
+    """
+
+    MAX_AGE = 365 * 24 * 60 * 60
+
+    def __init__(self):
+        self.static_folder = None
+        self.__digests = dict()
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        app.url_defaults(self.add_fingerprint)
+        app.after_request(self.set_cache_control)
+        app.extensions['static_assets'] = self
+
+    def fingerprint(self, filename: str):
+        # A short digest of the file's content, or None if there is no such file.
+        path = safe_join(self.static_folder, filename)
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except (TypeError, OSError):
+            return None
+
+        entry = self.__digests.get(path)
+        if entry is None or entry[0] != modified:
+            with open(path, 'rb') as infile:
+                entry = (modified, sha1(infile.read()).hexdigest()[:12])
+            self.__digests[path] = entry
+        return entry[1]
+
+    def add_fingerprint(self, endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            digest = self.fingerprint(values.get('filename', ''))
+            if digest is not None:
+                values['v'] = digest
+
+    def set_cache_control(self, response):
+        if request.endpoint == 'static' and response.status_code in (200, 304) and 'v' in request.args \
+                and request.args['v'] == self.fingerprint(request.view_args['filename']):
+            response.cache_control.public = True
+            response.cache_control.max_age = self.MAX_AGE
+            response.cache_control.immutable = True
+        return response
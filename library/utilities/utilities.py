@@ -1,4 +1,8 @@
-from flask import Blueprint, request, render_template, redirect, url_for, session
+from functools import wraps
+from hashlib import sha1
+
+from flask import Blueprint, request, render_template, redirect, url_for, session, make_response, current_app
+from werkzeug.http import is_resource_modified
 
 import library.adapters.repository as repo
 import library.utilities.services as services
@@ -10,6 +14,27 @@ utilities_blueprint = Blueprint(
 
 
 def get_genres_and_urls():
+    return _cached('genre_urls', _genres_and_urls)
+
+
+def get_authors_and_urls():
+    return _cached('author_urls', _authors_and_urls)
+
+
+def get_publishers_and_urls():
+    return _cached('publisher_urls', _publishers_and_urls)
+
+
+def get_selected_books(quantity=3):
+    # The picks only change with the repository version, so they can be cached alongside the url maps.
+    return _cached('selected_books', lambda: _selected_books(quantity), quantity)
+
+
+def _cached(name, factory, *vary):
+    return current_app.extensions['fragment_cache'].get_or_set(name, vary, factory)
+
+
+def _genres_and_urls():
     genre_names = services.get_genre_names(repo.repo_instance)
     genre_urls = dict()
     for genre_name in genre_names:
@@ -18,7 +43,7 @@ def get_genres_and_urls():
     return genre_urls
 
 
-def get_authors_and_urls():
+def _authors_and_urls():
     author_names = services.get_author_names(repo.repo_instance)
     author_urls = dict()
     for author_name in author_names:
@@ -27,7 +52,7 @@ def get_authors_and_urls():
     return author_urls
 
 
-def get_publishers_and_urls():
+def _publishers_and_urls():
     publisher_names = services.get_publisher_names(repo.repo_instance)
     publisher_urls = dict()
     for publisher_name in publisher_names:
@@ -36,9 +61,51 @@ def get_publishers_and_urls():
     return publisher_urls
 
 
-def get_selected_books(quantity=3):
+def _selected_books(quantity):
     books = services.get_random_books(quantity, repo.repo_instance)
 
     for book in books:
         book['hyperlink'] = url_for('book_bp.books_by_release_year', release_year=book['release_year'])
     return books
+
+
+def conditional_get(view):
+    """ Makes a read-only view answer conditional GETs from the repository's change version.
+
+    The weak ETag combines the version with the logged-in user (the navigation panel greets them), so a matching
+    If-None-Match or a recent enough If-Modified-Since is answered with 304 before the view or its templates run.
+    Pages rendered for a logged-in user, or showing pending reviews, only carry the ETag: a modification date cannot
+    tell them from the page another visitor was sent.
+    """
+    @wraps(view)
+    def wrapped_view(**kwargs):
+        version = repo.repo_instance.get_version()
+        etag = make_etag(version.version)
+        personalised = 'user_name' in session or 'pending_reviews' in session
+        last_modified = None if personalised else version.last_modified
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                # Redirects and errors are not worth revalidating.
+                return response
+
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+
+    # Lets the anonymous response cache know that this view's output only depends on the request and the repository.
+    wrapped_view.cacheable = True
+    return wrapped_view
+
+
+def make_etag(version: int):
+    # Reviews waiting in the write-behind queue are shown to their author, so they are part of the validator too.
+    user_name = session.get('user_name', '')
+    pending_reviews = session.get('pending_reviews', [])
+    return sha1(f'{version}:{user_name}:{pending_reviews}'.encode('utf-8')).hexdigest()[:20]
@@ -0,0 +1,16 @@
+"""Serves the application from several worker processes without gunicorn (see library/server.py).
+
+    $ python serve.py
+
+The address, workers, threads, preloading and shutdown timeout are read from config.Config (see .env). Send SIGHUP
+to the master process for a graceful restart, and SIGTERM (or press Ctrl+C) to stop it.
+"""
+import logging
+
+from config import Config
+from library import create_app
+from library.server import PreforkServer
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+    PreforkServer.from_config(create_app, Config).serve_forever()
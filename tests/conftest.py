@@ -8,6 +8,7 @@ from utils import get_project_root
 # the csv files in the test folder are different from the csv files in the library/adapters/data folder!
 # tests are written against the csv files in tests, this data path is used to override default path for testing
 TEST_DATA_PATH = get_project_root() / "tests" / "data"
+CACHE_STATS_TOKEN = 'cache-stats-token'
 
 
 @pytest.fixture
@@ -29,6 +30,50 @@ def client():
     return my_app.test_client()
 
 
+@pytest.fixture
+def cached_client():
+    my_app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'RESPONSE_CACHE': True,                         # Serve anonymous page views from the response cache.
+        'CACHE_STATS_TOKEN': CACHE_STATS_TOKEN          # Serve the caches' statistics at /debug/cache.
+    })
+
+    return my_app.test_client()
+
+
+@pytest.fixture
+def server_session_client(tmp_path):
+    my_app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'SESSION_BACKEND': 'sqlite',                    # Keep sessions on the server; the cookie only holds an id.
+        'SESSION_SQLITE_PATH': tmp_path / 'sessions.db'
+    })
+
+    return my_app.test_client()
+
+
+@pytest.fixture
+def write_behind_client(tmp_path):
+    my_app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'REVIEW_WRITE_BEHIND': True,                    # Queue reviews rather than storing them in the request.
+        'REVIEW_JOURNAL_DIR': tmp_path,
+        'REVIEW_FLUSH_INTERVAL': 3600                   # Only flush when a test asks for it.
+    })
+
+    yield my_app.test_client()
+    my_app.extensions['review_queue'].stop()
+
+
 class AuthenticationManager:
     def __init__(self, client):
         self.__client = client
@@ -46,3 +91,13 @@ class AuthenticationManager:
 @pytest.fixture
 def auth(client):
     return AuthenticationManager(client)
+
+
+@pytest.fixture
+def cached_auth(cached_client):
+    return AuthenticationManager(cached_client)
+
+
+@pytest.fixture
+def server_session_auth(server_session_client):
+    return AuthenticationManager(server_session_client)
@@ -1,7 +1,16 @@
+import gzip
+import json
+import re
+
 import pytest
 
 from flask import session
 
+import library.adapters.repository as repo
+from library import create_app
+
+from tests.conftest import TEST_DATA_PATH, CACHE_STATS_TOKEN
+
 
 def test_register(client):
     # Check that we retrieve the register page.
@@ -49,6 +58,18 @@ def test_login(client, auth):
         assert session['user_name'] == 'thorke'
 
 
+def test_login_is_throttled(client, auth):
+    # Repeated failed logins are refused, without checking the password, once the burst is used up.
+    for _ in range(5):
+        response = auth.login(password='WrongPassword1')
+        assert response.status_code == 200
+        assert b'Password does not match supplied user name' in response.data
+
+    response = auth.login()
+    assert response.status_code == 429
+    assert b'Too many login attempts' in response.data
+
+
 def test_logout(client, auth):
     # Login a user.
     auth.login()
@@ -104,6 +125,26 @@ def test_review_with_invalid_input(client, auth, review_text, messages):
         assert message in response.data
 
 
+@pytest.mark.parametrize('rating', ('9', '0', 'x'))
+def test_review_with_invalid_rating(client, auth, rating):
+    auth.login()
+
+    response = client.post('/review', data={'review': 'Wowowowowow', 'review_rating': rating, 'book_id': 1})
+    assert b'Your review rating has to be from 1 to 5' in response.data
+
+
+def test_review_of_unknown_book_is_refused(write_behind_client):
+    client = write_behind_client
+    client.post('authentication/login', data={'user_name': 'thorke', 'password': 'cLQ^C#oFXloS'})
+
+    reviews = len(repo.repo_instance.get_reviews())
+
+    response = client.post('/review', data={'review': 'Wowowowowow', 'review_rating': 4, 'book_id': 99999})
+    assert response.status_code == 404
+    client.application.extensions['review_queue'].flush()
+    assert len(repo.repo_instance.get_reviews()) == reviews
+
+
 def test_book_without_release_year(client):
     # Check that we can retrieve the books page.
     response = client.get('/books_by_release_year')
@@ -156,3 +197,289 @@ def test_books_with_publisher(client):
     assert response.status_code == 200
 
     assert b'None' in response.data
+
+
+def test_catalogue_page_answers_conditional_get(client):
+    response = client.get('/books_by_genre?genre=Crime')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert 'Last-Modified' in response.headers
+
+    response = client.get('/books_by_genre?genre=Crime', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_pages_of_logged_in_users_are_not_revalidated_by_date(client, auth):
+    last_modified = client.get('/books_by_genre?genre=Crime').headers['Last-Modified']
+    auth.login()
+
+    # The anonymous visitor's copy is as recent, but was not rendered for this user.
+    response = client.get('/books_by_genre?genre=Crime', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response.headers
+
+    response = client.get('/books_by_genre?genre=Crime', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_reviewing_invalidates_catalogue_etag(client, auth):
+    auth.login()
+    etag = client.get('/').headers['ETag']
+
+    client.post('/review', data={'review': "Wowowowowow", 'review_rating': 4, 'book_id': 1})
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_anonymous_pages_are_served_from_response_cache(cached_client):
+    response = cached_client.get('/books_by_genre?genre=Crime&cursor=0')
+    assert response.headers['X-Response-Cache'] == 'MISS'
+
+    # The query string is normalised, so reordered parameters hit the same entry.
+    response = cached_client.get('/books_by_genre?cursor=0&genre=Crime')
+    assert response.headers['X-Response-Cache'] == 'HIT'
+    assert b'The House of Memory' in response.data
+
+    stats = cached_client.get('/debug/cache', headers={'Authorization': 'Bearer ' + CACHE_STATS_TOKEN}).get_json()
+    assert stats['response_cache']['hits'] == 1
+
+
+def test_cache_statistics_require_the_token(cached_client):
+    assert cached_client.get('/debug/cache').status_code == 401
+    assert cached_client.get('/debug/cache', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    # Without a token the endpoint is not installed.
+    app = create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH,
+                      'RESPONSE_CACHE': True, 'CACHE_STATS_TOKEN': ''})
+    assert app.test_client().get('/debug/cache').status_code == 404
+
+
+def test_response_cache_is_bypassed_for_logged_in_users(cached_client, cached_auth):
+    cached_auth.login()
+
+    response = cached_client.get('/books_by_genre?genre=Crime')
+    assert 'X-Response-Cache' not in response.headers
+
+
+def test_response_cache_is_invalidated_by_writes(cached_client, cached_auth):
+    cached_client.get('/books_by_release_year?release_year=1987')
+
+    cached_auth.login()
+    cached_client.post('/review', data={'review': "Wowowowowow", 'review_rating': 4, 'book_id': 1})
+    cached_client.get('/authentication/logout')
+
+    response = cached_client.get('/books_by_release_year?release_year=1987')
+    assert response.headers['X-Response-Cache'] == 'MISS'
+
+
+def test_queued_review_is_visible_to_its_author(write_behind_client):
+    client = write_behind_client
+    client.post('authentication/login', data={'user_name': 'thorke', 'password': 'cLQ^C#oFXloS'})
+
+    response = client.post(
+        '/review',
+        data={'review': 'Still in the queue', 'review_rating': 4, 'book_id': 1}
+    )
+    assert response.headers['Location'] == 'http://localhost/books_by_release_year?release_year=1987&view_reviews_for=1'
+
+    # The review has not been stored yet, but its author sees it.
+    response = client.get('/books_by_release_year?release_year=1987&view_reviews_for=1')
+    assert b'Still in the queue' in response.data
+
+    client.application.extensions['review_queue'].flush()
+    client.get('/authentication/logout')
+
+    response = client.get('/books_by_release_year?release_year=1987&view_reviews_for=1')
+    assert b'Still in the queue' in response.data
+
+
+def test_rankings(client):
+    response = client.get('/books_most_reviewed')
+    assert response.status_code == 200
+    assert b'Most reviewed books' in response.data
+
+    response = client.get('/books_top_rated')
+    assert response.status_code == 200
+    assert b'Rating:' in response.data
+
+
+def test_server_side_session(server_session_client, server_session_auth):
+    client = server_session_client
+    server_session_auth.login()
+
+    # The cookie carries only a signed session id, not the session data.
+    cookie = next(cookie for cookie in client.cookie_jar if cookie.name == 'session')
+    assert 'thorke' not in cookie.value
+    with client:
+        client.get('/')
+        assert session['user_name'] == 'thorke'
+
+    # The user is looked up once for the session, not for every review.
+    repository = repo.repo_instance
+    lookups = []
+    get_user = repository.get_user
+    repository.get_user = lambda user_name: lookups.append(user_name) or get_user(user_name)
+    for rating in (3, 4):
+        response = client.post('/review', data={'review': 'Read it twice', 'review_rating': rating, 'book_id': 1})
+        assert response.status_code == 302
+    assert lookups == ['thorke']
+
+    # Logging out removes the session from the store; its id no longer logs anybody in.
+    client.get('/authentication/logout')
+    client.set_cookie('localhost', 'session', cookie.value)
+    response = client.post('/review', data={'review': 'Read it thrice', 'review_rating': 5, 'book_id': 1})
+    assert response.headers['Location'] == 'http://localhost/authentication/login'
+
+
+def test_logout_is_seen_by_every_process_sharing_the_sessions(server_session_client, server_session_auth, tmp_path):
+    # A second application stands for another worker process, with a cache of its own and the same backend.
+    other_client = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'SESSION_BACKEND': 'sqlite',
+        'SESSION_SQLITE_PATH': tmp_path / 'sessions.db'
+    }).test_client()
+
+    server_session_auth.login()
+    cookie = next(cookie for cookie in server_session_client.cookie_jar if cookie.name == 'session')
+    other_client.set_cookie('localhost', 'session', cookie.value)
+    response = other_client.post('/review', data={'review': 'Read it twice', 'review_rating': 4, 'book_id': 1})
+    assert response.headers['Location'] != 'http://localhost/authentication/login'
+
+    server_session_client.get('/authentication/logout')
+    response = other_client.post('/review', data={'review': 'Read it thrice', 'review_rating': 5, 'book_id': 1})
+    assert response.headers['Location'] == 'http://localhost/authentication/login'
+
+
+def test_server_side_session_id_changes_on_login(server_session_client, server_session_auth):
+    client = server_session_client
+    with client.session_transaction() as anonymous_session:
+        anonymous_session['visited'] = True
+    anonymous_cookie = next(cookie for cookie in client.cookie_jar if cookie.name == 'session')
+
+    server_session_auth.login()
+    cookie = next(cookie for cookie in client.cookie_jar if cookie.name == 'session')
+    assert cookie.value != anonymous_cookie.value
+
+
+def test_export_books(client):
+    response = client.get('/api/books')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    books = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [book['book_id'] for book in books] == sorted(book['book_id'] for book in books)
+    assert books[0]['title'] == 'The House of Memory'
+    assert books[0]['genres'] == ['Crime']
+
+    # An interrupted export resumes after the last book received.
+    response = client.get('/api/books?after_id={}'.format(books[-3]['book_id']))
+    assert [json.loads(line) for line in response.data.decode('utf-8').splitlines()] == books[-2:]
+
+    assert client.get('/api/books?after_id=last').status_code == 400
+
+
+def test_api_pages_through_books(client):
+    page = client.get('/api/v1/books?limit=8').json
+    assert len(page['books']) == 8
+    assert page['books'][0]['title'] == 'The House of Memory'
+    assert page['books'][0]['genres'] == ['Crime']
+
+    book_ids = [book['book_id'] for book in page['books']]
+    while page['next'] is not None:
+        page = client.get(page['next']).json
+        book_ids.extend(book['book_id'] for book in page['books'])
+    assert book_ids == sorted(book['book_id'] for book in client.get('/api/v1/books?limit=100').json['books'])
+
+    assert client.get('/api/v1/books?limit=0').status_code == 400
+    assert client.get('/api/v1/books?after_id=last').json == {'error': 'after_id must be an integer'}
+
+
+def test_api_books_with_genre_and_fields(client):
+    page = client.get('/api/v1/books?genre=Crime&limit=2&fields=book_id,title').json
+    assert page['books'] == [{'book_id': 1, 'title': 'The House of Memory'}, {'book_id': 4, 'title': 'Matto regiert'}]
+    assert page['next'] == '/api/v1/books?cursor=2&limit=2&genre=Crime&fields=book_id%2Ctitle'
+
+    assert client.get('/api/v1/books?fields=book_id,genre_books').json == {'error': 'Unknown fields: genre_books'}
+    assert client.get('/api/v1/books?genre=Crime&author=James Reiner').status_code == 400
+    # Field names are checked even when no record is returned.
+    assert client.get('/api/v1/books?genre=Poetry&fields=genre_books').status_code == 400
+
+
+def test_api_books_with_author_or_publisher(client):
+    assert [book['book_id'] for book in client.get('/api/v1/books?author=James Reiner').json['books']] == [1, 12, 16]
+    assert [book['book_id'] for book in client.get('/api/v1/books?publisher=Penguin').json['books']] == [1, 5, 7, 9]
+
+
+def test_api_book_and_reviews(client):
+    book = client.get('/api/v1/books/1').json
+    assert book['title'] == 'The House of Memory'
+    assert book['review_count'] == 1
+    assert 'reviews' not in book
+
+    reviews = client.get('/api/v1/books/1/reviews').json['reviews']
+    assert reviews[0]['user_name'] == 'thorke'
+    assert reviews[0]['rating'] == 3
+
+    assert client.get('/api/v1/books/707611').status_code == 404
+    assert client.get('/api/v1/books/707611/reviews').json == {'error': 'No such book'}
+
+
+def test_api_year_navigation(client):
+    year = client.get('/api/v1/years/2012?fields=title').json
+    assert year['books'] == [{'title': 'Jackrabbit Junction Jitters'}, {'title': 'Gyvenimas po gyvenimo'}]
+    assert (year['first_year'], year['previous_year'], year['next_year'], year['last_year']) == (1987, 2010, 2013, 2016)
+
+    assert client.get('/api/v1/years/1066').status_code == 404
+
+
+def test_api_lists_genres_authors_and_publishers(client):
+    assert {'genre_name': 'Crime'} in client.get('/api/v1/genres').json['genres']
+    assert {'author_id': 1, 'full_name': 'James Reiner'} in client.get('/api/v1/authors').json['authors']
+    assert {'publisher_id': 1, 'name': 'Penguin'} in client.get('/api/v1/publishers').json['publishers']
+
+
+def test_api_compresses_responses(client):
+    plain = client.get('/api/v1/books')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    compressed = client.get('/api/v1/books', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert len(compressed.data) < len(plain.data)
+
+    # The JSON for a page is a fraction of the HTML page showing the same books.
+    assert len(client.get('/api/v1/books?genre=Crime&limit=3').data) < len(client.get('/books_by_genre?genre=Crime').data) / 3
+
+
+def test_pages_are_compressed(client):
+    plain = client.get('/books_by_genre?genre=Crime')
+    compressed = client.get('/books_by_genre?genre=Crime', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+
+    # The compressed page is kept, and served again to the next client.
+    compressor = client.application.extensions['response_compressor']
+    client.get('/books_by_genre?genre=Crime', headers={'Accept-Encoding': 'gzip'})
+    assert compressor.cache.hits == 1
+
+
+def test_static_assets_have_content_hash_urls(client):
+    response = client.get('/')
+    css_url = re.search(r'href="(/static/css/main.css\?v=\w+)"', response.data.decode('utf-8')).group(1)
+
+    response = client.get(css_url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+
+    # Outdated links fall back to the usual, short expiry.
+    response = client.get('/static/css/main.css?v=0123456789ab')
+    assert response.cache_control.max_age != 365 * 24 * 60 * 60
@@ -0,0 +1,86 @@
+import pytest
+
+from library.adapters.caching_repository import CachingRepository
+from library.domain.model import Genre, make_review
+
+
+@pytest.fixture
+def caching_repo(in_memory_repo):
+    return CachingRepository(in_memory_repo, max_size=100)
+
+
+def test_caching_repository_serves_repeated_lookups_from_cache(caching_repo, in_memory_repo):
+    book = caching_repo.get_book(1)
+    assert caching_repo.get_book(1) is book
+    assert caching_repo.get_book_ids_for_genre('Crime') == in_memory_repo.get_book_ids_for_genre('Crime') != []
+    caching_repo.get_book_ids_for_genre('Crime')
+
+    stats = caching_repo.stats()
+    assert stats['methods']['get_book'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+    assert stats['methods']['get_book_ids_for_genre']['hits'] == 1
+
+
+def test_caching_repository_returns_copies_of_id_lists(caching_repo):
+    book_ids = caching_repo.get_book_ids_for_genre('Crime')
+    book_ids.append(-1)
+    assert -1 not in caching_repo.get_book_ids_for_genre('Crime')
+
+
+def test_caching_repository_caches_navigation_by_release_year(caching_repo):
+    book = caching_repo.get_book(1)
+    previous_year = caching_repo.get_release_year_of_previous_book(book)
+    next_year = caching_repo.get_release_year_of_next_book(book)
+
+    assert caching_repo.get_release_year_of_previous_book(book) == previous_year
+    assert caching_repo.get_release_year_of_next_book(book) == next_year
+    assert caching_repo.stats()['methods']['get_release_year_of_next_book']['hits'] == 1
+
+
+def test_caching_repository_drops_books_when_reviewed(caching_repo):
+    user = caching_repo.get_user('fmercury')
+    caching_repo.get_book(1)
+    caching_repo.get_book(2)
+    caching_repo.get_books_by_id([1, 2])
+    caching_repo.get_genres()
+
+    review = make_review('A new favourite', user, caching_repo.get_book(1), 5)
+    caching_repo.add_review(review)
+
+    assert ('get_book', (1,)) not in caching_repo.cache
+    assert ('get_books_by_id', ((1, 2),)) not in caching_repo.cache
+    assert ('get_book', (2,)) in caching_repo.cache
+    assert ('get_genres', ()) in caching_repo.cache
+    assert review in caching_repo.get_book(1).reviews
+
+
+def test_caching_repository_is_cleared_when_another_process_writes(caching_repo, in_memory_repo):
+    caching_repo.check_version()
+    caching_repo.get_genres()
+    caching_repo.add_review(make_review('Mine', caching_repo.get_user('fmercury'), caching_repo.get_book(1), 5))
+
+    # Its own writes leave the rest of the cache alone.
+    caching_repo.check_version()
+    assert ('get_genres', ()) in caching_repo.cache
+
+    # Written past the cache, as another process sharing a database would.
+    in_memory_repo.add_genre(Genre('Motoring'))
+    caching_repo.check_version()
+    assert Genre('Motoring') in caching_repo.get_genres()
+
+
+def test_caching_repository_is_cleared_by_new_entities(caching_repo):
+    caching_repo.get_genres()
+    version = caching_repo.get_version().version
+
+    caching_repo.add_genre(Genre('Motoring'))
+
+    assert Genre('Motoring') in caching_repo.get_genres()
+    assert caching_repo.get_version().version == version + 1
+
+
+def test_caching_repository_expires_entries(caching_repo):
+    caching_repo.ttls['get_book'] = 0
+    caching_repo.get_book(1)
+    caching_repo.get_book(1)
+
+    assert caching_repo.stats()['methods']['get_book']['hits'] == 0
@@ -0,0 +1,48 @@
+from benchmarks.catalogue import write_catalogue, catalogue_sizes
+from library.adapters import memory_repository, repository_populate
+
+
+def test_synthetic_catalogue_loads_into_a_repository(tmp_path):
+    write_catalogue(tmp_path, 50)
+    repo = memory_repository.MemoryRepository()
+    repository_populate.populate(tmp_path, repo, False)
+
+    sizes = catalogue_sizes(50)
+    assert repo.get_number_of_books() == 50
+    assert len(repo.get_authors()) == sizes['authors']
+    assert len(repo.get_reviews()) == sizes['reviews']
+    assert len(repo.get_genres()) > 0
+
+
+def test_synthetic_catalogue_is_the_same_for_the_same_seed(tmp_path):
+    first = write_catalogue(tmp_path / 'first', 20, seed=7)
+    second = write_catalogue(tmp_path / 'second', 20, seed=7)
+
+    for name in ('authors.csv', 'publishers.csv', 'books.csv', 'users.csv', 'reviews.csv'):
+        assert (first / name).read_bytes() == (second / name).read_bytes()
+
+
+def test_synthetic_catalogue_keeps_the_quirks_of_the_bundled_files(tmp_path):
+    write_catalogue(tmp_path, 2000)
+
+    for name in ('authors.csv', 'publishers.csv', 'books.csv', 'reviews.csv'):
+        assert (tmp_path / name).read_bytes().startswith(b'\xef\xbb\xbf')
+    users = (tmp_path / 'users.csv').read_bytes()
+    assert not users.startswith(b'\xef\xbb\xbf') and not users.endswith(b'\n')
+
+    books = (tmp_path / 'books.csv').read_text(encoding='utf-8-sig')
+    assert books.startswith('book_id,release_year,title,publisher,author_id,description,image_url,,,\n')
+    assert '\\n' in books
+    # Some descriptions span several lines, so there are more lines than rows.
+    assert books.count('\n') > 2001
+
+
+def test_synthetic_catalogue_skews_popularity(tmp_path):
+    write_catalogue(tmp_path, 2000)
+    repo = memory_repository.MemoryRepository()
+    repository_populate.populate(tmp_path, repo, False)
+
+    genre_sizes = sorted(len(repo.get_book_ids_for_genre(genre.genre_name)) for genre in repo.get_genres())
+    assert genre_sizes[-1] > 5 * genre_sizes[0]
+    review_counts = sorted(len(list(book.reviews)) for book in repo.get_all_books())
+    assert review_counts[-1] > 20 * (sum(review_counts) / len(review_counts))
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import urllib.request
+
+import pytest
+
+import library.adapters.repository as repo
+from library import create_app
+from library.adapters.catalogue_import import refuse_import
+from library.server import PreforkServer
+
+from tests.conftest import TEST_DATA_PATH
+from tests.unit.test_catalogue_watcher import wait_for
+from tests.unit.test_server import get
+
+TOKEN = 'import-secret'
+AUTHORIZATION = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH, path)
+    return path
+
+
+@pytest.fixture
+def import_client(data_path):
+    my_app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': data_path,
+        'WTF_CSRF_ENABLED': False,
+        'REPOSITORY_CACHE': True,                       # The import has to clear the cache in front of the repository.
+        'CATALOGUE_IMPORT_TOKEN': TOKEN
+    })
+
+    return my_app.test_client()
+
+
+def append(path, *lines):
+    with open(path, 'a', encoding='utf-8') as outfile:
+        outfile.write(''.join(line + '\n' for line in lines))
+
+
+def replace(path, old, new):
+    content = path.read_text(encoding='utf-8-sig')
+    assert old in content
+    path.write_text(content.replace(old, new), encoding='utf-8-sig')
+
+
+def test_appended_rows_are_imported(import_client, data_path):
+    assert import_client.get('/api/v1/books?genre=Crime').json['books'][0]['book_id'] == 1
+    version = repo.repo_instance.get_version().version
+
+    append(data_path / 'books.csv', '9001,2021,A Late Addition,1,1,Imported while running,https://example.com/9001.jpg,'
+                                    'Crime,Thriller,')
+    append(data_path / 'reviews.csv', '1,9001,Worth the wait,5', '2,9001,Loved it,5')
+    response = import_client.post('/admin/import-catalogue', headers=AUTHORIZATION)
+
+    assert response.status_code == 200
+    assert response.json['books'] == 1
+    assert response.json['reviews'] == 2
+    assert response.json['files'] == ['books.csv', 'reviews.csv']
+    assert repo.repo_instance.get_version().version == version + 1
+
+    book = import_client.get('/api/v1/books/9001').json
+    assert book['title'] == 'A Late Addition'
+    assert sorted(book['genres']) == ['Crime', 'Thriller']
+    assert book['review_count'] == 2
+    assert book['average_rating'] == 5
+    crime_books = [book['book_id'] for book in import_client.get('/api/v1/books?genre=Crime').json['books']]
+    assert 9001 in crime_books
+    assert repo.repo_instance.get_top_rated_books(1)[0].book_id == 9001
+
+
+def test_changed_rows_update_the_stored_entities(import_client, data_path):
+    before = import_client.get('/api/v1/books/1').json
+    replace(data_path / 'books.csv', '1,1987,The House of Memory,1,1,Bad book no publisher,',
+            '1,1988,The House of Memories,1,1,Bad book no publisher,')
+    replace(data_path / 'books.csv', 'images.gr-assets.com/books/1493114742m/33394837.jpg,Crime,,',
+            'images.gr-assets.com/books/1493114742m/33394837.jpg,Mystery,,')
+    replace(data_path / 'authors.csv', '1,James Reiner', '1,James T. Reiner')
+    response = import_client.post('/admin/import-catalogue', headers=AUTHORIZATION)
+
+    assert response.json['books'] == 1
+    assert response.json['authors'] == 1
+    assert response.json['reviews'] == 0
+    book = import_client.get('/api/v1/books/1').json
+    assert (book['title'], book['release_year']) == ('The House of Memories', 1988)
+    assert book['genres'] == ['Mystery']
+    assert book['review_count'] == before['review_count'] > 0
+    assert 1 not in [book['book_id'] for book in import_client.get('/api/v1/books?genre=Crime').json['books']]
+    assert 'James T. Reiner' in [author['full_name'] for author in import_client.get('/api/v1/authors').json['authors']]
+
+
+def test_nothing_is_imported_twice(import_client, data_path):
+    append(data_path / 'reviews.csv', '1,1,Read it again,4')
+    assert import_client.post('/admin/import-catalogue', headers=AUTHORIZATION).json['reviews'] == 1
+    version = repo.repo_instance.get_version().version
+
+    # Rewriting a file with the same rows changes its modification time but not its content.
+    (data_path / 'reviews.csv').write_bytes((data_path / 'reviews.csv').read_bytes())
+    response = import_client.post('/admin/import-catalogue', headers=AUTHORIZATION)
+
+    assert response.json['files'] == []
+    assert repo.repo_instance.get_version().version == version
+    assert len(repo.repo_instance.get_reviews()) == 10
+
+
+def test_rows_referring_to_unknown_entities_are_rejected(import_client, data_path):
+    append(data_path / 'reviews.csv', '1,1,Fine,3', '1,424242,No such book,3')
+    response = import_client.post('/admin/import-catalogue', headers=AUTHORIZATION)
+
+    assert response.status_code == 400
+    assert '424242' in response.json['error']
+    assert len(repo.repo_instance.get_reviews()) == 9
+
+
+def test_import_requires_the_token(import_client, data_path):
+    append(data_path / 'reviews.csv', '1,1,Unauthorised,3')
+
+    assert import_client.post('/admin/import-catalogue').status_code == 401
+    assert import_client.post('/admin/import-catalogue', headers={'Authorization': 'Bearer guess'}).status_code == 401
+    assert len(repo.repo_instance.get_reviews()) == 9
+
+
+def test_importer_is_not_installed_without_a_token(client):
+    assert client.post('/admin/import-catalogue', headers=AUTHORIZATION).status_code == 404
+
+
+def test_import_can_be_refused(import_client, data_path):
+    import_client.application.extensions['catalogue_importer'].on_import = refuse_import
+    append(data_path / 'reviews.csv', '1,1,Only in one worker,3')
+
+    response = import_client.post('/admin/import-catalogue', headers=AUTHORIZATION)
+    assert response.status_code == 400
+    assert 'restart the server' in response.json['error']
+    assert len(repo.repo_instance.get_reviews()) == 9
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_prefork_server_imports_into_every_worker(data_path):
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    server = PreforkServer(lambda: create_app({
+        'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': data_path, 'CATALOGUE_IMPORT_TOKEN': TOKEN
+    }), port=port, workers=2, threads=2, graceful_timeout=10)
+    master = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    master.start()
+    try:
+        assert get(port, '/api/v1/books/9001') == 404
+        append(data_path / 'books.csv', '9001,2021,A Late Addition,1,1,Imported while running,,Crime,,')
+        post = urllib.request.Request(f'http://localhost:{port}/admin/import-catalogue', data=b'', method='POST',
+                                      headers=AUTHORIZATION)
+        with urllib.request.urlopen(post) as response:
+            assert response.status == 202
+
+        # Whichever worker answers, once the master has replaced them.
+        assert wait_for(lambda: all(get(port, '/api/v1/books/9001') == 200 for _ in range(6)), timeout=30)
+    finally:
+        master.terminate()
+        master.join(20)
+
+    assert master.exitcode == 0
@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import time
+
+import pytest
+
+import library.adapters.repository as repo
+from library.adapters import repository_populate
+from library import create_app
+from library.adapters.catalogue_import import CatalogueImporter
+from library.adapters.catalogue_watcher import CatalogueWatcher, _inotify
+from library.domain.model import User, make_review
+from library.server import PreforkServer
+
+from tests.conftest import TEST_DATA_PATH, AuthenticationManager
+from tests.unit.test_server import get
+
+BOOK = '9001,2021,A Late Addition,1,1,Loaded while running,https://example.com/9001.jpg,Crime,,'
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH, path)
+    return path
+
+
+def make_app(data_path, **config):
+    return create_app(dict({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': data_path,
+        'WTF_CSRF_ENABLED': False,
+        'REPOSITORY_CACHE': True,                       # The new repository has to be put behind a cache of its own.
+        'CATALOGUE_WATCH': True,
+        'CATALOGUE_WATCH_DEBOUNCE': 0.2,
+        'CATALOGUE_WATCH_POLL_INTERVAL': 60
+    }, **config))
+
+
+@pytest.fixture
+def watched_app(data_path):
+    app = make_app(data_path)
+    yield app
+    app.extensions['catalogue_watcher'].stop()
+
+
+def append(path, *lines):
+    with open(path, 'a', encoding='utf-8') as outfile:
+        outfile.write(''.join(line + '\n' for line in lines))
+
+
+def wait_for(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def watch(data_path, **options) -> tuple:
+    changes = list()
+    watcher = CatalogueWatcher(data_path, debounce=0.3, **options)
+    watcher.on_change = changes.append
+    watcher.start()
+    return watcher, changes
+
+
+def test_polling_reloads_once_a_burst_of_writes_settles(data_path):
+    watcher, changes = watch(data_path, poll_interval=0.05, inotify=False)
+    try:
+        for line in ('1,1,First,3', '1,2,Second,4', '2,1,Third,5'):
+            append(data_path / 'reviews.csv', line)
+            time.sleep(0.1)
+        assert wait_for(lambda: len(changes) > 0)
+        time.sleep(0.5)
+    finally:
+        watcher.stop()
+
+    assert len(changes) == 1
+
+
+@pytest.mark.skipif(_inotify() is None, reason='needs inotify')
+def test_inotify_reports_a_file_replaced_by_renaming(data_path):
+    # Polling alone would not notice the change within the test.
+    watcher, changes = watch(data_path, poll_interval=60)
+    try:
+        replacement = data_path / 'books.csv.new'
+        replacement.write_bytes((data_path / 'books.csv').read_bytes() + (BOOK + '\n').encode())
+        os.replace(replacement, data_path / 'books.csv')
+        assert wait_for(lambda: len(changes) > 0)
+    finally:
+        watcher.stop()
+
+    assert watcher.uses_inotify
+
+
+def test_unchanged_content_is_not_reloaded(data_path):
+    watcher, changes = watch(data_path, poll_interval=60, inotify=False)
+    watcher.stop()
+
+    (data_path / 'books.csv').write_bytes((data_path / 'books.csv').read_bytes())
+    assert watcher.check() is False
+    append(data_path / 'books.csv', BOOK)
+    assert watcher.check() is True
+    assert len(changes) == 1
+
+
+def test_reload_swaps_in_a_complete_repository(watched_app, data_path):
+    client = watched_app.test_client()
+    previous = repo.repo_instance
+    version = previous.get_version().version
+    assert client.get('/api/v1/books/9001').status_code == 404
+
+    # A user who signed up and a review written while the application ran are not in the CSV files.
+    user = User('newcomer', 'Password123')
+    previous.add_user(user)
+    previous.add_review(make_review('Kept across reloads', user, previous.get_book(1), 4))
+    reviews = len(previous.get_reviews())
+
+    append(data_path / 'books.csv', BOOK)
+    assert watched_app.extensions['catalogue_watcher'].check() is True
+
+    assert repo.repo_instance is not previous
+    assert previous.get_book(9001) is None
+    assert repo.repo_instance.get_version().version > version
+    assert client.get('/api/v1/books/9001').json['title'] == 'A Late Addition'
+    assert len(repo.repo_instance.get_reviews()) == reviews
+    assert repo.repo_instance.get_user('newcomer').reviews[0].review_text == 'Kept across reloads'
+
+    # The carried-over review is carried over again by the next reload, once.
+    append(data_path / 'books.csv', BOOK.replace('9001', '9002'))
+    assert watched_app.extensions['catalogue_watcher'].check() is True
+    assert len(repo.repo_instance.get_reviews()) == reviews
+
+
+def test_reviews_imported_from_the_files_are_not_carried_over(watched_app, data_path):
+    importer = CatalogueImporter(data_path)
+    append(data_path / 'reviews.csv', '1,1,Imported while running,4')
+    assert importer.import_changes(repo.repo_instance)['reviews'] == 1
+    reviews = len(repo.repo_instance.get_reviews())
+
+    append(data_path / 'books.csv', BOOK)
+    assert watched_app.extensions['catalogue_watcher'].check() is True
+    assert len(repo.repo_instance.get_reviews()) == reviews
+
+
+def test_a_review_written_during_the_swap_reaches_the_new_repository(watched_app, data_path):
+    previous = repo.repo_instance
+    user, book = previous.get_user('thorke'), previous.get_book(1)
+    reviews = len(previous.get_reviews())
+    append(data_path / 'books.csv', BOOK)
+
+    # Stands for a request which took the previous repository before the swap, and writes to it after.
+    populate = repository_populate.populate
+
+    def populate_and_write(*args):
+        populate(*args)
+        previous.add_review(make_review('Written meanwhile', user, book, 5))
+    repository_populate.populate = populate_and_write
+    try:
+        assert watched_app.extensions['catalogue_watcher'].check() is True
+    finally:
+        repository_populate.populate = populate
+    previous.add_review(make_review('Written after the swap', user, book, 5))
+
+    assert [review.review_text for review in repo.repo_instance.get_reviews()[reviews:]] == \
+        ['Written meanwhile', 'Written after the swap']
+
+
+def test_logged_in_users_are_looked_up_in_the_new_repository(data_path):
+    app = make_app(data_path, SESSION_BACKEND='memory')
+    try:
+        client = app.test_client()
+        AuthenticationManager(client).login()
+        client.post('/review', data={'review': 'Before the reload', 'review_rating': 4, 'book_id': 1})
+
+        append(data_path / 'books.csv', BOOK)
+        assert app.extensions['catalogue_watcher'].check() is True
+        client.post('/review', data={'review': 'After the reload', 'review_rating': 5, 'book_id': 1})
+    finally:
+        app.extensions['catalogue_watcher'].stop()
+
+    user = repo.repo_instance.get_user('thorke')
+    assert [review.review_text for review in user.reviews][-2:] == ['Before the reload', 'After the reload']
+    assert user.reviews[-1] in repo.repo_instance.get_book(1).reviews
+
+
+def test_a_broken_file_keeps_the_current_repository(watched_app, data_path):
+    previous = repo.repo_instance
+    append(data_path / 'books.csv', '9001,not a year,Broken,1,1,,,')
+
+    with pytest.raises(ValueError):
+        watched_app.extensions['catalogue_watcher'].check()
+    assert repo.repo_instance is previous
+    # Not loaded again until the file changes.
+    assert watched_app.extensions['catalogue_watcher'].check() is False
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_prefork_server_replaces_its_workers_when_the_catalogue_changes(data_path):
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    server = PreforkServer(lambda: make_app(data_path, CATALOGUE_WATCH_POLL_INTERVAL=0.1, CATALOGUE_WATCH_INOTIFY=False),
+                           port=port, workers=2, threads=2, graceful_timeout=10)
+    master = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    master.start()
+    try:
+        assert get(port, '/api/v1/books/1') == 200
+        assert get(port, '/api/v1/books/9001') == 404
+
+        append(data_path / 'books.csv', BOOK)
+        assert wait_for(lambda: get(port, '/api/v1/books/9001') == 200, timeout=30)
+    finally:
+        master.terminate()
+        master.join(20)
+
+    assert master.exitcode == 0
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+from utils import get_project_root
+
+# Import time, in milliseconds, of everything a worker imports to build the application in memory mode: about 200 ms
+# on a developer machine, and about 500 ms when SQLAlchemy and the forms were imported up front.
+IMPORT_BUDGET_MS = 350
+
+# Packages a worker only needs for the database repository, or once a form is submitted.
+LAZY_PACKAGES = ('sqlalchemy', 'wtforms', 'flask_wtf', 'password_validator', 'better_profanity')
+
+BUILD_APP = """
+from library import create_app
+from utils import get_project_root
+create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': get_project_root() / 'tests' / 'data'})
+"""
+
+
+def imported_modules():
+    # Each line of -X importtime is 'import time: <self us> | <cumulative us> | <indented module name>'.
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', BUILD_APP], cwd=get_project_root(),
+                             capture_output=True, text=True, check=True)
+    modules = dict()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+def test_memory_mode_does_not_import_database_or_form_packages():
+    modules = imported_modules()
+
+    assert 'library' in modules
+    assert [name for name in modules if name.split('.')[0] in LAZY_PACKAGES] == []
+
+
+def test_import_time_is_within_budget():
+    # The fastest of a few runs, so that one slow run does not fail the test.
+    total_ms = min(sum(imported_modules().values()) for _ in range(3)) / 1000
+
+    assert total_ms < IMPORT_BUDGET_MS, f'Building the application imported modules for {total_ms:.0f} ms'
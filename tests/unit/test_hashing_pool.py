@@ -0,0 +1,43 @@
+import pytest
+
+from library.authentication import services as auth_services
+from library.authentication.hashing_pool import HashingPool, HashingBusyException
+from library.authentication.password_policy import PasswordPolicy
+
+
+@pytest.fixture
+def hashing_pool():
+    pool = HashingPool(PasswordPolicy(iterations=1000), workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_hashing_pool_hashes_and_verifies(hashing_pool):
+    password_hash = hashing_pool.hash('abcd1A23')
+
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert hashing_pool.verify(password_hash, 'abcd1A23')
+    assert not hashing_pool.verify(password_hash, '0987654321')
+    assert not hashing_pool.verify(None, 'abcd1A23')
+    assert not hashing_pool.needs_rehash(password_hash)
+
+
+def test_hashing_pool_serves_login(hashing_pool, in_memory_repo):
+    auth_services.add_user('pmccartney', 'abcd1A23', in_memory_repo, hashing_pool)
+
+    user_as_dict = auth_services.login('pmccartney', 'abcd1A23', in_memory_repo, hashing_pool)
+    assert user_as_dict['user_name'] == 'pmccartney'
+
+    with pytest.raises(auth_services.AuthenticationException):
+        auth_services.login('pmccartney', '0987654321', in_memory_repo, hashing_pool)
+
+
+def test_hashing_pool_refuses_work_when_full(in_memory_repo):
+    pool = HashingPool(PasswordPolicy(iterations=1000), workers=1, max_pending=0, queue_timeout=0)
+
+    with pytest.raises(HashingBusyException):
+        pool.hash('abcd1A23')
+
+    # The user is known, but their password cannot be checked right now.
+    with pytest.raises(HashingBusyException):
+        auth_services.login('thorke', 'cLQ^C#oFXloS', in_memory_repo, pool)
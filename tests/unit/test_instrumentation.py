@@ -0,0 +1,104 @@
+import logging
+
+import pytest
+
+from library import create_app
+from library.utilities.instrumentation import Metrics
+
+from tests.conftest import TEST_DATA_PATH
+
+TOKEN = 'metrics-token'
+
+
+@pytest.fixture
+def instrumented_client():
+    my_app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'INSTRUMENTATION': True,                        # Time requests; serve /metrics.
+        'INSTRUMENTATION_LOG': True,
+        'METRICS_TOKEN': TOKEN
+    })
+
+    return my_app.test_client()
+
+
+def server_timing(response):
+    return dict(
+        (entry.split(';')[0], entry) for entry in response.headers['Server-Timing'].split(', ')
+    )
+
+
+def test_responses_carry_server_timing(instrumented_client):
+    response = instrumented_client.get('/books_by_release_year')
+    timings = server_timing(response)
+
+    assert {'total', 'view', 'template', 'repository', 'sql', 'cache'} <= set(timings)
+    assert 'desc="1 rendered"' in timings['template']
+    assert 'desc="0 calls"' not in timings['repository']
+    assert 'desc="0 hits, 0 misses"' not in timings['cache']
+
+
+def test_requests_are_logged_with_their_timings(instrumented_client, caplog):
+    with caplog.at_level(logging.INFO, logger='library.utilities.instrumentation'):
+        instrumented_client.get('/list_of_genres')
+
+    line = caplog.messages[-1]
+    assert line.startswith('request method=GET path=/list_of_genres endpoint=book_bp.list_of_genres status=200 ')
+    assert 'repository_calls=' in line and 'templates=1' in line
+
+
+def test_metrics_are_served_in_the_prometheus_format(instrumented_client):
+    instrumented_client.get('/books_by_release_year')
+    instrumented_client.get('/books_by_release_year')
+
+    metrics = instrumented_client.get('/metrics', headers={'Authorization': 'Bearer ' + TOKEN})
+    text = metrics.get_data(as_text=True)
+
+    assert metrics.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert 'library_requests_total{endpoint="book_bp.books_by_release_year",method="GET",status="200"} 2' in text
+    assert 'library_request_duration_seconds_count{endpoint="book_bp.books_by_release_year"} 2' in text
+    assert 'library_template_renders_total{template="book/books.html"} 2' in text
+    assert 'library_repository_calls_total{method="get_books_by_release_year"}' in text
+    assert 'library_cache_lookups_total{cache="fragments",result="hit"}' in text
+    # Scrapes are not counted themselves.
+    assert 'endpoint="metrics"' not in text
+
+
+def test_metrics_require_the_token(instrumented_client):
+    assert instrumented_client.get('/metrics').status_code == 401
+    assert instrumented_client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    # Without a token the metrics are not served.
+    app = create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH,
+                      'INSTRUMENTATION': True, 'METRICS_TOKEN': ''})
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_cache_lookups_are_counted_by_their_own_application(instrumented_client, client):
+    headers = {'Authorization': 'Bearer ' + TOKEN}
+    before = instrumented_client.get('/metrics', headers=headers).get_data(as_text=True)
+    client.get('/books_by_release_year')
+
+    assert instrumented_client.get('/metrics', headers=headers).get_data(as_text=True) == before
+
+
+def test_nothing_is_instrumented_unless_enabled(client):
+    response = client.get('/books_by_release_year')
+
+    assert 'Server-Timing' not in response.headers
+    assert client.get('/metrics').status_code == 404
+
+
+def test_histograms_are_cumulative():
+    metrics = Metrics()
+    metrics.observe('library_request_duration_seconds', (('endpoint', 'home'),), 0.003)
+    metrics.observe('library_request_duration_seconds', (('endpoint', 'home'),), 0.2)
+    text = metrics.render()
+
+    assert 'library_request_duration_seconds_bucket{endpoint="home",le="0.005"} 1' in text
+    assert 'library_request_duration_seconds_bucket{endpoint="home",le="0.25"} 2' in text
+    assert 'library_request_duration_seconds_bucket{endpoint="home",le="+Inf"} 2' in text
+    assert 'library_request_duration_seconds_sum{endpoint="home"} 0.203' in text
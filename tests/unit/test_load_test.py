@@ -0,0 +1,23 @@
+import random
+
+from benchmarks.load_test import JOURNEYS, FlaskClientSession, VirtualUser, build_app, credentials, summarise
+from library.server import stop_extensions
+
+from tests.conftest import TEST_DATA_PATH
+
+
+def test_journeys_reach_every_route_without_failures():
+    app = build_app('memory', TEST_DATA_PATH)
+    try:
+        user = VirtualUser(FlaskClientSession(app), random.Random(1), credentials(TEST_DATA_PATH))
+        user.recording = True
+        for journey in JOURNEYS:
+            getattr(user, journey)()
+    finally:
+        stop_extensions(app)
+
+    results = {result['route']: result for result in summarise([user], 1)}
+    assert {'GET /books_by_release_year', 'GET /list_of_genres', 'GET /books_by_genre', 'GET /authentication/login',
+            'POST /authentication/login', 'GET /review', 'POST /review'} <= set(results)
+    assert all(not result['failures'] for result in results.values())
+    assert user.logged_in
@@ -1,3 +1,5 @@
+import gc
+import weakref
 from datetime import date, datetime
 from typing import List
 
@@ -135,6 +137,20 @@ def test_repository_can_get_books_by_ids(in_memory_repo):
     assert books[2].title == 'Zombie Bay'
 
 
+def test_repository_gets_books_by_ids_in_requested_order_once(in_memory_repo):
+    books = in_memory_repo.get_books_by_id([3, 1, 3, 100, 2])
+
+    assert [book.book_id for book in books] == [3, 1, 2]
+
+
+def test_repository_iterates_books_in_order_of_id(in_memory_repo):
+    book_ids = [book.book_id for book in in_memory_repo.iter_books()]
+    assert book_ids == sorted(book.book_id for book in in_memory_repo.get_all_books())
+
+    assert [book.book_id for book in in_memory_repo.iter_books(after_id=17)] == [18, 19, 20]
+    assert list(in_memory_repo.iter_books(after_id=20)) == []
+
+
 def test_repository_does_not_retrieve_book_for_non_existent_id(in_memory_repo):
     books = in_memory_repo.get_books_by_id([1, 100])
 
@@ -160,10 +176,10 @@ def test_repository_returns_an_empty_list_for_non_existent_genre(in_memory_repo)
     assert len(book_ids) == 0
 
 
-# def test_repository_returns_book_ids_for_existing_author(in_memory_repo):
-#     book_ids = in_memory_repo.get_book_ids_for_author('James Reiner')
-#
-#     assert book_ids == [1, 12, 16]
+def test_repository_returns_book_ids_for_existing_author(in_memory_repo):
+    book_ids = in_memory_repo.get_book_ids_for_author('James Reiner')
+
+    assert book_ids == [1, 12, 16]
 
 
 def test_repository_returns_an_empty_list_for_non_existent_author(in_memory_repo):
@@ -172,10 +188,10 @@ def test_repository_returns_an_empty_list_for_non_existent_author(in_memory_repo
     assert len(book_ids) == 0
 
 
-# def test_repository_returns_book_ids_for_existing_publisher(in_memory_repo):
-#     book_ids = in_memory_repo.get_book_ids_for_publisher('Penguin')
-#
-#     assert book_ids == [1, 5, 7, 9]
+def test_repository_returns_book_ids_for_existing_publisher(in_memory_repo):
+    book_ids = in_memory_repo.get_book_ids_for_publisher('Penguin')
+
+    assert book_ids == [1, 5, 7, 9]
 
 
 def test_repository_returns_an_empty_list_for_non_existent_publisher(in_memory_repo):
@@ -270,3 +286,82 @@ def test_repository_can_retrieve_reviews(in_memory_repo):
 
 
 
+
+
+def test_repository_version_increases_with_writes(in_memory_repo):
+    version = in_memory_repo.get_version()
+
+    user = in_memory_repo.get_user('thorke')
+    book = in_memory_repo.get_book(2)
+    in_memory_repo.add_review(make_review("Trump's onto it!", user, book, 5))
+
+    new_version = in_memory_repo.get_version()
+    assert new_version.version == version.version + 1
+    assert new_version.last_modified >= version.last_modified
+
+
+def test_repository_keeps_rating_summary_of_books(in_memory_repo):
+    user = in_memory_repo.get_user('thorke')
+    book = in_memory_repo.get_book(2)
+    summary = book.rating_summary
+    count, total = summary.review_count, summary.rating_total
+
+    review = make_review("Trump's onto it!", user, book, 5)
+    in_memory_repo.add_review(review)
+
+    assert summary.review_count == count + 1
+    assert summary.rating_total == total + 5
+    assert summary.average_rating == (total + 5) / (count + 1)
+    assert summary.histogram[5] >= 1
+    assert summary.latest_review == review.timestamp
+
+
+def test_repository_ranks_books_by_rating_and_number_of_reviews(in_memory_repo):
+    top_rated = in_memory_repo.get_top_rated_books(3)
+    averages = [book.rating_summary.average_rating for book in top_rated]
+    assert averages == sorted(averages, reverse=True)
+
+    user = in_memory_repo.get_user('thorke')
+    book = in_memory_repo.get_book(20)
+    for _ in range(3):
+        in_memory_repo.add_review(make_review('Perfect', user, book, 5))
+
+    assert in_memory_repo.get_most_reviewed_books(1) == [book]
+    assert in_memory_repo.get_top_rated_books(1)[0].rating_summary.average_rating == 5
+    assert all(book.rating_summary.review_count > 0 for book in in_memory_repo.get_top_rated_books(100))
+
+
+def test_released_repository_is_freed_without_a_garbage_collection(in_memory_repo):
+    book = in_memory_repo.get_book(1)
+    assert book.number_of_reviews > 0 and book.number_of_genres > 0
+    references = [weakref.ref(entity) for entity in (book, next(book.reviews), next(book.genres))]
+    references.append(weakref.ref(in_memory_repo.get_user('thorke')))
+    del book
+
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        in_memory_repo.release()
+        assert all(reference() is None for reference in references)
+    finally:
+        if collecting:
+            gc.enable()
+    assert in_memory_repo.get_number_of_books() == 0
+    assert in_memory_repo.get_book(1) is None
+
+
+def test_hand_over_passes_on_the_additions_and_then_every_write(in_memory_repo):
+    in_memory_repo.add_user(User('before', 'Password123'))
+    in_memory_repo.mark_populated()
+    user = User('during', 'Password123')
+    in_memory_repo.add_user(user)
+    in_memory_repo.add_review(make_review('Recorded', user, in_memory_repo.get_book(1), 4))
+
+    handed_over = []
+    in_memory_repo.hand_over(lambda users, reviews: handed_over.append((users, reviews)))
+    reviews = len(in_memory_repo.get_reviews())
+    in_memory_repo.add_review(make_review('Passed on', user, in_memory_repo.get_book(1), 5))
+
+    assert [[user.user_name for user in users] for users, _ in handed_over] == [['during'], []]
+    assert [[review.review_text for review in reviews] for _, reviews in handed_over] == [['Recorded'], ['Passed on']]
+    assert len(in_memory_repo.get_reviews()) == reviews
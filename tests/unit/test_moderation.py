@@ -0,0 +1,70 @@
+import pytest
+
+from library.book.moderation import ProfanityFilter
+from library.domain.model import make_review
+
+
+@pytest.fixture
+def profanity_filter():
+    return ProfanityFilter.from_default_wordlist()
+
+
+@pytest.mark.parametrize('text', (
+        'What the hell',
+        'This is bullshit.',
+        'sh1t happens',
+        'a$$hole',
+        'p*ssy',
+        'blow  job',
+        'B1TCH!',
+        'x f-u-c-ks',
+        'what the f.u.c.k.',
+        'sh!t happens',
+        'pu$$y€',
+))
+def test_filter_finds_profanity_and_its_leetspeak_spellings(profanity_filter, text):
+    assert profanity_filter.contains_profanity(text)
+
+
+@pytest.mark.parametrize('text', (
+        'I haven\'t read a fun mystery book in a while',
+        'A classic assessment of the class struggle',
+        'Scunthorpe',
+        'He was shot',
+        '',
+        '"crap"',
+        'f.u.c.k',
+        'b l o w j o b s',
+))
+def test_filter_accepts_clean_text(profanity_filter, text):
+    assert not profanity_filter.contains_profanity(text)
+
+
+def test_filter_reports_words_as_spelt(profanity_filter):
+    assert profanity_filter.find('Well, sh1t. That was a bull-shit ending.') == ['sh1t', 'bull-shit']
+
+
+@pytest.mark.parametrize('text', (
+        'f.u.c.k',
+        'f.u.c.k.',
+        'x f-u-c-ks',
+        'f u c k e r s',
+        'what a b!tch, and what a b i t c h',
+        'Ü-ber sh1t€',
+        'p*ss',
+        '"crap" and crap',
+        'x',
+))
+def test_filter_flags_what_better_profanity_flags(profanity_filter, text):
+    from better_profanity import Profanity
+    assert profanity_filter.contains_profanity(text) == Profanity().contains_profanity(text)
+
+
+def test_filter_screens_existing_reviews_in_batch(profanity_filter, in_memory_repo):
+    user = in_memory_repo.get_user('thorke')
+    book = in_memory_repo.get_book(1)
+    review = make_review('What a load of crap', user, book, 1)
+    in_memory_repo.add_review(review)
+
+    assert profanity_filter.screen_reviews(in_memory_repo.get_reviews()) == [review]
+    assert profanity_filter.screen(['crap', 'fine']) == [True, False]
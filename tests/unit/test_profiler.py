@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from library import create_app
+
+from tests.conftest import TEST_DATA_PATH
+
+TOKEN = 'profiler-token'
+
+
+@pytest.fixture
+def profiled_app(tmp_path):
+    return create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': TEST_DATA_PATH,
+        'WTF_CSRF_ENABLED': False,
+        'PROFILER': True,                               # Profile every books_by_release_year request.
+        'PROFILER_ENDPOINTS': 'book_bp.books_by_release_year',
+        'PROFILER_SAMPLE_RATE': 0,
+        'PROFILER_INTERVAL': 0.0001,
+        'PROFILER_DIR': str(tmp_path / 'profiles'),
+        'PROFILER_TOKEN': TOKEN
+    })
+
+
+def profile_until_sampled(client, profiler, url):
+    # A request may be over before the sampler wakes up, so requests are repeated until one is sampled.
+    deadline = time.monotonic() + 10
+    while not profiler.collapsed() and time.monotonic() < deadline:
+        client.get(url)
+    return profiler.collapsed()
+
+
+def test_stacks_are_counted_per_endpoint(profiled_app):
+    profiler = profiled_app.extensions['profiler']
+    client = profiled_app.test_client()
+
+    stacks = profile_until_sampled(client, profiler, '/books_by_release_year')
+
+    assert stacks
+    for line in stacks.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('book_bp.books_by_release_year;')
+        assert int(count) > 0
+    headers = {'Authorization': 'Bearer ' + TOKEN}
+    assert client.get('/debug/profile?endpoint=book_bp.books_by_release_year', headers=headers).data.decode() == stacks
+    assert client.get('/debug/profile?endpoint=home_bp.home', headers=headers).data == b''
+
+
+def test_stacks_require_the_token(profiled_app, tmp_path):
+    client = profiled_app.test_client()
+    assert client.get('/debug/profile').status_code == 401
+    assert client.get('/debug/profile', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    # Without a token the stacks are not served.
+    app = create_app({'TESTING': True, 'REPOSITORY': 'memory', 'TEST_DATA_PATH': TEST_DATA_PATH, 'PROFILER': True,
+                      'PROFILER_DIR': str(tmp_path / 'profiles'), 'PROFILER_TOKEN': ''})
+    assert app.test_client().get('/debug/profile').status_code == 404
+
+
+def test_other_endpoints_are_not_profiled_at_a_zero_sample_rate(profiled_app):
+    client = profiled_app.test_client()
+    for _ in range(50):
+        client.get('/')
+
+    assert profiled_app.extensions['profiler'].collapsed() == ''
+
+
+def test_dump_writes_collapsed_stacks(profiled_app, tmp_path):
+    profiler = profiled_app.extensions['profiler']
+    stacks = profile_until_sampled(profiled_app.test_client(), profiler, '/books_by_release_year')
+
+    path = profiler.dump()
+
+    assert path.parent == tmp_path / 'profiles'
+    assert path.suffix == '.collapsed'
+    assert path.read_text(encoding='utf-8').startswith(stacks.splitlines()[0])
+
+
+def test_toggle_switches_profiling_off_and_on(profiled_app):
+    profiler = profiled_app.extensions['profiler']
+    client = profiled_app.test_client()
+
+    profiler.toggle()
+    for _ in range(20):
+        client.get('/books_by_release_year')
+    assert profiler.collapsed() == ''
+
+    profiler.toggle()
+    assert profile_until_sampled(client, profiler, '/books_by_release_year')
@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+
+import library.adapters.repository as repo
+from library.book.review_queue import ReviewWriteQueue
+
+
+@pytest.fixture
+def review_queue(in_memory_repo, tmp_path, monkeypatch):
+    monkeypatch.setattr(repo, 'repo_instance', in_memory_repo)
+    return ReviewWriteQueue(tmp_path, batch_size=2)
+
+
+def test_submitted_review_is_pending_until_flushed(review_queue, in_memory_repo):
+    submission = review_queue.submit(1, 'Queued but not forgotten', 'thorke', 4)
+
+    assert review_queue.pending([submission.submission_id], 'thorke') == [submission]
+    assert review_queue.outstanding([submission.submission_id]) == [submission.submission_id]
+    assert len(in_memory_repo.get_reviews()) == 9
+
+    review_queue.flush()
+
+    assert review_queue.pending([submission.submission_id], 'thorke') == []
+    assert review_queue.outstanding([submission.submission_id]) == []
+    assert len(in_memory_repo.get_reviews()) == 10
+    review = in_memory_repo.get_reviews()[-1]
+    assert review.review_text == 'Queued but not forgotten'
+    assert review.timestamp == submission.timestamp
+
+
+def test_pending_reviews_are_only_shown_to_their_author(review_queue):
+    submission = review_queue.submit(1, 'Mine alone', 'thorke', 4)
+
+    assert review_queue.pending([submission.submission_id], 'fmercury') == []
+
+
+def test_reviews_pending_in_other_processes_stay_outstanding(review_queue):
+    parent_pid = os.getppid()
+
+    # Only the process running the server with the given pid knows whether its reviews were stored; those of a
+    # process that has exited were replayed from its journal.
+    assert review_queue.outstanding([f'{parent_pid}-1', '99999999-1']) == [f'{parent_pid}-1']
+
+
+def test_flush_stores_reviews_in_batches(review_queue, in_memory_repo, monkeypatch):
+    batches = []
+    add_reviews = in_memory_repo.add_reviews
+    monkeypatch.setattr(in_memory_repo, 'add_reviews', lambda reviews: batches.append(len(reviews)) or add_reviews(reviews))
+
+    for rating in range(1, 6):
+        review_queue.submit(1, 'One of many', 'thorke', rating)
+    review_queue.flush()
+
+    assert batches == [2, 2, 1]
+
+
+def test_reviews_for_unknown_books_are_dropped(review_queue, in_memory_repo):
+    review_queue.submit(99999, 'No such book', 'thorke', 4)
+    review_queue.flush()
+
+    assert len(in_memory_repo.get_reviews()) == 9
+
+
+def test_a_bad_submission_does_not_block_the_ones_after_it(review_queue, in_memory_repo):
+    user, book = in_memory_repo.get_user('thorke'), in_memory_repo.get_book(1)
+    reviews = (len(list(user.reviews)), len(list(book.reviews)))
+    review_queue.submit(1, 'Off the scale', 'thorke', 9)
+    review_queue.submit(1, 'Within the scale', 'thorke', 4)
+    review_queue.submit(1, 'Also within the scale', 'thorke', 5)
+    review_queue.flush()
+
+    assert [review.review_text for review in in_memory_repo.get_reviews()[9:]] == \
+        ['Within the scale', 'Also within the scale']
+    assert (len(list(user.reviews)), len(list(book.reviews))) == (reviews[0] + 2, reviews[1] + 2)
+    assert review_queue.outstanding([]) == []
+    review_queue.flush()
+    assert len(in_memory_repo.get_reviews()) == 11
+
+
+def test_orphaned_journal_is_replayed(in_memory_repo, tmp_path, monkeypatch):
+    monkeypatch.setattr(repo, 'repo_instance', in_memory_repo)
+    # No process can have this pid, so the journal is treated as left behind by a crash.
+    journal = tmp_path / 'review-journal-99999999.jsonl'
+    records = [
+        {'seq': 1, 'book_id': 1, 'user_name': 'thorke', 'review_text': 'Already stored', 'rating': 3,
+         'timestamp': '2021-10-01T10:00:00', 'submission_id': '99999999-1'},
+        {'applied': 1},
+        {'seq': 2, 'book_id': 1, 'user_name': 'thorke', 'review_text': 'Survived a crash', 'rating': 5,
+         'timestamp': '2021-10-01T10:00:01', 'submission_id': '99999999-2'},
+    ]
+    journal.write_text(''.join(json.dumps(record) + '\n' for record in records) + '{"seq": 3, "boo')
+
+    ReviewWriteQueue(tmp_path).replay_orphaned_journals()
+
+    assert [review.review_text for review in in_memory_repo.get_reviews()[9:]] == ['Survived a crash']
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_journal_whose_replay_was_cut_short_is_replayed(in_memory_repo, tmp_path, monkeypatch):
+    monkeypatch.setattr(repo, 'repo_instance', in_memory_repo)
+    # Claimed for replaying by a process that has exited since.
+    journal = tmp_path / 'review-journal-99999998.replaying-99999999.jsonl'
+    journal.write_text(json.dumps({'seq': 1, 'book_id': 1, 'user_name': 'thorke', 'review_text': 'Replayed at last',
+                                   'rating': 5, 'timestamp': '2021-10-01T10:00:00',
+                                   'submission_id': '99999998-1'}) + '\n')
+
+    ReviewWriteQueue(tmp_path).replay_orphaned_journals()
+
+    assert [review.review_text for review in in_memory_repo.get_reviews()[9:]] == ['Replayed at last']
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_journals_separately(review_queue, tmp_path):
+    parent_submission = review_queue.submit(1, 'Submitted by the parent', 'thorke', 4)
+
+    pid = os.fork()
+    if pid == 0:
+        # As in a pre-forked server worker: the child queues its own reviews, in its own journal, under ids of its own.
+        child_submission = review_queue.submit(1, 'Submitted by the child', 'thorke', 5)
+        own = review_queue.pending([parent_submission.submission_id, child_submission.submission_id], 'thorke')
+        os._exit(0 if own == [child_submission] else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+
+    child_journal = tmp_path / f'review-journal-{pid}.jsonl'
+    assert [json.loads(line)['review_text'] for line in child_journal.read_text().splitlines()] == [
+        'Submitted by the child'
+    ]
+    assert review_queue.pending([parent_submission.submission_id], 'thorke') == [parent_submission]
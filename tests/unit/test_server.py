@@ -0,0 +1,173 @@
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from library import create_app
+from library.server import PooledWSGIServer, PreforkServer
+
+from utils import get_project_root
+
+
+def make_app():
+    return create_app({
+        'TESTING': True,
+        'REPOSITORY': 'memory',
+        'TEST_DATA_PATH': get_project_root() / 'tests' / 'data',
+        'WTF_CSRF_ENABLED': False
+    })
+
+
+def get(port: int, path: str, timeout: float = 30):
+    # Retries until the server accepts connections.
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('localhost', port, timeout=5)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            return response.status
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_pooled_server_handles_requests_until_drained():
+    server = PooledWSGIServer('localhost', 0, make_app(), threads=2)
+    accepting = threading.Thread(target=server.serve_forever)
+    accepting.start()
+
+    assert get(server.port, '/api/v1/genres') == 200
+    assert get(server.port, '/api/v1/books/1') == 200
+
+    server.shutdown()
+    accepting.join()
+    server.drain()
+
+
+def test_pooled_server_only_accepts_connections_it_has_a_thread_for():
+    release = threading.Event()
+    started = []
+
+    def slow_app(environ, start_response):
+        started.append(environ['PATH_INFO'])
+        release.wait(10)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'done']
+
+    server = PooledWSGIServer('localhost', 0, slow_app, threads=1)
+    accepting = threading.Thread(target=server.serve_forever)
+    accepting.start()
+    connections = [socket.create_connection(('localhost', server.port)) for _ in range(3)]
+    try:
+        for number, connection in enumerate(connections):
+            connection.sendall(f'GET /{number} HTTP/1.0\r\n\r\n'.encode())
+        time.sleep(0.5)
+        # The other two wait in the listening socket's backlog, not in the thread pool's queue.
+        assert started == ['/0']
+        assert server.executor._work_queue.qsize() == 0
+
+        release.set()
+        for connection in connections:
+            assert connection.makefile('rb').readline().startswith(b'HTTP/1.0 200')
+    finally:
+        release.set()
+        for connection in connections:
+            connection.close()
+        server.shutdown()
+        accepting.join()
+        server.drain()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_prefork_server_gives_up_on_workers_that_keep_failing(monkeypatch):
+    monkeypatch.setattr('library.server.MAX_RESPAWN_DELAY', 0.2)
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    def broken_app():
+        raise RuntimeError('Cannot start')
+
+    server = PreforkServer(broken_app, port=port, workers=2, preload=False)
+    master = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    master.start()
+    master.join(30)
+
+    assert master.exitcode == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_prefork_server_restarts_and_stops_gracefully():
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    server = PreforkServer(make_app, port=port, workers=2, threads=2, graceful_timeout=10)
+    master = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    master.start()
+    try:
+        assert get(port, '/api/v1/genres') == 200
+
+        os.kill(master.pid, signal.SIGHUP)
+        for _ in range(10):
+            assert get(port, '/api/v1/genres') == 200
+    finally:
+        master.terminate()
+        master.join(20)
+
+    assert master.exitcode == 0
+
+
+@pytest.mark.skipif(not os.path.exists(f'/proc/{os.getpid()}/task/{os.getpid()}/children'), reason='needs /proc')
+def test_respawned_worker_replays_the_reviews_of_a_crashed_one(tmp_path):
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    def make_write_behind_app():
+        return create_app({
+            'TESTING': True,
+            'REPOSITORY': 'memory',
+            'TEST_DATA_PATH': get_project_root() / 'tests' / 'data',
+            'WTF_CSRF_ENABLED': False,
+            'REVIEW_WRITE_BEHIND': True,
+            'REVIEW_JOURNAL_DIR': tmp_path
+        })
+
+    server = PreforkServer(make_write_behind_app, port=port, workers=1, threads=2, graceful_timeout=10)
+    master = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    master.start()
+    try:
+        assert get(port, '/api/v1/genres') == 200
+        with open(f'/proc/{master.pid}/task/{master.pid}/children') as children:
+            worker = int(children.read().split()[0])
+
+        # The journal the worker would leave behind, had it crashed before storing a review.
+        journal = tmp_path / 'review-journal-99999999.jsonl'
+        journal.write_text('{"seq": 1, "book_id": 1, "user_name": "thorke", "review_text": "Journaled", '
+                           '"rating": 4, "timestamp": "2021-10-01T10:00:00", "submission_id": "99999999-1"}\n')
+        with urllib.request.urlopen(f'http://localhost:{port}/api/v1/books/1') as response:
+            reviews = json.load(response)['review_count']
+        os.kill(worker, signal.SIGKILL)
+
+        deadline = time.monotonic() + 30
+        while journal.exists() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert not journal.exists()
+        assert get(port, '/api/v1/genres') == 200
+        with urllib.request.urlopen(f'http://localhost:{port}/api/v1/books/1') as response:
+            assert json.load(response)['review_count'] == reviews + 1
+    finally:
+        master.terminate()
+        master.join(20)
@@ -5,6 +5,8 @@ import pytest
 from library.authentication.services import AuthenticationException
 from library.book import services as book_services
 from library.authentication import services as auth_services
+from library.authentication.password_policy import PasswordPolicy
+from library.authentication.throttle import LoginThrottle
 from library.book.services import NonExistentBookException
 from library.domain.model import Author
 
@@ -52,6 +54,54 @@ def test_authentication_with_invalid_credentials(in_memory_repo):
         auth_services.authenticate_user(new_user_name, '0987654321', in_memory_repo)
 
 
+def test_login_returns_user(in_memory_repo):
+    auth_services.add_user('pmccartney', 'abcd1A23', in_memory_repo)
+
+    user_as_dict = auth_services.login('pmccartney', 'abcd1A23', in_memory_repo)
+    assert user_as_dict['user_name'] == 'pmccartney'
+
+    with pytest.raises(auth_services.AuthenticationException):
+        auth_services.login('pmccartney', '0987654321', in_memory_repo)
+
+    with pytest.raises(auth_services.UnknownUserException):
+        auth_services.login('nobody', 'abcd1A23', in_memory_repo)
+
+
+def test_login_upgrades_hash_made_under_old_policy(in_memory_repo):
+    old_policy = PasswordPolicy(iterations=1000)
+    new_policy = PasswordPolicy(iterations=2000)
+    auth_services.add_user('pmccartney', 'abcd1A23', in_memory_repo, old_policy)
+    assert in_memory_repo.get_user('pmccartney').password.startswith('pbkdf2:sha256:1000$')
+
+    # A failed login leaves the hash alone.
+    with pytest.raises(auth_services.AuthenticationException):
+        auth_services.login('pmccartney', '0987654321', in_memory_repo, new_policy)
+    assert in_memory_repo.get_user('pmccartney').password.startswith('pbkdf2:sha256:1000$')
+
+    auth_services.login('pmccartney', 'abcd1A23', in_memory_repo, new_policy)
+    password_hash = in_memory_repo.get_user('pmccartney').password
+    assert password_hash.startswith('pbkdf2:sha256:2000$')
+    assert not new_policy.needs_rehash(password_hash)
+
+    # The upgraded hash still verifies.
+    auth_services.login('pmccartney', 'abcd1A23', in_memory_repo, new_policy)
+
+
+def test_login_throttle():
+    throttle = LoginThrottle(rate=1, burst=2, ip_rate=60, ip_burst=4)
+
+    assert throttle.allow('thorke', '10.0.0.1')
+    assert throttle.allow('THORKE', '10.0.0.1')
+    assert not throttle.allow('thorke', '10.0.0.1')
+
+    # Other users, and the same user elsewhere, are unaffected.
+    assert throttle.allow('fmercury', '10.0.0.1')
+    assert throttle.allow('thorke', '10.0.0.2')
+
+    # But one address cannot try more than its own limit across user names.
+    assert not throttle.allow('someone', '10.0.0.1')
+
+
 def test_can_add_review(in_memory_repo):
     book_id = 1
     review_text = 'Not bad, good size'
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from library.authentication.session_store import FileSessionBackend, SqliteSessionBackend
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def session_backend(request, tmp_path):
+    if request.param == 'file':
+        return FileSessionBackend(tmp_path / 'sessions')
+    return SqliteSessionBackend(tmp_path / 'sessions.db')
+
+
+def test_session_backend_saves_and_loads(session_backend):
+    assert session_backend.load('abc') is None
+
+    session_backend.save('abc', '{"user_name": "thorke"}', time.time() + 60)
+    assert session_backend.load('abc') == '{"user_name": "thorke"}'
+
+    session_backend.save('abc', '{"user_name": "fmercury"}', time.time() + 60)
+    assert session_backend.load('abc') == '{"user_name": "fmercury"}'
+
+
+def test_session_backend_deletes(session_backend):
+    session_backend.save('abc', '{}', time.time() + 60)
+    session_backend.delete('abc')
+    assert session_backend.load('abc') is None
+
+    # Deleting an unknown session is not an error.
+    session_backend.delete('abc')
+
+
+def test_session_backend_ignores_expired_sessions(session_backend):
+    session_backend.save('abc', '{}', time.time() - 1)
+    assert session_backend.load('abc') is None
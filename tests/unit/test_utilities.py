@@ -0,0 +1,72 @@
+from flask import render_template_string
+from werkzeug.datastructures import Accept
+
+from library.utilities import compression
+from library.utilities.lru import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.evictions == 1
+
+
+def test_lru_cache_counts_hits_and_misses():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.hit_ratio == 0.5
+
+
+def test_lru_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('library.utilities.lru.time.monotonic', lambda: now[0])
+    cache = LRUCache(max_size=2, ttl=10)
+    cache.set('a', 1)
+
+    now[0] += 11
+    assert cache.get('a') is None
+
+
+def test_lru_cache_is_bounded_by_weight():
+    cache = LRUCache(max_size=10, max_weight=5, weigher=len)
+    cache.set('a', 'xxx')
+    cache.set('b', 'xxx')
+
+    assert 'a' not in cache
+    assert cache.weight == 3
+
+
+def test_fragment_cache_renders_block_once_per_version(client):
+    app = client.application
+    calls = []
+
+    with app.test_request_context('/'):
+        app.jinja_env.globals['count_call'] = lambda: calls.append(1) or len(calls)
+        template = "{% cache 'counter' %}{{ count_call() }}{% endcache %}"
+
+        assert render_template_string(template) == '1'
+        assert render_template_string(template) == '1'
+        assert app.extensions['fragment_cache'].cache.hits == 1
+
+
+def test_negotiate_encoding_prefers_highest_quality(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert compression.negotiate_encoding(Accept([('gzip', 1), ('br', 1)])) == 'gzip'
+    assert compression.negotiate_encoding(Accept([('*', 0.5)])) == 'gzip'
+    assert compression.negotiate_encoding(Accept([('gzip', 0)])) is None
+    assert compression.negotiate_encoding(Accept()) is None
+
+    monkeypatch.setattr(compression, 'brotli', object())
+    assert compression.negotiate_encoding(Accept([('gzip', 1), ('br', 1)])) == 'br'
+    assert compression.negotiate_encoding(Accept([('gzip', 1), ('br', 0.5)])) == 'gzip'
@@ -0,0 +1,67 @@
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from library.adapters.catalogue_import import CatalogueImporter, CatalogueImportException
+from library.adapters.database_population import prepare_database, CURRENT
+from library.adapters.database_repository import SqlAlchemyRepository
+
+from tests_db.conftest import TEST_DATA_PATH_DATABASE_LIMITED
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE_LIMITED, path)
+    return path
+
+
+def prepare(database_path, data_path):
+    engine = create_engine(f'sqlite:///{database_path}')
+    repository = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    return prepare_database(engine, data_path, repository), engine, repository
+
+
+def append(path, *lines):
+    with open(path, 'a', encoding='utf-8') as outfile:
+        outfile.write(''.join(line + '\n' for line in lines))
+
+
+def test_changes_are_imported_into_the_database(tmp_path, data_path):
+    action, engine, repository = prepare(tmp_path / 'library.db', data_path)
+    importer = CatalogueImporter(data_path, engine=engine)
+    version = repository.get_version().version
+
+    append(data_path / 'books.csv', '9001,2021,A Late Addition,1,1,Imported while running,https://example.com/9001.jpg,'
+                                    'Crime,Space Opera,')
+    append(data_path / 'reviews.csv', '1,9001,Worth the wait,5', '2,1,Better the second time,4')
+    summary = importer.import_changes(repository)
+
+    assert (summary['books'], summary['reviews']) == (1, 2)
+    repository.reset_session()
+    assert repository.get_version().version == version + 1
+    book = repository.get_book(9001)
+    assert sorted(genre.genre_name for genre in book.genres) == ['Crime', 'Space Opera']
+    assert book.rating_summary.review_count == 1
+    assert 9001 in repository.get_book_ids_for_genre('Space Opera')
+    assert repository.get_book(1).rating_summary.review_count == 2
+
+    # The fingerprints were recorded, so a restart finds the database current.
+    assert prepare(tmp_path / 'library.db', data_path)[0] == CURRENT
+
+
+def test_a_bad_row_leaves_the_database_unchanged(tmp_path, data_path):
+    action, engine, repository = prepare(tmp_path / 'library.db', data_path)
+    importer = CatalogueImporter(data_path, engine=engine)
+    reviews = len(repository.get_reviews())
+
+    append(data_path / 'books.csv', '9001,2021,A Late Addition,1,1,Imported while running,,Crime,,')
+    append(data_path / 'reviews.csv', '99,9001,By nobody,5')
+    with pytest.raises(CatalogueImportException):
+        importer.import_changes(repository)
+
+    repository.reset_session()
+    assert repository.get_book(9001) is None
+    assert len(repository.get_reviews()) == reviews
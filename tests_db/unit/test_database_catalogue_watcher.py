@@ -0,0 +1,40 @@
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import library.adapters.repository as repo
+from library.adapters.catalogue_watcher import CatalogueWatcher
+from library.adapters.database_population import prepare_database
+from library.adapters.database_repository import SqlAlchemyRepository
+
+from tests_db.conftest import TEST_DATA_PATH_DATABASE_LIMITED
+
+
+@pytest.fixture
+def database_repository(tmp_path):
+    data_path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE_LIMITED, data_path)
+    engine = create_engine(f'sqlite:///{tmp_path / "library.db"}')
+    repository = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    prepare_database(engine, data_path, repository)
+
+    previous, repo.repo_instance = repo.repo_instance, repository
+    yield data_path, engine, repository
+    repo.repo_instance = previous
+
+
+def test_changes_are_imported_into_the_database_in_place(database_repository):
+    data_path, engine, repository = database_repository
+    watcher = CatalogueWatcher(data_path, engine=engine)
+    version = repository.get_version().version
+
+    with open(data_path / 'books.csv', 'a', encoding='utf-8') as outfile:
+        outfile.write('9001,2021,A Late Addition,1,1,Loaded while running,,Crime,,\n')
+    assert watcher.check() is True
+
+    assert repo.repo_instance is repository
+    repository.reset_session()
+    assert repository.get_version().version == version + 1
+    assert repository.get_book(9001).title == 'A Late Addition'
@@ -0,0 +1,100 @@
+import shutil
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from library.adapters import database_population
+from library.adapters.database_population import prepare_database, RESET, UPDATED, CURRENT, ADOPTED
+from library.adapters.database_repository import SqlAlchemyRepository
+from library.adapters.orm import population_fingerprints_table
+
+from tests_db.conftest import TEST_DATA_PATH_DATABASE_LIMITED
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE_LIMITED, path)
+    return path
+
+
+def prepare(database_path, data_path, reset=False):
+    engine = create_engine(f'sqlite:///{database_path}')
+    repository = SqlAlchemyRepository(sessionmaker(autocommit=False, autoflush=True, bind=engine))
+    return prepare_database(engine, data_path, repository, reset=reset), engine
+
+
+def content(engine):
+    # What population put in the database, without the ids and timestamps it chose.
+    with engine.connect() as connection:
+        return {
+            'books': connection.execute('SELECT * FROM books ORDER BY book_id').fetchall(),
+            'authors': connection.execute('SELECT * FROM authors ORDER BY author_id').fetchall(),
+            'genres': connection.execute(
+                'SELECT book_id, genre_name FROM book_genres JOIN genres USING (genre_id) ORDER BY 1, 2').fetchall(),
+            'users': connection.execute('SELECT user_name FROM users ORDER BY 1').fetchall(),
+            'reviews': connection.execute(
+                'SELECT user_name, book_id, review_text, rating FROM reviews JOIN users USING (user_id) '
+                'ORDER BY 1, 2, 3, 4').fetchall(),
+            'summaries': connection.execute(
+                'SELECT book_id, review_count, rating_total FROM book_rating_summaries ORDER BY 1').fetchall(),
+        }
+
+
+def test_population_is_skipped_when_nothing_changed(tmp_path, data_path):
+    action, engine = prepare(tmp_path / 'library.db', data_path)
+    assert action == RESET
+    populated = content(engine)
+    assert len(populated['books']) > 0
+
+    action, engine = prepare(tmp_path / 'library.db', data_path)
+    assert action == CURRENT
+    assert content(engine) == populated
+
+
+def test_changed_files_are_upserted_as_a_full_population_would(tmp_path, data_path):
+    prepare(tmp_path / 'library.db', data_path)
+
+    books = (data_path / 'books.csv').read_text(encoding='utf-8').splitlines()
+    first_book = books[1].split(',')
+    first_book[2] = 'A New Title'
+    books[1] = ','.join(first_book)
+    books.append('999,2021,A Brand New Book,1,1,Just written,,Poetry,,')
+    (data_path / 'books.csv').write_text('\n'.join(books) + '\n', encoding='utf-8')
+    authors = (data_path / 'authors.csv').read_text(encoding='utf-8').rstrip('\n')
+    (data_path / 'authors.csv').write_text(authors + '\n999,A New Author\n', encoding='utf-8')
+    reviews = (data_path / 'reviews.csv').read_text(encoding='utf-8').rstrip('\n')
+    first_user = reviews.splitlines()[1].split(',')[0]
+    (data_path / 'reviews.csv').write_text(reviews + f'\n{first_user},999,A fine new book,5\n', encoding='utf-8')
+
+    action, engine = prepare(tmp_path / 'library.db', data_path)
+    assert action == UPDATED
+    updated = content(engine)
+
+    action, engine = prepare(tmp_path / 'fresh.db', data_path)
+    assert action == RESET
+    assert updated == content(engine)
+    assert (999, 'Poetry') in updated['genres']
+
+
+def test_schema_change_or_reset_repopulates(tmp_path, data_path):
+    _, engine = prepare(tmp_path / 'library.db', data_path)
+    with engine.begin() as connection:
+        connection.execute(population_fingerprints_table.update().where(
+            population_fingerprints_table.c.source == database_population.SCHEMA).values(digest='old schema'))
+
+    assert prepare(tmp_path / 'library.db', data_path)[0] == RESET
+    assert prepare(tmp_path / 'library.db', data_path, reset=True)[0] == RESET
+    assert prepare(tmp_path / 'library.db', data_path)[0] == CURRENT
+
+
+def test_databases_populated_without_fingerprints_are_adopted(tmp_path, data_path):
+    _, engine = prepare(tmp_path / 'library.db', data_path)
+    populated = content(engine)
+    population_fingerprints_table.drop(engine)
+
+    action, engine = prepare(tmp_path / 'library.db', data_path)
+    assert action == ADOPTED
+    assert content(engine) == populated
+    assert prepare(tmp_path / 'library.db', data_path)[0] == CURRENT
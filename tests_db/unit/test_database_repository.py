@@ -1,11 +1,32 @@
+from contextlib import contextmanager
 from datetime import date, datetime
 
 import pytest
+from sqlalchemy import event
 
 import library.adapters.repository as repo
+from library.adapters.caching_repository import CachingRepository
+from library.adapters import database_repository
 from library.adapters.database_repository import SqlAlchemyRepository
 from library.domain.model import User, Book, Genre, Review, make_review
 from library.adapters.repository import RepositoryException
+from library.book.services import books_to_dict
+
+
+@contextmanager
+def recorded_statements(session_factory):
+    # Collects the SQL statements sent to the database inside the with block.
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session_factory.kw['bind']
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
 
 
 def test_repository_can_add_a_user(session_factory):
@@ -28,6 +49,17 @@ def test_repository_can_retrieve_a_user(session_factory):
     assert user == User('fmercury', '8734gfe2058v')
 
 
+def test_repository_can_update_a_user(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    user = repo.get_user('fmercury')
+    user.password = 'pbkdf2:sha256:2000$salt$hash'
+    repo.update_user(user)
+
+    repo = SqlAlchemyRepository(session_factory)
+    assert repo.get_user('fmercury').password == 'pbkdf2:sha256:2000$salt$hash'
+
+
 def test_repository_does_not_retrieve_a_non_existent_user(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -150,6 +182,54 @@ def test_repository_can_get_books_by_ids(session_factory):
     assert books[2].title == 'Fair Game'
 
 
+def test_repository_gets_books_by_ids_in_requested_order_once(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    with recorded_statements(session_factory) as statements:
+        books = repo.get_books_by_id([6, 2, 6, 209, 5])
+        book_dicts = books_to_dict(books)
+
+    assert [book['book_id'] for book in book_dicts] == [6, 2, 5]
+    # The books, then their reviews, the reviews' users, genres, genres' books and rating summaries: one query each.
+    assert len(statements) == 6
+
+
+def test_repository_gets_books_by_ids_in_chunks(session_factory, monkeypatch):
+    monkeypatch.setattr(database_repository, 'MAX_BOUND_PARAMETERS', 2)
+    repo = SqlAlchemyRepository(session_factory)
+
+    books = repo.get_books_by_id([7, 3, 5, 1, 3])
+
+    assert [book.book_id for book in books] == [7, 3, 5, 1]
+
+
+def test_repository_iterates_books_in_batches(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    session = repo._session_cm.session
+
+    book_ids = []
+    largest_identity_map = 0
+    for book in repo.iter_books(after_id=2, batch_size=3):
+        book_ids.append(book.book_id)
+        largest_identity_map = max(largest_identity_map, len(session.identity_map))
+
+    assert book_ids == list(range(3, 21))
+    # Only the current batch (books, genres and rating summaries) is held at any time.
+    assert largest_identity_map < 20
+
+
+def test_iterating_books_leaves_the_rest_of_the_session_attached(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    session = repo._session_cm.session
+    user, book = repo.get_user('fmercury'), repo.get_book(1)
+
+    assert len([book for book in repo.iter_books(batch_size=3)]) == 20
+
+    assert user in session
+    assert book not in session
+    assert repo.get_user('fmercury') is user
+
+
 def test_repository_does_not_retrieve_book_for_non_existent_id(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -183,6 +263,15 @@ def test_repository_returns_an_empty_list_for_non_existent_genre(session_factory
     assert len(book_ids) == 0
 
 
+def test_repository_returns_book_ids_for_existing_author_and_publisher(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    assert repo.get_book_ids_for_author('James Reiner') == [1, 12, 16]
+    assert repo.get_book_ids_for_publisher('Penguin') == [1, 5, 7, 9]
+    assert repo.get_book_ids_for_author('United States') == []
+    assert repo.get_book_ids_for_publisher('United States') == []
+
+
 def test_repository_returns_date_of_previous_book(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -281,3 +370,85 @@ def test_can_retrieve_an_book_and_add_a_review_to_it(session_factory):
     assert review in book_fetched.reviews
     assert review in user_fetched.reviews
 
+
+
+def test_repository_version_increases_with_writes(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    version = repo.get_version()
+    assert version.version > 0
+
+    repo.add_genre(Genre('Motoring'))
+
+    assert repo.get_version().version == version.version + 1
+
+
+def test_repository_ranks_books_from_rating_summaries(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    most_reviewed = repo.get_most_reviewed_books(5)
+    counts = [book.rating_summary.review_count for book in most_reviewed]
+    assert counts == sorted(counts, reverse=True)
+    assert counts[0] == max(book.number_of_reviews for book in repo.get_all_books())
+
+    top_rated = repo.get_top_rated_books(5)
+    averages = [book.rating_summary.average_rating for book in top_rated]
+    assert averages == sorted(averages, reverse=True)
+
+
+def test_repository_can_rebuild_rating_summaries(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    before = [(book.book_id, book.rating_summary.review_count) for book in repo.get_most_reviewed_books(10)]
+
+    repo.rebuild_rating_summaries()
+    repo.reset_session()
+
+    assert [(book.book_id, book.rating_summary.review_count) for book in repo.get_most_reviewed_books(10)] == before
+
+
+def test_repository_detaches_and_attaches_books(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    book = repo.get_book(1)
+    snapshot = repo.detach(book)
+    repo.reset_session()
+
+    with recorded_statements(session_factory) as statements:
+        copy = repo.attach(snapshot)
+        assert copy is not snapshot
+        assert copy.title == book.title
+        assert [review.user.user_name for review in copy.reviews] == [review.user.user_name for review in book.reviews]
+        assert [genre.number_of_genre_books for genre in copy.genres] == \
+               [genre.number_of_genre_books for genre in book.genres]
+        assert copy.rating_summary.review_count == book.rating_summary.review_count
+    assert statements == []
+
+
+def test_caching_repository_over_database(session_factory):
+    repo = CachingRepository(SqlAlchemyRepository(session_factory))
+    number_of_reviews = repo.get_book(1).number_of_reviews
+    repo.reset_session()
+
+    # Served from the cache, as a copy in the new session.
+    book = repo.get_book(1)
+    assert repo.stats()['methods']['get_book']['hits'] == 1
+
+    user = repo.attach_user(repo.get_user('thorke'))
+    repo.add_review(make_review('Better the second time', user, book, 4))
+    repo.reset_session()
+
+    assert repo.get_book(1).number_of_reviews == number_of_reviews + 1
+
+
+def test_concurrent_reviews_are_all_counted_in_the_rating_summary(session_factory):
+    # Two repositories stand for two processes, each with a session of its own.
+    repo_a, repo_b = SqlAlchemyRepository(session_factory), SqlAlchemyRepository(session_factory)
+    book_a, book_b = repo_a.get_book(1), repo_b.get_book(1)
+    review_count = book_a.rating_summary.review_count
+    assert book_b.rating_summary.review_count == review_count
+
+    repo_a.add_review(make_review('First', repo_a.get_user('fmercury'), book_a, 5))
+    repo_b.add_review(make_review('Second', repo_b.get_user('fmercury'), book_b, 1))
+
+    repo_a.reset_session()
+    summary = repo_a.get_book(1).rating_summary
+    assert summary.review_count == review_count + 2
+    assert summary.histogram[5] >= 1 and summary.histogram[1] >= 1
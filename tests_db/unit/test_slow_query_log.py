@@ -0,0 +1,94 @@
+import logging
+
+from flask import Flask
+
+from library.adapters.database_repository import SqlAlchemyRepository
+from library.adapters.slow_query_log import SlowQueryLog, normalise, REDACTED
+from library.domain.model import User
+
+
+def test_normalise_merges_statements_differing_in_literals():
+    assert normalise("SELECT * FROM books\n  WHERE release_year = 2001 AND title = 'It''s'") == \
+        'SELECT * FROM books WHERE release_year = ? AND title = ?'
+    assert normalise('SELECT * FROM books WHERE book_id IN (?, ?, ?)') == \
+        normalise('SELECT * FROM books WHERE book_id IN (?,?)') == \
+        'SELECT * FROM books WHERE book_id IN (?, ...)'
+    assert normalise('SELECT anon_1.book_id FROM anon_1') == 'SELECT anon_1.book_id FROM anon_1'
+
+
+def test_slow_statements_are_logged_with_method_and_plan(session_factory, caplog):
+    engine = session_factory.kw['bind']
+    slow_query_log = SlowQueryLog(threshold=0)  # Every statement is slow.
+    slow_query_log.install(engine)
+    repository = SqlAlchemyRepository(session_factory)
+    try:
+        with caplog.at_level(logging.WARNING, logger='library.adapters.slow_query_log'):
+            repository.get_books_by_release_year(2016)
+            repository.get_books_by_release_year(1997)
+            repository.get_book_ids_for_genre('Comics & Graphic Novels')
+    finally:
+        slow_query_log.uninstall(engine)
+
+    entries = slow_query_log.top()
+    by_method = {method: entry for entry in entries for method in entry.methods}
+    assert {'get_books_by_release_year', 'get_book_ids_for_genre'} <= set(by_method)
+
+    release_year = by_method['get_books_by_release_year']
+    assert release_year.count == 2
+    assert release_year.methods == {'get_books_by_release_year': 2}
+    assert 'books.release_year = ?' in release_year.statement
+    assert 'books' in release_year.plan
+
+    assert any('method=get_book_ids_for_genre' in record.getMessage() for record in caplog.records)
+    report = slow_query_log.report()
+    assert release_year.statement in report
+    assert f'plan: {release_year.plan}' in report
+
+
+def test_fast_statements_are_not_recorded(session_factory):
+    engine = session_factory.kw['bind']
+    slow_query_log = SlowQueryLog(threshold=60)
+    slow_query_log.install(engine)
+    try:
+        SqlAlchemyRepository(session_factory).get_books_by_release_year(2016)
+    finally:
+        slow_query_log.uninstall(engine)
+
+    assert slow_query_log.top() == []
+
+
+def test_parameters_of_writes_to_users_are_not_kept(session_factory, caplog):
+    engine = session_factory.kw['bind']
+    slow_query_log = SlowQueryLog(threshold=0)
+    slow_query_log.install(engine)
+    try:
+        with caplog.at_level(logging.WARNING, logger='library.adapters.slow_query_log'):
+            SqlAlchemyRepository(session_factory).add_user(User('newcomer', 'pbkdf2:sha256:secret-hash'))
+    finally:
+        slow_query_log.uninstall(engine)
+
+    entry = next(entry for entry in slow_query_log.top() if entry.statement.startswith('INSERT INTO users'))
+    assert entry.parameters == REDACTED
+    assert 'secret-hash' not in slow_query_log.report()
+    assert not any('secret-hash' in record.getMessage() for record in caplog.records)
+
+
+def test_report_requires_the_token(session_factory):
+    engine = session_factory.kw['bind']
+    apps = list()
+    for token in ('slow-query-token', ''):
+        app = Flask(__name__)
+        app.config['SLOW_QUERY_TOKEN'] = token
+        slow_query_log = SlowQueryLog()
+        slow_query_log.init_app(app, engine)
+        slow_query_log.uninstall(engine)
+        apps.append(app.test_client())
+    client, client_without_token = apps
+
+    assert client.get('/debug/slow-queries').status_code == 401
+    assert client.get('/debug/slow-queries', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/debug/slow-queries', headers={'Authorization': 'Bearer slow-query-token'})
+    assert response.status_code == 200
+    assert b'Slow statements' in response.data
+    # Without a token the report is not served.
+    assert client_without_token.get('/debug/slow-queries').status_code == 404